@@ -0,0 +1,311 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+from PIL import features
+
+from metrics import counter, gauge, span
+from placement import get_placer
+from frames import frame_geometry, frame_save_options, regions_bounding_box, FRAME_INFO_KEY
+
+logger = logging.getLogger(__name__)
+
+# Default archive settings (can be changed with configure_archiver)
+ARCHIVE_FORMAT = "png"  # Lossless; "webp" or "jpeg" trade exact pixels for much smaller files
+ARCHIVE_QUALITY = 80  # WebP/JPEG quality (0-100), only used when a lossy format is chosen
+PNG_COMPRESS_LEVEL = 6  # PNG zlib level (0-9); higher is smaller but slower
+CROP_TO_REGIONS = True  # Keep only the union of the OCR regions instead of the whole capture
+ARCHIVE_SCALE = 1.0  # Downscale factor applied before encoding (1.0 keeps full resolution)
+ARCHIVE_QUEUE_SIZE = 8  # Screenshots waiting to be written before submit() blocks
+SUBMIT_TIMEOUT = 2  # Seconds submit() may block on a full queue before the screenshot is dropped
+RETENTION_DAYS = None  # Archived screenshots older than this are deleted (None keeps them forever)
+MAX_ARCHIVE_MB = None  # Oldest screenshots are deleted above this total size (None disables the cap)
+FSYNC_BATCH = 10  # Files written before they are fsynced together
+FSYNC_INTERVAL = 5  # Seconds a written file may wait for its fsync
+RETENTION_CHECK_INTERVAL = 3600  # Seconds between full rescans of the archive folder
+
+# Names of the files the archiver wrote, one per line; only these are ever deleted
+ARCHIVE_MANIFEST = "archived_screenshots.txt"
+ARCHIVE_EXTENSIONS = {"webp": ".webp", "jpeg": ".jpg", "png": ".png"}
+
+_STOP = object()
+
+_written = counter("archive_written_total", "Screenshots written to the archive")
+_dropped = counter("archive_dropped_total", "Screenshots dropped because the archive writer fell behind")
+_deleted = counter("archive_deleted_total", "Archived screenshots deleted by the retention policy")
+_queue_depth = gauge("archive_queue_depth", "Screenshots waiting for the archive writer")
+_archive_bytes = gauge("archive_bytes", "Total size of the archived screenshots")
+
+
+def archive_format(image_format):
+    """Normalize a format name, falling back to PNG when Pillow was built without WebP"""
+    image_format = image_format.lower()
+    if image_format == "jpg":
+        image_format = "jpeg"
+    if image_format not in ARCHIVE_EXTENSIONS:
+        raise ValueError(f"Unknown archive format: {image_format}")
+    if image_format == "webp" and not features.check("webp"):
+        logger.warning("Pillow has no WebP support, archiving screenshots as PNG")
+        return "png"
+    return image_format
+
+
+def prepare_screenshot(screenshot, crop_to_regions=CROP_TO_REGIONS, scale=ARCHIVE_SCALE, rois=None):
+    """Crop to the OCR regions (rois, default ROIS) and/or downscale, keeping the frame geometry the ROIs need"""
+    offset_x, offset_y, frame_width, frame_height = frame_geometry(screenshot)
+    image = screenshot
+    if crop_to_regions:
+        left, top, right, bottom = regions_bounding_box(frame_width, frame_height, rois)
+        box = (max(0, left - offset_x), max(0, top - offset_y),
+               min(image.width, right - offset_x), min(image.height, bottom - offset_y))
+        if box != (0, 0, image.width, image.height) and box[2] > box[0] and box[3] > box[1]:
+            image = image.crop(box)
+            offset_x += box[0]
+            offset_y += box[1]
+    if scale and scale != 1.0:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, resample=3)  # Bicubic keeps small text legible
+        offset_x, offset_y = round(offset_x * scale), round(offset_y * scale)
+        frame_width, frame_height = round(frame_width * scale), round(frame_height * scale)
+    if image is screenshot:
+        return screenshot
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    image.info[FRAME_INFO_KEY] = (offset_x, offset_y, frame_width, frame_height)
+    return image
+
+
+class ScreenshotArchiver:
+    """Writes reference screenshots on a background thread with retention and size limits"""
+
+    def __init__(self, directory, image_format=ARCHIVE_FORMAT, quality=ARCHIVE_QUALITY,
+                 png_compress_level=PNG_COMPRESS_LEVEL, crop_to_regions=CROP_TO_REGIONS, scale=ARCHIVE_SCALE,
+                 queue_size=ARCHIVE_QUEUE_SIZE, submit_timeout=SUBMIT_TIMEOUT, retention_days=RETENTION_DAYS,
+                 max_mb=MAX_ARCHIVE_MB, fsync_batch=FSYNC_BATCH, fsync_interval=FSYNC_INTERVAL, rois=None):
+        self.directory = directory
+        self.image_format = archive_format(image_format)
+        self.quality = quality
+        self.png_compress_level = png_compress_level
+        self.crop_to_regions = crop_to_regions
+        self.scale = scale
+        self.rois = rois
+        self.submit_timeout = submit_timeout
+        self.retention_days = retention_days
+        self.max_bytes = max_mb * 1024 * 1024 if max_mb else None
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._unsynced = []  # Paths written since the last fsync
+        self._first_unsynced = None
+        self._files = {}  # path -> (mtime, size) of the screenshots this archiver wrote
+        self._last_retention = 0
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="screenshot-archiver", daemon=True)
+        self._thread.start()
+
+    def extension(self):
+        return ARCHIVE_EXTENSIONS[self.image_format]
+
+    def submit(self, screenshot, name):
+        """Queue a screenshot to be saved as <name><extension>; returns the path, or None if dropped
+
+        A name already taken (e.g. two screenshots in the same second) gets a "_2", "_3", ... suffix.
+        """
+        filename = name + self.extension()
+        path = get_placer().reserve(self.directory, filename)
+        try:
+            self._queue.put((screenshot, filename, path), timeout=self.submit_timeout)
+        except queue.Full:
+            get_placer().release(path)
+            _dropped.inc()
+            logger.warning("Archive writer is behind, screenshot not saved: %s", path)
+            return None
+        _queue_depth.set(self._queue.qsize())
+        return path
+
+    def _run(self):
+        self._apply_retention(rescan=True)
+        while True:
+            timeout = None
+            if self._unsynced:
+                timeout = max(0.0, self._first_unsynced + self.fsync_interval - time.time())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._sync()
+                continue
+            _queue_depth.set(self._queue.qsize())
+            if item is _STOP:
+                break
+            screenshot, filename, path = item
+            try:
+                self._write(screenshot, filename, path)
+            except Exception as e:
+                logger.error("Error saving screenshot %s: %s", path, e)
+            if len(self._unsynced) >= self.fsync_batch:
+                self._sync()
+        self._sync()
+
+    def _write(self, screenshot, filename, path):
+        with span("archive_write", labels={"format": self.image_format}, file=path):
+            image = prepare_screenshot(screenshot, self.crop_to_regions, self.scale, self.rois)
+            options = frame_save_options(image, self.image_format)
+            if self.image_format == "png":
+                options["compress_level"] = self.png_compress_level
+            else:
+                options["quality"] = self.quality
+                if self.image_format == "webp":
+                    options["method"] = 4  # Encoder effort: a balance between speed and size
+            try:
+                f = open(path, "xb")
+            except FileExistsError:
+                # Created by another process since it was reserved: take the next free name
+                f = get_placer().create(self.directory, filename)
+                path = f.name
+            except Exception:
+                get_placer().release(path)
+                raise
+            try:
+                # Closed right away: an open handle would block deleting or renaming it on Windows
+                with f:
+                    image.save(f, format=self.image_format.upper(), **options)
+                    size = f.tell()
+            except Exception:
+                os.remove(path)
+                get_placer().release(path)
+                raise
+        with open(self._manifest_path(), "a", encoding="utf-8") as f:
+            f.write(os.path.basename(path) + "\n")
+        if not self._unsynced:
+            self._first_unsynced = time.time()
+        self._unsynced.append(path)
+        self._files[path] = (time.time(), size)
+        _written.inc()
+        logger.info("Screenshot saved to: %s", path)
+
+    def _sync(self):
+        """fsync every file written since the last batch, then apply the retention policy"""
+        if not self._unsynced:
+            return
+        with span("archive_fsync", files=len(self._unsynced)):
+            for path in self._unsynced + [self._manifest_path()]:
+                try:
+                    _fsync_path(path)
+                except OSError as e:
+                    logger.warning("Could not fsync %s: %s", path, e)
+            self._unsynced = []
+            if hasattr(os, "O_DIRECTORY"):
+                # Make the new directory entries durable too (not possible on Windows)
+                fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+        self._apply_retention(rescan=time.time() - self._last_retention > RETENTION_CHECK_INTERVAL)
+
+    def _manifest_path(self):
+        return os.path.join(self.directory, ARCHIVE_MANIFEST)
+
+    def _scan(self):
+        """Stat the files listed in the manifest; anything else in the folder is never touched"""
+        files = {}
+        try:
+            with open(self._manifest_path(), encoding="utf-8") as f:
+                names = [line.strip() for line in f]
+        except FileNotFoundError:
+            return files
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if not name or path in files:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files[path] = (stat.st_mtime, stat.st_size)
+        return files
+
+    def _write_manifest(self):
+        """Rewrite the manifest with the files still archived"""
+        tmp_path = self._manifest_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for path in self._files:
+                f.write(os.path.basename(path) + "\n")
+        os.replace(tmp_path, self._manifest_path())
+
+    def _apply_retention(self, rescan=False):
+        """Delete screenshots past the retention age, then the oldest ones above the size cap"""
+        try:
+            if rescan:
+                self._files = self._scan()
+                self._write_manifest()
+                self._last_retention = time.time()
+            expired = []
+            if self.retention_days:
+                cutoff = time.time() - self.retention_days * 86400
+                expired = [path for path, (mtime, _) in self._files.items() if mtime < cutoff]
+            total = sum(size for _, size in self._files.values())
+            if self.max_bytes and total > self.max_bytes:
+                expired_set = set(expired)
+                total -= sum(self._files[path][1] for path in expired)
+                for path, (_, size) in sorted(self._files.items(), key=lambda item: item[1][0]):
+                    if total <= self.max_bytes:
+                        break
+                    if path not in expired_set:
+                        expired.append(path)
+                        total -= size
+            for path in expired:
+                try:
+                    os.remove(path)
+                    _deleted.inc()
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning("Could not delete old screenshot %s: %s", path, e)
+                    continue
+                self._files.pop(path, None)
+            if expired:
+                self._write_manifest()
+                logger.info("Deleted %d old screenshots from the archive", len(expired))
+            _archive_bytes.set(sum(size for _, size in self._files.values()))
+        except Exception as e:
+            logger.error("Error applying the screenshot retention policy: %s", e)
+
+    def close(self, timeout=None):
+        """Write everything still queued, fsync it and stop the writer thread"""
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+
+def _fsync_path(path):
+    """fsync a closed file by reopening it (Windows only flushes handles opened for writing)"""
+    fd = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+_archiver = None
+
+
+def configure_archiver(directory, **settings):
+    """Start the shared archiver (directory=None disables it, so callers save synchronously)"""
+    global _archiver
+    close_archiver()
+    _archiver = ScreenshotArchiver(directory, **settings) if directory else None
+    return _archiver
+
+
+def get_archiver():
+    return _archiver
+
+
+def close_archiver(timeout=None):
+    global _archiver
+    if _archiver is not None:
+        _archiver.close(timeout)
+        _archiver = None
@@ -0,0 +1,121 @@
+import logging
+import os
+
+from PIL import Image
+
+from metrics import counter, span
+from screenshot_extract import extract_regions_lazy, parse_fields, to_grayscale
+
+logger = logging.getLogger(__name__)
+
+# Attachments are usually bank transfer receipts that already show the amount,
+# reference, account and status, so those fields are read from the file itself
+# and only what is missing (typically the contact name) needs the chat window.
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff")
+PDF_EXTENSIONS = (".pdf",)
+
+# Receipt regions as percentages of the attachment: the upper part usually holds the
+# amount and status, the lower part the reference, account and date
+RECEIPT_ROIS = {
+    'receipt_summary': {
+        'top': 0.0,
+        'left': 0.0,
+        'bottom': 0.5,
+        'right': 1.0
+    },
+    'receipt_details': {
+        'top': 0.45,
+        'left': 0.0,
+        'bottom': 1.0,
+        'right': 1.0
+    }
+}
+# Regions in the order they are OCR'd; the second is skipped once the required fields are found
+RECEIPT_STAGES = [('receipt_summary',), ('receipt_details',)]
+# Fields a receipt may contain; the details region is only skipped once all of them are found
+RECEIPT_REQUIRED_FIELDS = ('amount', 'account', 'reference', 'status', 'date_time')
+
+PDF_DPI = 200  # Resolution scanned PDF pages are rendered at
+MIN_TEXT_LAYER_CHARS = 20  # A PDF with less text than this is treated as a scan and OCR'd
+MAX_ATTACHMENT_PIXELS = 12_000_000  # Larger images are downscaled before OCR
+
+_results = counter("attachment_extractions_total", "Attachments read for transaction fields, by result")
+
+
+def is_supported_attachment(path):
+    """True if the file is an image or PDF the attachment extraction can read"""
+    return path.lower().endswith(IMAGE_EXTENSIONS + PDF_EXTENSIONS)
+
+
+def _load_pdf(path):
+    """Return (first page image, None), or (None, text) when the PDF has a usable text layer"""
+    try:
+        import fitz  # PyMuPDF
+    except ImportError:
+        fitz = None
+    if fitz is not None:
+        with fitz.open(path) as document:
+            page = document[0]
+            text = page.get_text()
+            if len(text.strip()) >= MIN_TEXT_LAYER_CHARS:
+                return None, text
+            pixmap = page.get_pixmap(dpi=PDF_DPI, colorspace=fitz.csGRAY)
+            return Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples), None
+
+    try:
+        import pypdfium2
+    except ImportError:
+        raise RuntimeError("Reading PDF attachments needs PyMuPDF or pypdfium2") from None
+    document = pypdfium2.PdfDocument(path)
+    try:
+        page = document[0]
+        text = page.get_textpage().get_text_range()
+        if len(text.strip()) >= MIN_TEXT_LAYER_CHARS:
+            return None, text
+        return page.render(scale=PDF_DPI / 72, grayscale=True).to_pil(), None
+    finally:
+        document.close()
+
+
+def load_attachment(path):
+    """Decode an attachment into (image, None) or, for PDFs with a text layer, (None, text)"""
+    if path.lower().endswith(PDF_EXTENSIONS):
+        return _load_pdf(path)
+    with Image.open(path) as image:
+        # Only the first frame of animated or multi-page images is read
+        image.draft("L", (image.width, image.height))
+        image = image.convert("L")
+    pixels = image.width * image.height
+    if pixels > MAX_ATTACHMENT_PIXELS:
+        scale = (MAX_ATTACHMENT_PIXELS / pixels) ** 0.5
+        image = image.resize((int(image.width * scale), int(image.height * scale)), resample=3)
+    return image, None
+
+
+def extract_fields_from_attachment(path, engine=None):
+    """Read the transaction fields from a receipt image or PDF; returns field -> (value, start, end)
+
+    Returns None when the file cannot be read, so the caller falls back to the screenshot.
+    engine replaces the default field rules.
+    """
+    if not is_supported_attachment(path):
+        _results.inc(result="unsupported")
+        return None
+    try:
+        with span("attachment_extract", file=path):
+            image, text = load_attachment(path)
+            spans = None
+            if text is None:
+                text, spans = extract_regions_lazy(image, to_grayscale(image), rois=RECEIPT_ROIS,
+                                                   stages=RECEIPT_STAGES, required=RECEIPT_REQUIRED_FIELDS,
+                                                   engine=engine)
+            logger.debug("Attachment text: %r", text)
+            fields = parse_fields(text, spans, engine)
+    except Exception as e:
+        logger.error("Error reading attachment %s: %s", path, e)
+        _results.inc(result="error")
+        return None
+    _results.inc(result="found" if fields else "empty")
+    logger.info("Read %s from attachment %s", ", ".join(fields) or "no fields", os.path.basename(path))
+    return fields
@@ -0,0 +1,286 @@
+"""Re-run screenshot extraction over archived screenshots without Viber.
+
+Usage:
+    python batch_replay.py SCREENSHOT_DIR [--attachments DIR] [--output results.jsonl]
+                           [--format jsonl|csv] [--workers N] [--apply]
+    python batch_replay.py ATTACHMENT_DIR --source attachments [--apply] ...
+
+With --source attachments the receipts themselves are OCR'd, so a backlog of
+downloads can be renamed without any screenshots.
+
+Runs headless: only OpenCV, Pillow and Tesseract are needed, never win32gui or pyautogui.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".webp")
+
+# Screenshots saved by rename_file are named "<attachment name>_screenshot_<YYYYmmdd_HHMMSS>.png" after
+# the attachment's final name (including its own "_2", "_3", ... suffix), plus a suffix of their own
+# when two were saved in the same second
+SCREENSHOT_NAME_PATTERN = re.compile(r"^(?P<prefix>.+)_screenshot_\d{8}_\d{6}(?:_\d+)?$")
+
+RESULT_FIELDS = ["screenshot", "attachment", "contact_name", "details", "date_time", "new_name", "status", "elapsed_ms"]
+
+
+def find_screenshots(screenshot_dir):
+    """List the saved screenshots in a directory, skipping the debug region dumps"""
+    paths = []
+    for entry in sorted(os.scandir(screenshot_dir), key=lambda e: e.name):
+        if not entry.is_file() or entry.name.startswith("debug_"):
+            continue
+        if entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            paths.append(entry.path)
+    return paths
+
+
+def index_attachments(attachment_dir):
+    """Map attachment name stems to their paths so screenshots can be paired with them"""
+    attachments = {}
+    if not attachment_dir:
+        return attachments
+    for entry in os.scandir(attachment_dir):
+        if entry.is_file():
+            attachments[os.path.splitext(entry.name)[0]] = entry.path
+    return attachments
+
+
+def pair_attachment(screenshot_path, attachments):
+    """Find the attachment that was renamed alongside this screenshot"""
+    stem = os.path.splitext(os.path.basename(screenshot_path))[0]
+    match = SCREENSHOT_NAME_PATTERN.match(stem)
+    if not match:
+        return None
+    return attachments.get(match.group("prefix"))
+
+
+def pair_screenshots(screenshots, attachments):
+    """Pair every screenshot with its attachment; returns [(screenshot, attachment or None)]
+
+    An attachment claimed by more than one screenshot (e.g. screenshots saved by older
+    versions before the attachment's name got a suffix) is paired with none of them,
+    so --apply never renames a file on an ambiguous match.
+    """
+    pairs = [(path, pair_attachment(path, attachments)) for path in screenshots]
+    claimed = {}
+    for _, attachment in pairs:
+        if attachment:
+            claimed[attachment] = claimed.get(attachment, 0) + 1
+    for attachment, count in claimed.items():
+        if count > 1:
+            logger.warning("%d screenshots match %s, leaving it unpaired", count, attachment)
+    return [(path, attachment if attachment and claimed[attachment] == 1 else None) for path, attachment in pairs]
+
+
+def find_attachments(attachment_dir):
+    """List the attachments in a directory that can be read directly (images and PDFs)"""
+    from attachment_extract import is_supported_attachment
+
+    return [entry.path for entry in sorted(os.scandir(attachment_dir), key=lambda e: e.name)
+            if entry.is_file() and is_supported_attachment(entry.name)]
+
+
+def _init_worker(tesseract_cmd, engine, log_level="WARNING", rules_file=None, ocr_profiles_file=None):
+    """Process pool initializer: one single-threaded OCR engine per process"""
+    from field_rules import configure_rules
+    from ocr_engine import configure_ocr_profiles, configure_pool, set_tesseract_cmd
+
+    # Extraction logs go to stderr; keep stdout free for the result rows
+    logging.basicConfig(level=log_level, stream=sys.stderr, format="%(levelname)s %(name)s: %(message)s")
+    if tesseract_cmd:
+        set_tesseract_cmd(tesseract_cmd)
+    # Parallelism comes from the processes, so keep each one to a single OCR worker
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    configure_pool(size=1, engine=engine)
+    configure_rules(path=rules_file)
+    configure_ocr_profiles(path=ocr_profiles_file)
+
+
+def process_screenshot(job):
+    """Worker: run region extraction, OCR and field parsing on one saved screenshot"""
+    from PIL import Image
+    from screenshot_extract import extract_info_from_screenshot, build_new_name
+
+    screenshot_path, attachment_path = job
+    result = {"screenshot": screenshot_path, "attachment": attachment_path or ""}
+    start = time.perf_counter()
+    try:
+        with Image.open(screenshot_path) as image:
+            screenshot = image.convert("RGB")
+        contact_name, details_str, date_time = extract_info_from_screenshot(screenshot)
+        extension = os.path.splitext(attachment_path)[1] if attachment_path else ""
+        result.update({
+            "contact_name": contact_name,
+            "details": details_str,
+            "date_time": date_time,
+            "new_name": build_new_name(contact_name, details_str, date_time, extension) if attachment_path else "",
+            "status": "ok",
+        })
+    except Exception as e:
+        result.update({"contact_name": "", "details": "", "date_time": "", "new_name": "", "status": f"error: {e}"})
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+def process_attachment(job):
+    """Worker: read the transaction fields from the attachment itself"""
+    from attachment_extract import extract_fields_from_attachment
+    from screenshot_extract import finish_extraction, build_new_name
+
+    _, attachment_path = job
+    result = {"screenshot": "", "attachment": attachment_path}
+    start = time.perf_counter()
+    fields = extract_fields_from_attachment(attachment_path)
+    if fields is None:
+        result.update({"contact_name": "", "details": "", "date_time": "", "new_name": "",
+                       "status": "error: attachment could not be read"})
+    else:
+        contact_name, details_str, date_time = finish_extraction(fields)
+        result.update({
+            "contact_name": contact_name,
+            "details": details_str,
+            "date_time": date_time,
+            "new_name": build_new_name(contact_name, details_str, date_time, os.path.splitext(attachment_path)[1]),
+            "status": "ok",
+        })
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+def apply_rename(result, output_dir=None):
+    """Rename the paired attachment to the newly extracted name, never overwriting
+    (a taken name gets a "_2", "_3", ... suffix, and new_name is updated to the name used)"""
+    from placement import place_file
+
+    attachment = result["attachment"]
+    if not attachment or not result["new_name"] or result["status"] != "ok":
+        return "skipped"
+    target_dir = output_dir or os.path.dirname(attachment)
+    new_path = os.path.join(target_dir, result["new_name"])
+    if os.path.abspath(new_path) == os.path.abspath(attachment):
+        return "unchanged"
+    try:
+        new_path = place_file(attachment, target_dir, result["new_name"])
+    except OSError as e:
+        return f"error: {e}"
+    result["new_name"] = os.path.basename(new_path)
+    return "renamed"
+
+
+class ResultWriter:
+    """Writes result rows as JSON lines or CSV, to a file or stdout"""
+
+    def __init__(self, output, fmt):
+        self._file = open(output, "w", newline="", encoding="utf-8") if output and output != "-" else sys.stdout
+        self._fmt = fmt
+        self._csv = None
+        if fmt == "csv":
+            self._csv = csv.DictWriter(self._file, fieldnames=RESULT_FIELDS + ["action"], extrasaction="ignore")
+            self._csv.writeheader()
+
+    def write(self, row):
+        if self._csv:
+            self._csv.writerow(row)
+        else:
+            self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not sys.stdout:
+            self._file.close()
+
+
+def _record_results(results, writer, summary, apply, output_dir):
+    """Count, optionally apply and write each result as it arrives"""
+    for result in results:
+        if result["status"] == "ok":
+            summary["ok"] += 1
+        else:
+            summary["errors"] += 1
+        if apply:
+            result["action"] = apply_rename(result, output_dir)
+            if result["action"] == "renamed":
+                summary["renamed"] += 1
+        else:
+            result["action"] = "dry-run"
+        writer.write(result)
+
+
+def run_batch(screenshot_dir, attachment_dir=None, output=None, fmt="jsonl", workers=None,
+              apply=False, output_dir=None, tesseract_cmd=None, engine="auto", log_level="WARNING",
+              source="screenshots", rules_file=None, ocr_profiles_file=None):
+    """Process every screenshot (or, with source="attachments", every attachment) in screenshot_dir
+    across a process pool; returns a summary dict"""
+    if source == "attachments":
+        jobs = [(None, path) for path in find_attachments(screenshot_dir)]
+        worker = process_attachment
+    else:
+        screenshots = find_screenshots(screenshot_dir)
+        attachments = index_attachments(attachment_dir)
+        jobs = pair_screenshots(screenshots, attachments)
+        worker = process_screenshot
+    workers = workers or os.cpu_count() or 1
+
+    print(f"Processing {len(jobs)} {source} with {workers} workers "
+          f"({'apply' if apply else 'dry-run'} mode)", file=sys.stderr)
+
+    summary = {"total": len(jobs), "ok": 0, "errors": 0, "renamed": 0}
+    writer = ResultWriter(output, fmt)
+    start = time.perf_counter()
+    initargs = (tesseract_cmd, engine, log_level, rules_file, ocr_profiles_file)
+    try:
+        if workers == 1:
+            # A single worker runs in this process instead of starting a pool
+            _init_worker(*initargs)
+            _record_results(map(worker, jobs), writer, summary, apply, output_dir)
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+                # map keeps the input order so the output lines up with the directory listing
+                _record_results(executor.map(worker, jobs, chunksize=4), writer, summary, apply, output_dir)
+    finally:
+        writer.close()
+
+    summary["seconds"] = round(time.perf_counter() - start, 2)
+    print(f"Done: {summary}", file=sys.stderr)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-run OCR extraction over archived Viber screenshots")
+    parser.add_argument("screenshot_dir", help="Directory of saved screenshots (or attachments with --source attachments)")
+    parser.add_argument("--source", choices=["screenshots", "attachments"], default="screenshots",
+                        help="Read the fields from saved screenshots or from the attachments themselves")
+    parser.add_argument("--attachments", help="Directory of attachments to pair with the screenshots")
+    parser.add_argument("--output", "-o", help="Output file (default: stdout)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="Output format (default: from extension, else jsonl)")
+    parser.add_argument("--workers", "-j", type=int, help="Number of worker processes (default: all cores)")
+    parser.add_argument("--apply", action="store_true", help="Rename paired attachments (default is a dry run)")
+    parser.add_argument("--output-dir", help="Move renamed attachments here instead of renaming in place")
+    parser.add_argument("--tesseract-cmd", help="Path to the tesseract executable")
+    parser.add_argument("--engine", default="auto", choices=["auto", "tesserocr", "pytesseract"], help="OCR engine")
+    parser.add_argument("--rules", help="JSON file with extra or replacement field rules")
+    parser.add_argument("--ocr-profiles", help="JSON file with Tesseract settings per region (see ocr_tuning.py)")
+    parser.add_argument("--log-level", default="WARNING", help="Logging level for extraction messages (default: WARNING)")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.output and args.output.lower().endswith(".csv") else "jsonl")
+    if args.apply and not args.attachments and args.source == "screenshots":
+        parser.error("--apply needs --attachments")
+
+    summary = run_batch(args.screenshot_dir, args.attachments, args.output, fmt, args.workers,
+                        args.apply, args.output_dir, args.tesseract_cmd, args.engine, args.log_level.upper(), args.source, args.rules,
+                        args.ocr_profiles)
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,404 @@
+"""Latency and accuracy benchmark for the screenshot-to-filename pipeline.
+
+Usage:
+    python benchmark.py [--corpus DIR] [--output results.json] [--compare baseline.json]
+    python benchmark.py --generate-corpus DIR
+
+Without --corpus a golden corpus of synthetic Viber-like screenshots is rendered
+in memory at several resolutions. A labeled corpus directory contains images plus
+a labels.jsonl file with one {"image": ..., "contact_name": ..., "amount": ...,
+"account": ..., "reference": ..., "date": ...} object per line.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from PIL import Image, ImageDraw, ImageFont
+
+RESOLUTIONS = [(1366, 768), (1920, 1080), (2560, 1440), (3840, 2160)]
+SAMPLES_PER_RESOLUTION = 5
+FIELDS = ["contact_name", "amount", "account", "reference", "date"]
+LABELS_FILE = "labels.jsonl"
+
+# Default regression tolerances used by --compare
+LATENCY_TOLERANCE = 0.20  # 20% slower p50/p95 counts as a regression
+ACCURACY_TOLERANCE = 0.02  # Losing more than 2 points of field accuracy counts as a regression
+
+CONTACT_FIRST = ["Hardware", "Traders", "Enterprise", "Store", "Holdings"]
+CONTACT_SECOND = ["JanavareeMagu", "Majeedhee", "Hulhumale", "Orchid", "Boduthakurufaanu"]
+FONT_CANDIDATES = ["arial.ttf", "DejaVuSans.ttf", "LiberationSans-Regular.ttf", "FreeSans.ttf"]
+
+
+def _load_font(size):
+    for name in FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only has the small bitmap font
+        return ImageFont.load_default()
+
+
+def make_sample(rng, index):
+    """Create the expected fields for one synthetic conversation"""
+    day = date(2025, 1, 1) + timedelta(days=rng.randrange(365))
+    whole = rng.randrange(1, 99999)
+    amount = f"{whole:,}.{rng.randrange(100):02d}"
+    account = f"MVR 7701 {rng.randrange(10000, 99999)}{rng.choice('ABC')} {rng.randrange(1, 999):03d}"
+    reference = f"BLAZ{rng.randrange(10, 99)}Y{rng.randrange(10 ** 8, 10 ** 9)}"
+    contact = f"Sonee{rng.choice(CONTACT_FIRST)} {rng.choice(CONTACT_SECOND)}"
+    return {
+        "id": f"sample_{index:03d}",
+        "contact_name": contact,
+        "amount": amount.replace(",", ""),
+        "account": account.replace(" ", ""),
+        "reference": reference,
+        "date": f"{day:%A}, {day:%B} {day.day}, {day.year}",
+        "_amount_text": amount,
+        "_account_text": account,
+        "_transaction_date": f"{day:%d/%m/%Y}",
+        "_last_seen": f"{rng.randrange(1, 12)}:{rng.randrange(60):02d} {rng.choice(['AM', 'PM'])}",
+    }
+
+
+def render_screenshot(sample, width, height):
+    """Draw a Viber-like desktop frame with the sample's fields inside the extraction regions"""
+    image = Image.new("RGB", (width, height), (236, 229, 221))
+    draw = ImageDraw.Draw(image)
+    scale = height / 1080
+    font = _load_font(max(12, int(22 * scale)))
+    big_font = _load_font(max(14, int(28 * scale)))
+
+    # Sidebar and chat header
+    draw.rectangle([0, 0, int(width * 0.3), height], fill=(255, 255, 255))
+    draw.rectangle([int(width * 0.3), int(height * 0.07), width, int(height * 0.16)], fill=(250, 250, 250))
+    draw.text((int(width * 0.42), int(height * 0.085)), sample["contact_name"], fill=(20, 20, 20), font=big_font)
+    draw.text((int(width * 0.42), int(height * 0.12)), f"Last seen today at {sample['_last_seen']}",
+              fill=(110, 110, 110), font=font)
+
+    # Date separator and transaction bubble
+    draw.text((int(width * 0.48), int(height * 0.32)), sample["date"], fill=(90, 90, 90), font=font)
+    draw.rounded_rectangle([int(width * 0.34), int(height * 0.36), int(width * 0.8), int(height * 0.58)],
+                           radius=int(12 * scale), fill=(255, 255, 255))
+    lines = [
+        "Your transaction is successful",
+        f"Amount MVR {sample['_amount_text']}",
+        f"To {sample['contact_name'].upper()}",
+        f"Reference {sample['reference']}",
+        f"Date {sample['_transaction_date']}",
+    ]
+    y = int(height * 0.38)
+    for line in lines:
+        draw.text((int(width * 0.36), y), line, fill=(20, 20, 20), font=font)
+        y += int(38 * scale)
+
+    # Bank details bubble
+    draw.rounded_rectangle([int(width * 0.45), int(height * 0.66), int(width * 0.85), int(height * 0.82)],
+                           radius=int(12 * scale), fill=(220, 248, 198))
+    draw.text((int(width * 0.47), int(height * 0.68)), "Bank account", fill=(20, 20, 20), font=font)
+    draw.text((int(width * 0.47), int(height * 0.72)), sample["_account_text"], fill=(20, 20, 20), font=font)
+    return image
+
+
+def public_labels(sample):
+    return {key: value for key, value in sample.items() if not key.startswith("_")}
+
+
+def synthetic_corpus(seed=1234, resolutions=RESOLUTIONS, per_resolution=SAMPLES_PER_RESOLUTION):
+    """Yield (labels, image) pairs for the in-memory golden corpus"""
+    rng = random.Random(seed)
+    index = 0
+    for width, height in resolutions:
+        for _ in range(per_resolution):
+            sample = make_sample(rng, index)
+            labels = public_labels(sample)
+            labels["resolution"] = f"{width}x{height}"
+            yield labels, render_screenshot(sample, width, height)
+            index += 1
+
+
+def generate_corpus(directory, seed=1234):
+    """Write the synthetic corpus and its labels.jsonl to disk"""
+    os.makedirs(directory, exist_ok=True)
+    count = 0
+    with open(os.path.join(directory, LABELS_FILE), "w", encoding="utf-8") as labels_file:
+        for labels, image in synthetic_corpus(seed):
+            labels["image"] = f"{labels['id']}_{labels['resolution']}.png"
+            image.save(os.path.join(directory, labels["image"]))
+            labels_file.write(json.dumps(labels) + "\n")
+            count += 1
+    return count
+
+
+def load_corpus(directory):
+    """Yield (labels, image) pairs from a labeled corpus directory"""
+    with open(os.path.join(directory, LABELS_FILE), encoding="utf-8") as labels_file:
+        for line in labels_file:
+            if not line.strip():
+                continue
+            labels = json.loads(line)
+            with Image.open(os.path.join(directory, labels["image"])) as image:
+                screenshot = image.convert("RGB")
+            labels.setdefault("resolution", f"{screenshot.width}x{screenshot.height}")
+            yield labels, screenshot
+
+
+def score_fields(expected, contact_name, details_str, date_time):
+    """Compare the extracted filename parts with the expected fields; returns field -> bool"""
+    details = details_str.split("_")
+    return {
+        "contact_name": contact_name == expected.get("contact_name"),
+        "amount": f"MVR{expected.get('amount')}" in details,
+        "account": expected.get("account") in details,
+        "reference": expected.get("reference") in details,
+        "date": date_time.startswith(expected.get("date", "").replace(",", "_")),
+    }
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize_latencies(values):
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values), 2) if values else None,
+        "p50_ms": percentile(values, 50),
+        "p90_ms": percentile(values, 90),
+        "p95_ms": percentile(values, 95),
+        "p99_ms": percentile(values, 99),
+        "max_ms": max(values) if values else None,
+    }
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, round((time.perf_counter() - start) * 1000, 3)
+
+
+def _load_rename_file(work_dir):
+    """Import the live rename_file with its output folders redirected, if this platform allows it"""
+    try:
+        import viber_file_rename
+    except Exception as e:
+        print(f"rename_file stage skipped ({e})", file=sys.stderr)
+        return None
+    viber_file_rename.OUTPUT_DIR = work_dir
+    viber_file_rename.SCREENSHOT_DIR = os.path.join(work_dir, "Screenshots")
+    return viber_file_rename.rename_file
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_benchmark(corpus, repeat=1, warmup=1, trace_memory=False):
+    """Run every stage over the corpus and return the machine-readable report"""
+    import screenshot_extract
+    from screenshot_extract import extract_specific_regions, extract_info_from_screenshot
+
+    samples = list(corpus)
+    if not samples:
+        raise ValueError("The corpus is empty")
+
+    work_dir = tempfile.mkdtemp(prefix="viber_bench_")
+    rename_file = _load_rename_file(work_dir)
+
+    # Warm up the OCR workers so model loading is not counted as latency
+    for _, screenshot in samples[:warmup]:
+        extract_specific_regions(screenshot)
+
+    latencies = {"extract_specific_regions": [], "extract_info_from_screenshot": []}
+    if rename_file:
+        latencies["rename_file"] = []
+    correct = {field: 0 for field in FIELDS}
+    by_resolution = {}
+    failures = []
+    runs = 0
+
+    # tracemalloc adds overhead to every Python allocation, so it is opt-in
+    if trace_memory:
+        tracemalloc.start()
+    peak_traced = None
+    wall_start = time.perf_counter()
+    try:
+        for _ in range(repeat):
+            for labels, screenshot in samples:
+                _, elapsed = _timed(extract_specific_regions, screenshot)
+                latencies["extract_specific_regions"].append(elapsed)
+
+                (contact_name, details_str, date_time), elapsed = _timed(extract_info_from_screenshot, screenshot)
+                latencies["extract_info_from_screenshot"].append(elapsed)
+
+                if rename_file:
+                    attachment = os.path.join(work_dir, f"{labels['id']}.jpg")
+                    with open(attachment, "wb") as f:
+                        f.write(b"\xff\xd8benchmark")
+                    _, elapsed = _timed(rename_file, attachment, screenshot)
+                    latencies["rename_file"].append(elapsed)
+
+                scores = score_fields(labels, contact_name, details_str, date_time)
+                resolution = by_resolution.setdefault(labels.get("resolution", "unknown"), {"runs": 0, "all_correct": 0})
+                resolution["runs"] += 1
+                resolution["all_correct"] += all(scores.values())
+                for field, ok in scores.items():
+                    correct[field] += ok
+                if not all(scores.values()):
+                    failures.append({
+                        "id": labels.get("id"),
+                        "resolution": labels.get("resolution"),
+                        "missed": [field for field, ok in scores.items() if not ok],
+                        "got": {"contact_name": contact_name, "details": details_str, "date_time": date_time},
+                    })
+                runs += 1
+        wall_seconds = time.perf_counter() - wall_start
+        if trace_memory:
+            _, peak_traced = tracemalloc.get_traced_memory()
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    # Throughput of a full attachment: rename_file when available, else extraction alone
+    end_to_end = latencies.get("rename_file") or latencies["extract_info_from_screenshot"]
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "samples": len(samples),
+            "repeat": repeat,
+            "extraction_mode": screenshot_extract.EXTRACTION_MODE,
+        },
+        "latency": {stage: summarize_latencies(values) for stage, values in latencies.items()},
+        "throughput": {
+            "attachments_per_second": round(len(end_to_end) / (sum(end_to_end) / 1000), 3) if sum(end_to_end) else None,
+            "wall_seconds": round(wall_seconds, 2),
+        },
+        "memory": {
+            "peak_traced_mb": round(peak_traced / (1024 * 1024), 1) if peak_traced is not None else None,
+            "peak_rss_mb": _peak_rss_mb(),
+        },
+        "accuracy": {
+            "fields": {field: round(count / runs, 4) for field, count in correct.items()},
+            "all_fields": round(sum(r["all_correct"] for r in by_resolution.values()) / runs, 4),
+            "by_resolution": {
+                name: round(r["all_correct"] / r["runs"], 4) for name, r in sorted(by_resolution.items())
+            },
+        },
+        "failures": failures[:50],
+    }
+
+
+def compare_reports(baseline, current, latency_tolerance=LATENCY_TOLERANCE, accuracy_tolerance=ACCURACY_TOLERANCE):
+    """Return a list of human-readable regressions of current against baseline"""
+    regressions = []
+    for stage, stats in current["latency"].items():
+        old = baseline.get("latency", {}).get(stage)
+        if not old:
+            continue
+        for key in ("p50_ms", "p95_ms"):
+            if old.get(key) and stats.get(key) and stats[key] > old[key] * (1 + latency_tolerance):
+                regressions.append(f"{stage} {key}: {old[key]} -> {stats[key]}")
+
+    old_tp = baseline.get("throughput", {}).get("attachments_per_second")
+    new_tp = current["throughput"]["attachments_per_second"]
+    if old_tp and new_tp and new_tp < old_tp / (1 + latency_tolerance):
+        regressions.append(f"attachments_per_second: {old_tp} -> {new_tp}")
+
+    for field, value in current["accuracy"]["fields"].items():
+        old = baseline.get("accuracy", {}).get("fields", {}).get(field)
+        if old is not None and value < old - accuracy_tolerance:
+            regressions.append(f"{field} accuracy: {old} -> {value}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark latency and accuracy of screenshot extraction")
+    parser.add_argument("--corpus", help="Labeled corpus directory (default: render the synthetic corpus in memory)")
+    parser.add_argument("--generate-corpus", metavar="DIR", help="Write the synthetic corpus to DIR and exit")
+    parser.add_argument("--seed", type=int, default=1234, help="Seed for the synthetic corpus")
+    parser.add_argument("--repeat", type=int, default=1, help="Times to run each sample")
+    parser.add_argument("--trace-memory", action="store_true", help="Also record peak Python allocations with tracemalloc")
+    parser.add_argument("--output", "-o", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare against an earlier JSON report")
+    parser.add_argument("--latency-tolerance", type=float, default=LATENCY_TOLERANCE)
+    parser.add_argument("--accuracy-tolerance", type=float, default=ACCURACY_TOLERANCE)
+    parser.add_argument("--tesseract-cmd", help="Path to the tesseract executable")
+    parser.add_argument("--engine", default="auto", choices=["auto", "tesserocr", "pytesseract"], help="OCR engine")
+    parser.add_argument("--pool-size", type=int, default=3, help="OCR worker pool size")
+    parser.add_argument("--ocr-profiles", help="JSON file with Tesseract settings per region (see ocr_tuning.py)")
+    parser.add_argument("--extraction-mode", choices=["lazy", "full"], help="Override screenshot_extract.EXTRACTION_MODE")
+    parser.add_argument("--log-level", default="WARNING", help="Logging level for extraction messages (default: WARNING)")
+    args = parser.parse_args(argv)
+
+    if args.generate_corpus:
+        count = generate_corpus(args.generate_corpus, args.seed)
+        print(f"Wrote {count} labeled screenshots to {args.generate_corpus}")
+        return 0
+
+    import screenshot_extract
+    from ocr_engine import configure_ocr_profiles, configure_pool, set_tesseract_cmd, shutdown_pool
+
+    if args.extraction_mode:
+        screenshot_extract.EXTRACTION_MODE = args.extraction_mode
+
+    if args.tesseract_cmd:
+        set_tesseract_cmd(args.tesseract_cmd)
+    configure_ocr_profiles(path=args.ocr_profiles)
+    configure_pool(size=args.pool_size, engine=args.engine)
+
+    # Extraction logs go to stderr; per-region progress is only logged at DEBUG
+    logging.basicConfig(level=args.log_level.upper(), format="%(levelname)s %(name)s: %(message)s")
+    try:
+        corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.seed)
+        report = run_benchmark(corpus, repeat=args.repeat, trace_memory=args.trace_memory)
+    finally:
+        shutdown_pool()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_reports(baseline, report, args.latency_tolerance, args.accuracy_tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+        print("No regressions against baseline", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,505 @@
+"""Window control and frame capture backends.
+
+"win32" drives the Viber window on the desktop. "replay" serves frames from a
+directory or a socket instead, so OCR can run on a machine without Viber (e.g. a
+Linux worker fed by a capture agent on the desktop, or CI replaying saved frames).
+Platform modules are only imported when their backend is created.
+
+Capture agent (runs on the desktop next to Viber):
+    python capture_backend.py DOWNLOAD_FOLDER --send tcp://worker:8765 --token SECRET
+    python capture_backend.py DOWNLOAD_FOLDER --out \\\\worker\\frames
+"""
+import argparse
+import hmac
+import io
+import itertools
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+from metrics import counter
+from frames import frame_pnginfo, regions_bounding_box, FRAME_INFO_KEY
+from stability import final_path_for
+
+logger = logging.getLogger(__name__)
+
+FOCUS_DELAY = 0.5  # Seconds the UI gets to redraw after the window is brought forward
+REPLAY_WAIT = 10  # Seconds capture() waits for a replayed frame to arrive
+REPLAY_MAX_FRAMES = 32  # Received frames kept before the oldest unclaimed ones are dropped
+REPLAY_POLL_INTERVAL = 0.2  # Seconds between directory checks while waiting for a frame
+FRAME_EXTENSIONS = (".png", ".webp", ".jpg", ".jpeg")
+REPLAY_MAX_FRAME_BYTES = 64 * 1024 * 1024  # Largest encoded frame accepted from a socket
+REPLAY_MAX_FRAME_PIXELS = 40_000_000  # Largest frame decoded (an 8K screen is 33 million pixels)
+AGENT_DEDUP_WINDOW = 120  # Seconds events for the same download name are treated as one download
+
+_frames = counter("replay_frames_total", "Replayed frames by result (received, served, missing, dropped)")
+
+
+class CaptureBackend:
+    """Brings the chat window forward and grabs frames of it"""
+
+    name = "none"
+
+    def focus(self, window_title):
+        """Bring the window to the foreground; returns False if it cannot be found"""
+        return True
+
+    def capture(self, window_title, mode="regions", name=None, rois=None):
+        """Return a frame of the window (None on failure)
+
+        name identifies the attachment it is for; in "regions" mode only the union of
+        rois (default ROIS) is grabbed.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class Win32Backend(CaptureBackend):
+    """Desktop capture through pywin32 (and Pillow's ImageGrab for the full screen)"""
+
+    name = "win32"
+
+    def __init__(self, focus_delay=FOCUS_DELAY):
+        import ctypes
+        import win32con
+        import win32gui
+        import win32ui
+        from PIL import ImageGrab
+        self._win32con = win32con
+        self._win32gui = win32gui
+        self._win32ui = win32ui
+        self._image_grab = ImageGrab
+        self.focus_delay = focus_delay
+        try:
+            # Window rectangles in physical pixels, matching what is copied from the screen
+            ctypes.windll.shcore.SetProcessDpiAwareness(2)
+        except (AttributeError, OSError):
+            pass
+
+    def focus(self, window_title):
+        # Find the Viber window by title
+        hwnd = self._win32gui.FindWindow(None, window_title)
+        if not hwnd:
+            logger.warning("Viber window not found")
+            return False
+        # Maximize the window and bring it to the foreground
+        self._win32gui.ShowWindow(hwnd, self._win32con.SW_MAXIMIZE)
+        self._win32gui.SetForegroundWindow(hwnd)
+        # Give UI time to update
+        time.sleep(self.focus_delay)
+        return True
+
+    def window_rect(self, window_title):
+        """Return the (left, top, right, bottom) screen rectangle of the window"""
+        hwnd = self._win32gui.FindWindow(None, window_title)
+        if not hwnd:
+            return None
+        left, top, right, bottom = self._win32gui.GetWindowRect(hwnd)
+        if right <= left or bottom <= top:
+            return None
+        return left, top, right, bottom
+
+    def window_dpi(self, window_title):
+        """Return the DPI of the monitor showing the window, or None if unknown"""
+        try:
+            import ctypes
+            hwnd = self._win32gui.FindWindow(None, window_title)
+            # GetDpiForWindow needs Windows 10 1607 or newer
+            return ctypes.windll.user32.GetDpiForWindow(hwnd) if hwnd else None
+        except Exception:
+            return None
+
+    def grab(self, left, top, right, bottom):
+        """Copy just this rectangle of the screen
+
+        ImageGrab.grab(bbox=...) copies the whole screen (or virtual desktop) and crops
+        afterwards; a BitBlt of the rectangle copies only the pixels that are needed.
+        """
+        width, height = right - left, bottom - top
+        desktop = self._win32gui.GetDesktopWindow()
+        desktop_dc = self._win32gui.GetWindowDC(desktop)
+        source_dc = self._win32ui.CreateDCFromHandle(desktop_dc)
+        memory_dc = source_dc.CreateCompatibleDC()
+        bitmap = self._win32ui.CreateBitmap()
+        try:
+            bitmap.CreateCompatibleBitmap(source_dc, width, height)
+            memory_dc.SelectObject(bitmap)
+            memory_dc.BitBlt((0, 0), (width, height), source_dc, (left, top), self._win32con.SRCCOPY)
+            return Image.frombuffer("RGB", (width, height), bitmap.GetBitmapBits(True), "raw", "BGRX", 0, 1)
+        finally:
+            self._win32gui.DeleteObject(bitmap.GetHandle())
+            memory_dc.DeleteDC()
+            source_dc.DeleteDC()
+            self._win32gui.ReleaseDC(desktop, desktop_dc)
+
+    def capture(self, window_title, mode="regions", name=None, rois=None):
+        rect = self.window_rect(window_title) if mode in ("window", "regions") else None
+        if rect is None:
+            # Take a screenshot of the entire screen
+            return self._image_grab.grab()
+
+        left, top, right, bottom = rect
+        if mode == "regions":
+            # Grab only the union of the OCR regions and remember where it sits in the window
+            box = regions_bounding_box(right - left, bottom - top, rois)
+            screenshot = self.grab(left + box[0], top + box[1], left + box[2], top + box[3])
+            screenshot.info[FRAME_INFO_KEY] = (box[0], box[1], right - left, bottom - top)
+        else:
+            screenshot = self.grab(*rect)
+        dpi = self.window_dpi(window_title)
+        if dpi:
+            # Text blocks found by the layout analysis are cached per window size and DPI
+            screenshot.info["dpi"] = (dpi, dpi)
+        return screenshot
+
+
+def _load_frame(fp, max_pixels=REPLAY_MAX_FRAME_PIXELS):
+    """Decode a frame, refusing one whose header claims more pixels than any screen has"""
+    image = Image.open(fp)
+    if image.width * image.height > max_pixels:
+        image.close()
+        raise ValueError(f"Frame of {image.width}x{image.height} pixels exceeds the {max_pixels} pixel limit")
+    image.load()
+    return image
+
+
+def _parse_address(source):
+    """Split "tcp://host:port" or "unix:/path" into (family, address); the host defaults to 127.0.0.1"""
+    if source.startswith("unix:"):
+        return socket.AF_UNIX, source[len("unix:"):]
+    host, _, port = source[len("tcp://"):].rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def is_socket_source(source):
+    return source.startswith(("tcp://", "unix:"))
+
+
+class ReplayBackend(CaptureBackend):
+    """Serves frames from a directory or a socket instead of the screen
+
+    A frame named after an attachment (e.g. receipt.jpg.png for receipt.jpg) is served
+    for that attachment; without a name the oldest frame is served. Directory frames
+    are deleted once served unless keep_files is set. With a token, socket frames are
+    only accepted from senders that present the same token.
+    """
+
+    name = "replay"
+
+    def __init__(self, source, wait=REPLAY_WAIT, max_frames=REPLAY_MAX_FRAMES, keep_files=False, token=None,
+                 max_frame_bytes=REPLAY_MAX_FRAME_BYTES, max_frame_pixels=REPLAY_MAX_FRAME_PIXELS):
+        self.source = source
+        self.wait = wait
+        self.max_frames = max_frames
+        self.keep_files = keep_files
+        self.token = token
+        self.max_frame_bytes = max_frame_bytes
+        self.max_frame_pixels = max_frame_pixels
+        self._frames = OrderedDict()  # name -> image, for frames received over the socket
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._server = None
+        self._closed = False
+        if is_socket_source(source):
+            family, address = _parse_address(source)
+            if family == socket.AF_UNIX and os.path.exists(address):
+                os.remove(address)
+            self._server = socket.socket(family, socket.SOCK_STREAM)
+            if family == socket.AF_INET:
+                self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                if not token and address[0] not in ("127.0.0.1", "localhost", "::1"):
+                    logger.warning("Accepting frames on %s from any host without a token; set a capture token", source)
+            self._server.bind(address)
+            self._server.listen()
+            threading.Thread(target=self._accept_loop, name="replay-listener", daemon=True).start()
+            logger.info("Waiting for frames on %s", source)
+        elif not os.path.isdir(source):
+            raise RuntimeError(f"Replay source is neither a directory nor a socket address: {source}")
+
+    def _accept_loop(self):
+        while not self._closed:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._receive, args=(connection,), name="replay-connection", daemon=True).start()
+
+    def _receive(self, connection):
+        """Read frames sent by send_frame(): a JSON header line followed by the encoded image"""
+        with connection, connection.makefile("rb") as stream:
+            while True:
+                try:
+                    line = stream.readline()
+                    if not line:
+                        return
+                    header = json.loads(line)
+                    if not isinstance(header, dict):
+                        raise ValueError("frame header is not a JSON object")
+                    if self.token and not hmac.compare_digest(str(header.get("token", "")), self.token):
+                        raise ValueError("wrong or missing token")
+                    size = header["size"]
+                    if not isinstance(size, int) or not 0 < size <= self.max_frame_bytes:
+                        raise ValueError(f"frame size {size!r} is not between 1 and {self.max_frame_bytes} bytes")
+                    data = stream.read(size)
+                    if len(data) < size:
+                        raise ValueError("connection closed in the middle of a frame")
+                    image = _load_frame(io.BytesIO(data), self.max_frame_pixels)
+                except Exception as e:
+                    logger.warning("Dropping replay connection after a bad frame: %s", e)
+                    return
+                name = header.get("name")
+                if name is not None and not isinstance(name, str):
+                    logger.warning("Dropping replayed frame with a non-string name %r", name)
+                    _frames.inc(result="dropped")
+                    continue
+                _frames.inc(result="received")
+                # Unnamed frames are only ever served in arrival order
+                name = name or next(self._sequence)
+                with self._condition:
+                    self._frames.pop(name, None)
+                    self._frames[name] = image
+                    while len(self._frames) > self.max_frames:
+                        self._frames.popitem(last=False)
+                        _frames.inc(result="dropped")
+                    self._condition.notify_all()
+
+    def _take_received(self, name):
+        if name is None:
+            return self._frames.popitem(last=False)[1] if self._frames else None
+        return self._frames.pop(name, None)
+
+    def _take_file(self, name):
+        frames = []
+        for entry in os.scandir(self.source):
+            stem, extension = os.path.splitext(entry.name)
+            if extension.lower() not in FRAME_EXTENSIONS or not entry.is_file():
+                continue
+            if name is None or stem == name:
+                frames.append((entry.stat().st_mtime, entry.path))
+        if not frames:
+            return None
+        path = min(frames)[1]
+        with open(path, "rb") as f:
+            image = _load_frame(f, self.max_frame_pixels)
+        if not self.keep_files:
+            os.remove(path)
+        return image
+
+    def capture(self, window_title, mode="regions", name=None, rois=None):
+        deadline = time.time() + self.wait
+        while True:
+            if self._server is not None:
+                with self._condition:
+                    image = self._take_received(name)
+                    if image is None and time.time() < deadline:
+                        self._condition.wait(deadline - time.time())
+                        image = self._take_received(name)
+            else:
+                image = self._take_file(name)
+            if image is not None:
+                _frames.inc(result="served")
+                return image
+            if time.time() >= deadline:
+                _frames.inc(result="missing")
+                logger.warning("No replayed frame for %s within %ss", name or "the next capture", self.wait)
+                return None
+            if self._server is None:
+                time.sleep(REPLAY_POLL_INTERVAL)
+
+    def close(self):
+        self._closed = True
+        if self._server is not None:
+            self._server.close()
+            if self._server.family == socket.AF_UNIX:
+                try:
+                    os.remove(self.source[len("unix:"):])
+                except OSError:
+                    pass
+
+
+def encode_frame(image):
+    """PNG bytes of a frame, keeping its geometry and DPI"""
+    buffer = io.BytesIO()
+    options = {"pnginfo": frame_pnginfo(image)}
+    if "dpi" in image.info:
+        options["dpi"] = image.info["dpi"]
+    image.save(buffer, format="PNG", compress_level=1, **options)
+    return buffer.getvalue()
+
+
+def send_frame(sock, image, name, token=None):
+    """Send one frame to a ReplayBackend listening on a socket"""
+    data = encode_frame(image)
+    header = {"name": name, "size": len(data)}
+    if token:
+        header["token"] = token
+    sock.sendall(json.dumps(header).encode("utf-8") + b"\n" + data)
+
+
+def write_frame(directory, image, name):
+    """Write a frame where a directory ReplayBackend picks it up (atomically, so it is never read half-written)"""
+    path = os.path.join(directory, name + ".png")
+    tmp_path = path + ".part"
+    with open(tmp_path, "wb") as f:
+        f.write(encode_frame(image))
+    os.replace(tmp_path, path)
+    return path
+
+
+# Registered backends in order of preference: (name, factory, is_available)
+_BACKENDS = []
+
+
+def register_backend(name, factory, is_available=None, first=False):
+    """Add a capture backend; factory(source, **options) returns a CaptureBackend"""
+    entry = (name, factory, is_available or (lambda: True))
+    if first:
+        _BACKENDS.insert(0, entry)
+    else:
+        _BACKENDS.append(entry)
+
+
+def available_backends():
+    return [name for name, _, is_available in _BACKENDS if is_available()]
+
+
+def create_capture_backend(backend="auto", source=None, **options):
+    """Create a capture backend; "auto" replays from source when one is given, else uses the desktop"""
+    if backend == "auto" and source:
+        backend = "replay"
+    for name, factory, is_available in _BACKENDS:
+        if backend not in ("auto", name) or (backend == "auto" and name == "replay"):
+            continue
+        if not is_available():
+            if backend == name:
+                raise RuntimeError(f"Capture backend '{name}' is not available on this platform")
+            continue
+        return factory(source, **options)
+    raise RuntimeError(f"No usable capture backend for '{backend}'")
+
+
+def _has_module(module_name):
+    try:
+        __import__(module_name)
+        return True
+    except ImportError:
+        return False
+
+
+register_backend("win32", lambda source, **options: Win32Backend(),
+                 lambda: sys.platform == "win32" and _has_module("win32gui"))
+register_backend("replay", lambda source, token=None, **options: ReplayBackend(source, token=token))
+
+
+_backend = None
+
+
+def configure_capture(backend="auto", source=None, token=None):
+    """Create the shared capture backend used by the pipeline (token: shared secret of replay sockets)"""
+    global _backend
+    close_capture()
+    _backend = create_capture_backend(backend, source, token=token)
+    return _backend
+
+
+def get_capture_backend():
+    return _backend
+
+
+def close_capture():
+    global _backend
+    if _backend is not None:
+        _backend.close()
+        _backend = None
+
+
+def frame_name(path):
+    """Name a frame after the attachment it belongs to, using the final name of a temporary download"""
+    return os.path.basename(final_path_for(path))
+
+
+def _first_sighting(sent, name, now=None, window=AGENT_DEDUP_WINDOW):
+    """Record name in sent (name -> time) and return False if it was already seen within window"""
+    now = time.monotonic() if now is None else now
+    for seen in [n for n, at in sent.items() if now - at > window]:
+        del sent[seen]
+    if name in sent:
+        return False
+    sent[name] = now
+    return True
+
+
+def run_agent(folder, window_title, send=None, out=None, mode="regions", watch_backend="auto", token=None):
+    """Capture the chat for every new download in folder and ship the frame to a replay worker"""
+    from folder_watcher import create_watcher
+
+    capture = create_capture_backend("win32")
+    watcher = create_watcher(folder, watch_backend)
+    sock = None
+    sent = {}
+    logger.info("Capturing frames for downloads in %s", folder)
+    try:
+        while True:
+            for event in watcher.read_events(timeout=1):
+                name = frame_name(event.path)
+                # The chat is captured once per download, as soon as it appears; a name
+                # reused after AGENT_DEDUP_WINDOW is a new download and gets its own frame
+                if name.startswith(".") or not _first_sighting(sent, name):
+                    continue
+                try:
+                    if not capture.focus(window_title):
+                        continue
+                    image = capture.capture(window_title, mode, name)
+                    if send:
+                        if sock is None:
+                            family, address = _parse_address(send)
+                            sock = socket.socket(family, socket.SOCK_STREAM)
+                            sock.connect(address)
+                        send_frame(sock, image, name, token)
+                    else:
+                        write_frame(out, image, name)
+                    logger.info("Sent frame for %s", name)
+                except OSError as e:
+                    # Reconnect on the next download if the worker went away
+                    logger.error("Could not send frame for %s: %s", name, e)
+                    if sock is not None:
+                        sock.close()
+                        sock = None
+                except Exception as e:
+                    logger.error("Error capturing frame for %s: %s", name, e)
+    except KeyboardInterrupt:
+        logger.info("Capture agent stopped by user")
+    finally:
+        watcher.close()
+        if sock is not None:
+            sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Capture agent: sends a Viber frame for every new download "
+                                                 "to a worker running the replay capture backend")
+    parser.add_argument("folder", help="Viber download folder to watch")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--send", help="Worker socket (tcp://host:port or unix:/path)")
+    target.add_argument("--out", help="Directory the worker replays frames from")
+    parser.add_argument("--token", help="Shared secret the worker expects (its CAPTURE_TOKEN)")
+    parser.add_argument("--window-title", default="Rakuten Viber")
+    parser.add_argument("--mode", default="regions", choices=("regions", "window", "full"))
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)-7s %(message)s")
+    run_agent(args.folder, args.window_title, send=args.send, out=args.out, mode=args.mode, token=args.token)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
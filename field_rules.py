@@ -0,0 +1,212 @@
+"""Rule engine that finds the transaction fields in OCR text.
+
+Each rule declares the field it extracts, a regular expression (with an optional
+(?P<value>...) group for the part to keep), a priority and optionally the regions
+it applies to. Every rule is compiled once and searched on its own, so a match
+of one rule never hides an overlapping match of another; for every field the
+highest-priority match wins, and the earliest one among equal priorities.
+
+Usage without OCR:
+    python field_rules.py TEXT_FILE [--rules rules.json] [--repeat N]
+"""
+import argparse
+import json
+import re
+import sys
+import threading
+import time
+
+# Building blocks that rules can use as {NAME}
+PATTERN_MACROS = {
+    'DAY': r"(?:Mon|Tues|Wednes|Thurs|Fri|Satur|Sun)day",
+    'MONTH': r"(?:January|February|March|April|May|June|July|August|September|October|November|December)",
+}
+
+# Default rules. A rules file may add rules, replace a default by using its name,
+# or switch one off with "enabled": false.
+DEFAULT_RULES = [
+    # Contact name from the chat header ("SoneeHardware JanavareeMagu")
+    {'name': 'contact_header', 'field': 'contact_name', 'pattern': r"Sonee\w+\s+\w+", 'priority': 20},
+    # Recipient line of a transfer ("To SONEE HARDWARE")
+    {'name': 'contact_recipient', 'field': 'contact_name', 'pattern': r"To\s+(?P<value>SONEE\s+\w+)", 'priority': 10},
+    # Account number (MVR 7701 70007B 001)
+    {'name': 'account', 'field': 'account', 'pattern': r"MVR\s+\d+\s+\d+\w*\s+\d+|77017000\d+", 'priority': 10},
+    # Transaction amount (1,065.80)
+    {'name': 'amount', 'field': 'amount', 'pattern': r"\d{1,3}(?:,\d{3})*\.\d{2}", 'priority': 10},
+    # Date separator in the chat (Monday, February 24, 2025)
+    {'name': 'date', 'field': 'date', 'pattern': r"{DAY},\s+{MONTH}\s+\d{1,2},\s+\d{4}", 'priority': 10},
+    # Last seen time in the chat header (Last seen today at 4:24 PM)
+    {'name': 'last_seen', 'field': 'time', 'pattern': r"Last\s+seen\s+today\s+at\s+(?P<value>\d{1,2}:\d{2}\s+(?:AM|PM))",
+     'priority': 10, 'regions': ['header']},
+    # Transaction date (24/02/2025)
+    {'name': 'transaction_date', 'field': 'transaction_date', 'pattern': r"\d{1,2}/\d{1,2}/\d{4}", 'priority': 10},
+    # Reference number (Reference BLAZ29Y417504782)
+    {'name': 'reference', 'field': 'reference', 'pattern': r"Reference\s+(?P<value>[A-Z0-9]+)", 'priority': 10,
+     'flags': ['IGNORECASE']},
+    # Confirmation that the transfer went through
+    {'name': 'status', 'field': 'status', 'pattern': r"(?P<value>SUCCESS|transaction\s+is\s+successful)",
+     'priority': 10, 'flags': ['IGNORECASE']},
+]
+
+_FLAGS = {'IGNORECASE': re.IGNORECASE, 'MULTILINE': re.MULTILINE, 'DOTALL': re.DOTALL, 'VERBOSE': re.VERBOSE,
+          'ASCII': re.ASCII}
+_MACRO = re.compile(r"\{([A-Z_]+)\}")
+
+
+class Rule:
+    """One compiled field extractor"""
+
+    def __init__(self, name, field, pattern, priority=0, regions=None, flags=None, enabled=True):
+        self.name = name
+        self.field = field
+        self.pattern = pattern
+        self.priority = priority
+        self.regions = frozenset(regions) if regions else None
+        self.flags = tuple(flags or ())
+        self.enabled = enabled
+        unknown = [flag for flag in self.flags if flag not in _FLAGS]
+        if unknown:
+            raise ValueError(f"Rule '{name}': unknown flags {unknown}")
+        flag_bits = 0
+        for flag in self.flags:
+            flag_bits |= _FLAGS[flag]
+        # Compiled here, once, so a broken rule is reported by name
+        try:
+            self.regex = re.compile(self.expanded_pattern(), flag_bits)
+        except re.error as e:
+            raise ValueError(f"Rule '{name}': invalid pattern: {e}") from None
+        if self.regex.groupindex.keys() - {'value'}:
+            raise ValueError(f"Rule '{name}': the only named group allowed is 'value'")
+
+    @classmethod
+    def from_dict(cls, config):
+        missing = [key for key in ('name', 'field', 'pattern') if key not in config]
+        if missing:
+            raise ValueError(f"Rule '{config.get('name', '?')}': missing {missing}")
+        return cls(config['name'], config['field'], config['pattern'], config.get('priority', 0),
+                   config.get('regions'), config.get('flags'), config.get('enabled', True))
+
+    def expanded_pattern(self, macros=None):
+        macros = PATTERN_MACROS if macros is None else macros
+
+        def expand(match):
+            if match.group(1) not in macros:
+                raise ValueError(f"Rule '{self.name}': unknown macro {{{match.group(1)}}}")
+            return macros[match.group(1)]
+        return _MACRO.sub(expand, self.pattern)
+
+
+class FieldRuleEngine:
+    """Matches every rule against a text, each with the pattern its Rule compiled"""
+
+    def __init__(self, rules=None):
+        rules = DEFAULT_RULES if rules is None else rules
+        self.rules = [rule if isinstance(rule, Rule) else Rule.from_dict(rule) for rule in rules]
+        self.rules = [rule for rule in self.rules if rule.enabled]
+        # Higher priority first, so the preferred rules are tried first
+        self.rules.sort(key=lambda rule: -rule.priority)
+        self.fields = sorted({rule.field for rule in self.rules})
+
+    def matches(self, text, spans=None):
+        """Yield (rule, value, start, end) for every match, restricted to each rule's regions
+
+        Matches come rule by rule (highest priority first), each rule's in text order.
+        spans is a list of (region, start, end) telling which region each part of the
+        text came from; region-scoped rules apply to any text not covered by a span.
+        """
+        for rule in self.rules:
+            for match in rule.regex.finditer(text):
+                group = 'value' if 'value' in rule.regex.groupindex and match.group('value') is not None else 0
+                start, end = match.span(group)
+                if spans is not None and rule.regions is not None:
+                    # Text outside every span (e.g. a full-frame fallback) is not scoped
+                    region = _region_at(spans, start)
+                    if region is not None and region not in rule.regions:
+                        continue
+                yield rule, match.group(group), start, end
+
+    def extract(self, text, spans=None):
+        """Return field -> (value, start, end) using the best match for each field"""
+        best = {}
+        for rule, value, start, end in self.matches(text, spans):
+            current = best.get(rule.field)
+            # Prefer a higher priority, then the earlier match in the text
+            if current is None or (-rule.priority, start) < (-current[0], current[2]):
+                best[rule.field] = (rule.priority, value, start, end)
+        return {field: (value, start, end) for field, (_, value, start, end) in best.items()}
+
+
+def _region_at(spans, offset):
+    for region, start, end in spans:
+        if start <= offset < end:
+            return region
+    return None
+
+
+def load_rules(path, base=None):
+    """Merge the rules of a JSON file (a list of rule objects) into the default rules"""
+    with open(path, encoding="utf-8") as f:
+        overrides = json.load(f)
+    if not isinstance(overrides, list) or not all(isinstance(rule, dict) and 'name' in rule for rule in overrides):
+        raise ValueError("expected a list of rule objects, each with a name")
+    rules = {rule['name']: dict(rule) for rule in (DEFAULT_RULES if base is None else base)}
+    for rule in overrides:
+        if rule['name'] in rules:
+            rules[rule['name']].update(rule)
+        else:
+            rules[rule['name']] = dict(rule)
+    return list(rules.values())
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def configure_rules(rules=None, path=None):
+    """Compile the shared engine from rules (default: DEFAULT_RULES) plus an optional rules file"""
+    global _engine
+    if path:
+        rules = load_rules(path, rules)
+    engine = FieldRuleEngine(rules)
+    with _engine_lock:
+        _engine = engine
+    return engine
+
+
+def get_rule_engine():
+    """Return the shared engine, compiling the default rules on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = FieldRuleEngine()
+        return _engine
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the field rules over OCR text without any OCR")
+    parser.add_argument("text_file", help="File with the OCR text ('-' reads stdin)")
+    parser.add_argument("--rules", help="JSON file with extra or replacement rules")
+    parser.add_argument("--repeat", type=int, default=0, help="Also time this many extractions")
+    args = parser.parse_args(argv)
+
+    if args.text_file == "-":
+        text = sys.stdin.read()
+    else:
+        with open(args.text_file, encoding="utf-8") as f:
+            text = f.read()
+
+    engine = configure_rules(path=args.rules)
+    fields = engine.extract(text)
+    print(json.dumps({field: value for field, (value, _, _) in fields.items()}, indent=2, ensure_ascii=False))
+    if args.repeat:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            engine.extract(text)
+        elapsed = time.perf_counter() - start
+        print(f"{args.repeat} extractions in {elapsed:.3f}s ({elapsed / args.repeat * 1e6:.1f} us each)",
+              file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
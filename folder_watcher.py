@@ -0,0 +1,321 @@
+import logging
+import os
+import sys
+import time
+import queue
+import select
+import struct
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Kinds of events reported by every watcher backend
+EVENT_CREATED = "created"  # A new entry appeared in the folder
+EVENT_CLOSED = "closed"  # A file was closed after being written (download finished)
+EVENT_MOVED = "moved"  # A file was renamed/moved into the folder (e.g. "_tmp" -> final name)
+EVENT_MODIFIED = "modified"  # An existing file was written to (e.g. a download written in place)
+
+FileEvent = namedtuple("FileEvent", ["kind", "path"])
+
+# How often the snapshot-diff backend rescans the folder (in seconds)
+SCAN_INTERVAL = 2
+FULL_RESCAN_INTERVAL = 60  # Seconds between scans that stat every file, catching files rewritten in place
+MTIME_RESOLUTION = 2  # Seconds a folder mtime may lag behind a change (FAT keeps 2-second mtimes)
+
+
+class ScandirWatcher:
+    """Portable fallback that diffs os.scandir snapshots of each file's size and mtime
+
+    The size and mtime of every file are cached. A scan only lists and stats the
+    whole folder when the folder's own mtime changed (an entry was added, removed
+    or renamed), and every full_rescan_interval seconds to catch files rewritten
+    in place; otherwise only the files still changing are stat-ed.
+    """
+
+    name = "scandir"
+
+    def __init__(self, folder_path, interval=SCAN_INTERVAL, full_rescan_interval=FULL_RESCAN_INTERVAL):
+        self.folder_path = folder_path
+        self.interval = interval
+        self.full_rescan_interval = full_rescan_interval
+        # name -> (size, mtime_ns) for every file seen in the last snapshot
+        self._entries = {}
+        # Files that changed in the last snapshot and are not yet stable
+        self._changing = set()
+        self._next_scan = 0.0
+        self._folder_mtime = None
+        self._next_full_scan = 0.0
+
+        # Take the baseline snapshot; files that already exist produce no events
+        self._entries = self._snapshot(time.time())
+        self._next_scan = time.time() + self.interval
+
+    def _scan_folder(self):
+        """List the folder with the size and mtime of every file"""
+        entries = {}
+        with os.scandir(self.folder_path) as it:
+            for entry in it:
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    entries[entry.name] = (stat.st_size, stat.st_mtime_ns)
+                except OSError:
+                    # Entry vanished between listing and stat
+                    continue
+        return entries
+
+    def _snapshot(self, now):
+        """Current size and mtime of every file, from a full scan only when one is due"""
+        # Taken before listing, so a change made during the scan shows up as a new mtime next time
+        folder_mtime = os.stat(self.folder_path).st_mtime_ns
+        # A folder mtime within MTIME_RESOLUTION of now may not reflect changes made in the same tick
+        if (folder_mtime != self._folder_mtime or now >= self._next_full_scan
+                or now - folder_mtime / 1e9 < MTIME_RESOLUTION):
+            self._folder_mtime = folder_mtime
+            self._next_full_scan = now + self.full_rescan_interval
+            return self._scan_folder()
+        entries = dict(self._entries)
+        for name in self._changing:
+            try:
+                stat = os.stat(os.path.join(self.folder_path, name))
+                entries[name] = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                entries.pop(name, None)
+        return entries
+
+    def _poll(self):
+        """Produce events by diffing a new snapshot against the previous one"""
+        try:
+            current = self._snapshot(time.time())
+        except OSError as e:
+            logger.error("Error reading watched folder: %s", e)
+            return []
+
+        events = []
+        for name, stat in current.items():
+            path = os.path.join(self.folder_path, name)
+            previous = self._entries.get(name)
+            if previous is None:
+                events.append(FileEvent(EVENT_CREATED, path))
+                self._changing.add(name)
+            elif name in self._changing:
+                if stat == previous:
+                    # Unchanged for a whole interval: treat as closed after write
+                    events.append(FileEvent(EVENT_CLOSED, path))
+                    self._changing.discard(name)
+            elif stat != previous:
+                # An existing file was rewritten
+                events.append(FileEvent(EVENT_MODIFIED, path))
+                self._changing.add(name)
+
+        self._changing.intersection_update(current)
+        self._entries = current
+        return events
+
+    def read_events(self, timeout=None):
+        """Wait up to timeout seconds and return the list of new events"""
+        now = time.time()
+        wait = max(0.0, self._next_scan - now)
+        if timeout is not None and timeout < wait:
+            time.sleep(timeout)
+            return []
+        time.sleep(wait)
+        self._next_scan = time.time() + self.interval
+        return self._poll()
+
+    def close(self):
+        self._entries = {}
+        self._changing.clear()
+
+
+class InotifyWatcher:
+    """Linux backend using inotify; reports close-after-write and moved-in entries only"""
+
+    name = "inotify"
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    _EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, folder_path):
+        import ctypes
+        import ctypes.util
+
+        self.folder_path = folder_path
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder_path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"inotify_add_watch failed for {folder_path}")
+
+    def read_events(self, timeout=None):
+        """Block up to timeout seconds for kernel notifications"""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset + self._EVENT_HEADER.size <= len(data):
+            _, mask, _, name_len = self._EVENT_HEADER.unpack_from(data, offset)
+            offset += self._EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b"\0")
+            offset += name_len
+
+            if mask & self.IN_Q_OVERFLOW:
+                logger.warning("inotify queue overflowed, some downloads may have been missed")
+                continue
+            if mask & self.IN_ISDIR or not name:
+                continue
+
+            path = os.path.join(self.folder_path, os.fsdecode(name))
+            if mask & self.IN_CLOSE_WRITE:
+                events.append(FileEvent(EVENT_CLOSED, path))
+            elif mask & self.IN_MOVED_TO:
+                events.append(FileEvent(EVENT_MOVED, path))
+            elif mask & self.IN_CREATE:
+                events.append(FileEvent(EVENT_CREATED, path))
+        return events
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class WindowsWatcher:
+    """Windows backend using ReadDirectoryChangesW on a background thread"""
+
+    name = "windows"
+
+    FILE_LIST_DIRECTORY = 0x0001
+    FILE_ACTION_ADDED = 1
+    FILE_ACTION_MODIFIED = 3
+    FILE_ACTION_RENAMED_NEW_NAME = 5
+
+    def __init__(self, folder_path):
+        import win32con
+        import win32file
+
+        self.folder_path = folder_path
+        self._win32file = win32file
+        self._events = queue.Queue()
+        self._handle = win32file.CreateFile(
+            folder_path,
+            self.FILE_LIST_DIRECTORY,
+            win32con.FILE_SHARE_READ | win32con.FILE_SHARE_WRITE | win32con.FILE_SHARE_DELETE,
+            None,
+            win32con.OPEN_EXISTING,
+            win32con.FILE_FLAG_BACKUP_SEMANTICS,
+            None,
+        )
+        # Size and last-write changes report downloads written in place after an empty ADDED
+        self._filter = (win32con.FILE_NOTIFY_CHANGE_FILE_NAME | win32con.FILE_NOTIFY_CHANGE_SIZE
+                        | win32con.FILE_NOTIFY_CHANGE_LAST_WRITE)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="viber-folder-watcher", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self._running:
+            try:
+                results = self._win32file.ReadDirectoryChangesW(self._handle, 64 * 1024, False, self._filter, None, None)
+            except Exception as e:
+                if self._running:
+                    logger.error("Error reading folder changes: %s", e)
+                    time.sleep(1)
+                continue
+            for action, name in results:
+                path = os.path.join(self.folder_path, name)
+                if action == self.FILE_ACTION_ADDED:
+                    self._events.put(FileEvent(EVENT_CREATED, path))
+                elif action == self.FILE_ACTION_RENAMED_NEW_NAME:
+                    self._events.put(FileEvent(EVENT_MOVED, path))
+                elif action == self.FILE_ACTION_MODIFIED:
+                    self._events.put(FileEvent(EVENT_MODIFIED, path))
+
+    def read_events(self, timeout=None):
+        """Return queued events, waiting up to timeout seconds for the first one"""
+        try:
+            events = [self._events.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                events.append(self._events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def close(self):
+        self._running = False
+        try:
+            self._handle.Close()
+        except Exception:
+            pass
+
+
+# Registered backends in order of preference: (name, factory, is_available)
+_BACKENDS = []
+
+
+def register_backend(name, factory, is_available=None, first=False):
+    """Register a watcher backend; factory(folder_path) must return an object with read_events() and close()"""
+    entry = (name, factory, is_available or (lambda: True))
+    if first:
+        _BACKENDS.insert(0, entry)
+    else:
+        _BACKENDS.append(entry)
+
+
+def available_backends():
+    """Names of the registered backends usable on this platform"""
+    return [name for name, _, is_available in _BACKENDS if is_available()]
+
+
+def create_watcher(folder_path, backend="auto"):
+    """Create a watcher for folder_path, picking the best available backend for 'auto'"""
+    for name, factory, is_available in _BACKENDS:
+        if backend not in ("auto", name):
+            continue
+        if not is_available():
+            if backend == name:
+                raise RuntimeError(f"Watcher backend '{name}' is not available on this platform")
+            continue
+        try:
+            return factory(folder_path)
+        except Exception as e:
+            if backend == name:
+                raise
+            logger.warning("Watcher backend '%s' failed to start (%s), trying the next one", name, e)
+    raise RuntimeError(f"No usable watcher backend for '{backend}'")
+
+
+def _has_module(module_name):
+    try:
+        __import__(module_name)
+        return True
+    except ImportError:
+        return False
+
+
+register_backend("inotify", InotifyWatcher, lambda: sys.platform.startswith("linux"))
+register_backend("windows", WindowsWatcher, lambda: sys.platform == "win32" and _has_module("win32file"))
+register_backend("scandir", ScandirWatcher)
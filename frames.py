@@ -0,0 +1,91 @@
+"""Frame geometry shared by capture, archiving and OCR.
+
+The regions of interest are fractions of the Viber window. A partial capture (only
+the regions, or a cropped archive copy) records where it sits in the full frame so
+the regions can still be found in it. Only Pillow is needed, so the capture agent
+can use this without OpenCV or the OCR stack.
+"""
+
+# Regions of interest (ROIs) based on the screenshots provided
+# These values are percentages of the Viber window (or full screen) size
+ROIS = {
+    'header': {
+        'top': 0.08,  # 8% from top
+        'left': 0.4,  # 40% from left
+        'bottom': 0.15,  # 15% from top
+        'right': 0.85  # 85% from left
+    },
+    'transaction_info': {
+        'top': 0.3,  # 30% from top
+        'left': 0.3,  # 30% from left
+        'bottom': 0.7,  # 70% from top
+        'right': 0.85  # 85% from left
+    },
+    'bank_details': {
+        'top': 0.6,  # 60% from top
+        'left': 0.4,  # 40% from left
+        'bottom': 0.9,  # 90% from top
+        'right': 0.9  # 90% from left
+    }
+}
+
+# Key under which a partial capture records where it sits in the full frame:
+# "offset_x,offset_y,frame_width,frame_height"
+FRAME_INFO_KEY = "viber_frame"
+EXIF_IMAGE_DESCRIPTION = 0x010E
+
+
+def regions_bounding_box(frame_width, frame_height, rois=None):
+    """Return (left, top, right, bottom) of the union of all ROIs in frame pixels"""
+    rois = ROIS if rois is None else rois
+    left = min(int(frame_width * c['left']) for c in rois.values())
+    top = min(int(frame_height * c['top']) for c in rois.values())
+    right = max(int(frame_width * c['right']) for c in rois.values())
+    bottom = max(int(frame_height * c['bottom']) for c in rois.values())
+    return left, top, right, bottom
+
+
+def frame_geometry(screenshot):
+    """Return (offset_x, offset_y, frame_width, frame_height) of the frame the ROIs refer to"""
+    info = getattr(screenshot, "info", None) or {}
+    frame = info.get(FRAME_INFO_KEY)
+    if not frame and info.get("exif"):
+        # JPEG and WebP archives keep it in the EXIF image description instead. The raw
+        # EXIF block survives convert(), which resets .format, so it is read from info
+        from PIL import Image
+        exif = Image.Exif()
+        exif.load(info["exif"])
+        description = exif.get(EXIF_IMAGE_DESCRIPTION)
+        if isinstance(description, str) and description.startswith(FRAME_INFO_KEY + "="):
+            frame = description[len(FRAME_INFO_KEY) + 1:]
+    if frame:
+        if isinstance(frame, str):
+            frame = [int(value) for value in frame.split(",")]
+        return tuple(frame)
+    width, height = screenshot.size
+    return 0, 0, width, height
+
+
+def frame_pnginfo(screenshot):
+    """PNG metadata that keeps the frame geometry of a partial capture when it is saved"""
+    frame = screenshot.info.get(FRAME_INFO_KEY)
+    if not frame:
+        return None
+    from PIL import PngImagePlugin
+    pnginfo = PngImagePlugin.PngInfo()
+    pnginfo.add_text(FRAME_INFO_KEY, frame if isinstance(frame, str) else ",".join(str(v) for v in frame))
+    return pnginfo
+
+
+def frame_save_options(screenshot, image_format):
+    """Keyword arguments for Image.save that keep the frame geometry in a PNG, JPEG or WebP file"""
+    frame = screenshot.info.get(FRAME_INFO_KEY)
+    if not frame:
+        return {}
+    if image_format.lower() == "png":
+        return {"pnginfo": frame_pnginfo(screenshot)}
+    from PIL import Image
+    exif = Image.Exif()
+    value = frame if isinstance(frame, str) else ",".join(str(v) for v in frame)
+    exif[EXIF_IMAGE_DESCRIPTION] = f"{FRAME_INFO_KEY}={value}"
+    return {"exif": exif.tobytes()}
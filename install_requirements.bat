@@ -1,11 +1,17 @@
 @echo off
 echo Installing required Python packages for Viber file rename script...
-pip install pyautogui pywin32 pytesseract pillow opencv-python
+pip install pywin32 pytesseract pillow opencv-python
+echo.
+echo Optional: install tesserocr for faster in-process OCR (uses the same Tesseract data):
+echo pip install tesserocr
+echo.
+echo Optional: install PyMuPDF to read PDF attachments:
+echo pip install pymupdf
 echo.
 echo Note: You also need to install Tesseract OCR from:
 echo https://github.com/UB-Mannheim/tesseract/wiki
 echo.
 echo After installing Tesseract OCR, make sure to update the path in the script to match your installation:
-echo pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+echo TESSERACT_CMD = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 echo.
 pause 
\ No newline at end of file
@@ -0,0 +1,219 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Attachment states recorded in the journal
+STATE_BASELINE = "baseline"  # Already in the folder when the journal was created; never processed
+STATE_DETECTED = "detected"  # Seen by the watcher, waiting for the download to finish
+STATE_STABLE = "stable"  # Download finished, waiting for capture
+STATE_CAPTURED = "captured"  # Conversation captured (or details reused), waiting for OCR/rename
+STATE_RENAMING = "renaming"  # Rename to output_path started
+STATE_RENAMED = "renamed"  # Moved to output_path
+STATE_SKIPPED = "skipped"  # Deliberately not renamed (temporary or already processed)
+STATE_FAILED = "failed"  # Rename failed; error holds the reason
+
+# States an attachment can be left in by a crash; these are resumed on startup
+IN_FLIGHT_STATES = (STATE_DETECTED, STATE_STABLE, STATE_CAPTURED, STATE_RENAMING)
+# States after which the same file (same path and content) is never processed again
+DONE_STATES = (STATE_BASELINE, STATE_RENAMED, STATE_SKIPPED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS attachments (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    digest TEXT,
+    state TEXT NOT NULL,
+    fields TEXT,
+    output_path TEXT,
+    error TEXT,
+    detected_at REAL,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS attachments_folder_state ON attachments (folder, state);
+CREATE INDEX IF NOT EXISTS attachments_digest ON attachments (digest);
+CREATE INDEX IF NOT EXISTS attachments_output ON attachments (output_path);
+CREATE TABLE IF NOT EXISTS folders (
+    folder TEXT PRIMARY KEY,
+    initialized_at REAL
+);
+"""
+
+
+def path_key(path):
+    """Normalized form of a path used to identify an attachment"""
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _file_stat(path):
+    """(size, mtime_ns) of a file, or (None, None) if it cannot be read"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None, None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class ProcessingJournal:
+    """SQLite (WAL mode) record of every attachment's identity, fields, output and state"""
+
+    def __init__(self, db_path):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # WAL with synchronous=NORMAL survives application crashes without an fsync per update
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            cursor = self._db.execute(sql, params)
+            self._db.commit()
+            return cursor
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def folder_initialized(self, folder):
+        return bool(self._query("SELECT 1 FROM folders WHERE folder = ?", (path_key(folder),)))
+
+    def initialize_folder(self, folder, paths):
+        """Record the files already present on first use as baseline (never processed)"""
+        folder_key = path_key(folder)
+        now = time.time()
+        rows = [(path_key(path), os.path.abspath(path), folder_key, *_file_stat(path), STATE_BASELINE, now, now)
+                for path in paths]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO attachments (key, path, folder, size, mtime_ns, state, detected_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._db.execute("INSERT OR REPLACE INTO folders (folder, initialized_at) VALUES (?, ?)", (folder_key, now))
+            self._db.commit()
+
+    def new_files(self, folder, paths):
+        """The paths that are not the file recorded under their name (one indexed query)
+
+        Viber reuses names such as IMG_0001.jpg, so a recorded name only counts as the
+        same file while its size and mtime match; a renamed file's old name always
+        holds a new one.
+        """
+        rows = self._query("SELECT key, state, size, mtime_ns FROM attachments WHERE folder = ?", (path_key(folder),))
+        known = {key: (state, size, mtime_ns) for key, state, size, mtime_ns in rows}
+        new = []
+        for path in paths:
+            record = known.get(path_key(path))
+            if record is None or record[0] == STATE_RENAMED:
+                new.append(path)
+            elif record[1] is not None and _file_stat(path) not in ((None, None), record[1:]):
+                new.append(path)
+        return new
+
+    def in_flight(self, folder):
+        """Attachments of this folder that a previous run left unfinished: (path, state, output_path)"""
+        placeholders = ",".join("?" for _ in IN_FLIGHT_STATES)
+        return self._query(
+            f"SELECT path, state, output_path FROM attachments WHERE folder = ? AND state IN ({placeholders})",
+            (path_key(folder),) + IN_FLIGHT_STATES,
+        )
+
+    def get(self, path):
+        """Return the journal row for path as a dict, or None"""
+        with self._lock:
+            cursor = self._db.execute("SELECT * FROM attachments WHERE key = ?", (path_key(path),))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            record = dict(zip([column[0] for column in cursor.description], row))
+        if record.get("fields"):
+            record["fields"] = json.loads(record["fields"])
+        return record
+
+    def record_detected(self, path):
+        """Start (or restart) tracking a file the watcher reported, forgetting any earlier file of that name"""
+        now = time.time()
+        self._execute(
+            "INSERT INTO attachments (key, path, folder, state, detected_at, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET path = excluded.path, state = excluded.state, error = NULL, "
+            "output_path = NULL, size = NULL, mtime_ns = NULL, digest = NULL, fields = NULL, "
+            "detected_at = excluded.detected_at, updated_at = excluded.updated_at",
+            (path_key(path), os.path.abspath(path), path_key(os.path.dirname(os.path.abspath(path))),
+             STATE_DETECTED, now, now),
+        )
+
+    def update(self, path, state, **values):
+        """Move an attachment to a new state, storing any of size, mtime_ns, digest, fields, output_path, error"""
+        if "fields" in values and values["fields"] is not None:
+            values["fields"] = json.dumps(values["fields"])
+        if values.get("output_path"):
+            values["output_path"] = os.path.abspath(values["output_path"])
+        columns = ["state = ?", "updated_at = ?"] + [f"{column} = ?" for column in values]
+        params = [state, time.time()] + list(values.values()) + [path_key(path)]
+        cursor = self._execute(f"UPDATE attachments SET {', '.join(columns)} WHERE key = ?", params)
+        if cursor.rowcount == 0:
+            # Not detected through the watcher (e.g. processed directly); create the row
+            self.record_detected(path)
+            self._execute(f"UPDATE attachments SET {', '.join(columns)} WHERE key = ?", params)
+
+    def is_processed(self, path, digest=None):
+        """True if this file (same path and content) was already handled or is the output of a rename"""
+        if self._query("SELECT 1 FROM attachments WHERE output_path = ? AND state = ? LIMIT 1",
+                       (os.path.abspath(path), STATE_RENAMED)):
+            return True
+        record = self.get(path)
+        if record is None or record["state"] not in DONE_STATES:
+            return False
+        return digest is None or record["digest"] in (None, digest)
+
+    def find_by_digest(self, digest):
+        """Most recent renamed attachment with this content hash, as a dict, or None"""
+        rows = self._query(
+            "SELECT path, output_path, fields FROM attachments WHERE digest = ? AND state = ? "
+            "ORDER BY updated_at DESC LIMIT 1",
+            (digest, STATE_RENAMED),
+        )
+        if not rows:
+            return None
+        path, output_path, fields = rows[0]
+        return {"path": path, "output_path": output_path, "fields": json.loads(fields) if fields else None}
+
+    def counts(self):
+        """Number of attachments per state"""
+        return dict(self._query("SELECT state, COUNT(*) FROM attachments GROUP BY state"))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_journal = None
+
+
+def open_journal(db_path):
+    """Open the shared journal (None disables journaling)"""
+    global _journal
+    close_journal()
+    _journal = ProcessingJournal(db_path) if db_path else None
+    return _journal
+
+
+def get_journal():
+    return _journal
+
+
+def close_journal():
+    global _journal
+    if _journal is not None:
+        _journal.close()
+        _journal = None
@@ -0,0 +1,149 @@
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from metrics import counter, span
+
+# Layout analysis finds the text blocks (chat header, message bubbles) inside each
+# region so that only those tight boxes are OCR'd instead of the whole region.
+
+LAYOUT_SCALE = 0.25  # The analysis runs on a frame downscaled by this factor
+MIN_BLOCK_AREA = 24  # Blocks smaller than this (in downscaled pixels) are noise
+BOX_PADDING = 6  # Pixels added around each block at full resolution so no glyph is clipped
+LAYOUT_CACHE_SIZE = 32  # Layouts remembered (one per region, window size and DPI)
+LAYOUT_MAX_REUSE = 100  # Cache hits before a layout is analyzed afresh, dropping blocks whose text went away
+BACKGROUND_TOLERANCE = 32  # Largest gray-level change outside the cached blocks that still counts as the same layout
+DEFAULT_DPI = 96
+
+_cache = OrderedDict()  # (region name, region box, dpi) -> (blocks relative to the region, background, hits)
+_cache_lock = threading.Lock()
+_results = counter("layout_lookups_total", "Layout lookups by result (cached, new, unsegmented)")
+
+
+def text_mask(gray_box, scale=LAYOUT_SCALE):
+    """Binary mask of text-like pixels in a downscaled copy of a grayscale region"""
+    height, width = gray_box.shape[:2]
+    small = cv2.resize(gray_box, (max(1, int(width * scale)), max(1, int(height * scale))),
+                       interpolation=cv2.INTER_AREA)
+    # The morphological gradient marks glyph edges whatever the text and background colors
+    gradient = cv2.morphologyEx(small, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, mask = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    if cv2.countNonZero(mask) > mask.size * 0.5:
+        # Mostly "edges": a photo or noisy background, not something this analysis can segment
+        return None
+    return mask
+
+
+def find_blocks(mask, scale=LAYOUT_SCALE):
+    """Bounding boxes (top, left, bottom, right) of text blocks in the mask, in full-size pixels"""
+    # Join the characters of a line, then neighbouring lines of the same bubble
+    joined = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 1)))
+    joined = cv2.dilate(joined, cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)))
+    contours, _ = cv2.findContours(joined, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    blocks = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w * h < MIN_BLOCK_AREA:
+            continue
+        blocks.append((int(y / scale), int(x / scale), int((y + h) / scale), int((x + w) / scale)))
+    return merge_boxes(blocks)
+
+
+def merge_boxes(boxes, padding=BOX_PADDING):
+    """Pad boxes and merge the ones that overlap, top to bottom"""
+    padded = sorted((top - padding, left - padding, bottom + padding, right + padding)
+                    for top, left, bottom, right in boxes)
+    merged = []
+    for box in padded:
+        for index, other in enumerate(merged):
+            if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+                merged[index] = (min(box[0], other[0]), min(box[1], other[1]),
+                                 max(box[2], other[2]), max(box[3], other[3]))
+                break
+        else:
+            merged.append(box)
+    if len(merged) < len(padded):
+        # A merge can make a box overlap one merged earlier
+        return merge_boxes(merged, padding=0)
+    return sorted(merged)
+
+
+def uncovered(mask, boxes, scale=LAYOUT_SCALE):
+    """Copy of the mask without the text pixels that fall inside the boxes"""
+    remaining = mask.copy()
+    for top, left, bottom, right in boxes:
+        remaining[max(0, int(top * scale)):int(bottom * scale) + 1, max(0, int(left * scale)):int(right * scale) + 1] = 0
+    return remaining
+
+
+def background(region, blocks, scale=LAYOUT_SCALE):
+    """Downscaled copy of a grayscale region with the blocks blanked out"""
+    height, width = region.shape[:2]
+    small = cv2.resize(region, (max(1, int(width * scale)), max(1, int(height * scale))),
+                       interpolation=cv2.INTER_AREA)
+    return uncovered(small, blocks, scale)
+
+
+def text_boxes(gray, region_box, key):
+    """Tight text boxes inside region_box (top, left, bottom, right) of the grayscale image
+
+    key identifies the region, window size and DPI. The blocks found for a key are
+    reused, without analyzing the region again, while everything outside them
+    looks as it did when they were found; any change there (a longer message
+    bubble, a scrolled chat), or LAYOUT_MAX_REUSE hits, triggers a fresh analysis
+    whose blocks replace the cached ones. Returns boxes in image pixels, [] if the
+    region is blank, or None if it cannot be segmented (the caller should then OCR
+    the whole region).
+    """
+    top, left, bottom, right = region_box
+    region = gray[top:bottom, left:right]
+    if region.size == 0:
+        return []
+
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+    if (cached is not None and cached[2] < LAYOUT_MAX_REUSE
+            and np.max(cv2.absdiff(background(region, cached[0]), cached[1])) <= BACKGROUND_TOLERANCE):
+        blocks = cached[0]
+        with _cache_lock:
+            if _cache.get(key) is cached:
+                _cache[key] = (blocks, cached[1], cached[2] + 1)
+        _results.inc(result="cached")
+    else:
+        mask = text_mask(region)
+        if mask is None:
+            _results.inc(result="unsegmented")
+            return None
+        if cv2.countNonZero(mask) == 0:
+            return []
+        with span("layout_analysis"):
+            blocks = find_blocks(mask)
+        _results.inc(result="new")
+        with _cache_lock:
+            _cache[key] = (blocks, background(region, blocks), 0)
+            _cache.move_to_end(key)
+            while len(_cache) > LAYOUT_CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    # Blocks are relative to the region; clip them to it and return image coordinates
+    height, width = region.shape[:2]
+    boxes = []
+    for block_top, block_left, block_bottom, block_right in blocks:
+        block = (max(0, block_top), max(0, block_left), min(height, block_bottom), min(width, block_right))
+        if block[2] > block[0] and block[3] > block[1]:
+            boxes.append((top + block[0], left + block[1], top + block[2], left + block[3]))
+    return boxes
+
+
+def layout_key(region_name, region_box, dpi=None):
+    """Cache key of a region's layout: its pixel box (which follows the window size) and the screen DPI"""
+    return (region_name, tuple(region_box), dpi or DEFAULT_DPI)
+
+
+def clear_layout_cache():
+    with _cache_lock:
+        _cache.clear()
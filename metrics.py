@@ -0,0 +1,374 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Latency histogram bucket upper bounds (in seconds)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Prefix of every exported metric name
+METRIC_PREFIX = "viber_"
+# Seconds between rewrites of the Prometheus text file
+EXPORT_INTERVAL = 15
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key):
+    if not key:
+        return ""
+    escaped = []
+    for name, value in key:
+        value = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonically increasing count, one series per label set"""
+
+    kind = "counter"
+
+    def __init__(self, name, help=""):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """Mirror a running total kept elsewhere (e.g. a cache's hit count), read by a collector"""
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = max(value, self._values.get(key, 0))
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    """Value that can go up and down (queue depths, items in flight)"""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set (Prometheus histogram)"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help="", buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    samples.append((self.name + "_bucket", key + (("le", _format_value(float(bound))),), count))
+                samples.append((self.name + "_bucket", key + (("le", "+Inf"),), series[-1]))
+                samples.append((self.name + "_sum", key, round(series[-2], 6)))
+                samples.append((self.name + "_count", key, series[-1]))
+        return samples
+
+
+class Registry:
+    """Named metrics plus collectors that refresh gauges just before an export"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help):
+        name = name if name.startswith(METRIC_PREFIX) else METRIC_PREFIX + name
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help)
+            return metric
+
+    def counter(self, name, help=""):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help=""):
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name, help=""):
+        return self._get(Histogram, name, help)
+
+    def add_collector(self, collector):
+        """Register a callable run before every export (e.g. to read queue depths)"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        with self._lock:
+            if collector in self._collectors:
+                self._collectors.remove(collector)
+
+    def render(self):
+        """Prometheus text exposition format of every metric"""
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = sorted(self._metrics.items())
+        for collector in collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning("Metrics collector failed: %s", e)
+        lines = []
+        for name, metric in metrics:
+            if metric.help:
+                lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for sample_name, key, value in metric.samples():
+                lines.append(f"{sample_name}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help=""):
+    return REGISTRY.counter(name, help)
+
+
+def gauge(name, help=""):
+    return REGISTRY.gauge(name, help)
+
+
+def histogram(name, help=""):
+    return REGISTRY.histogram(name, help)
+
+
+class TraceWriter:
+    """Appends one JSON object per finished span to a file"""
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+_tracer = None
+
+
+def configure_tracing(path):
+    """Write JSON-lines traces to path (None disables tracing)"""
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+    _tracer = TraceWriter(path) if path else None
+
+
+def trace(name, duration=None, **attrs):
+    """Record a trace event; a no-op unless tracing is configured"""
+    if _tracer is None:
+        return
+    record = {"ts": round(time.time(), 3), "span": name, "thread": threading.current_thread().name}
+    if duration is not None:
+        record["duration_ms"] = round(duration * 1000, 2)
+    record.update(attrs)
+    try:
+        _tracer.write(record)
+    except Exception as e:
+        logger.warning("Could not write trace: %s", e)
+
+
+@contextmanager
+def span(name, labels=None, **attrs):
+    """Time a block: observes viber_<name>_seconds{labels} and writes a trace record
+
+    labels become metric labels and must have few distinct values (e.g. a region
+    name); attrs such as file paths only go into the trace.
+    """
+    labels = labels or {}
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        histogram(f"{name}_seconds", f"Latency of {name.replace('_', ' ')}").observe(duration, **labels)
+        if error is not None:
+            counter("errors_total", "Exceptions raised inside timed spans").inc(span=name)
+            attrs["error"] = error
+        trace(name, duration, **{**labels, **attrs})
+
+
+def timed(name):
+    """Decorator form of span() for whole functions"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Start times of files between detection and rename, keyed like the pipeline
+_marks = {}
+_marks_lock = threading.Lock()
+
+
+def mark(key):
+    """Remember when key (e.g. a detected file) entered the system"""
+    with _marks_lock:
+        _marks.setdefault(key, time.time())
+
+
+def elapsed_since_mark(key, name=None, **labels):
+    """Pop key's mark and return the seconds since; observed as viber_<name>_seconds if name is given"""
+    with _marks_lock:
+        started = _marks.pop(key, None)
+    if started is None:
+        return None
+    elapsed = time.time() - started
+    if name:
+        histogram(f"{name}_seconds", f"Seconds from {name.replace('_', ' ')}").observe(elapsed, **labels)
+    return elapsed
+
+
+def write_prometheus_file(path):
+    """Write the metrics atomically so a scraper (e.g. node_exporter's textfile collector) never reads half a file"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(REGISTRY.render())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Metrics request: " + format, *args)
+
+
+class MetricsExporter:
+    """Serves /metrics over HTTP and/or rewrites a Prometheus text file periodically"""
+
+    def __init__(self, file_path=None, port=None, host="127.0.0.1", interval=EXPORT_INTERVAL):
+        self.file_path = file_path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._server = None
+        self._threads = []
+        if port is not None:
+            self._server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            self._start(self._server.serve_forever, "metrics-http")
+            logger.info("Serving metrics on http://%s:%d/metrics", host, self._server.server_address[1])
+        if file_path:
+            directory = os.path.dirname(file_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._start(self._write_loop, "metrics-file")
+
+    def _start(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _write_loop(self):
+        while True:
+            try:
+                write_prometheus_file(self.file_path)
+            except Exception as e:
+                logger.warning("Could not write metrics file %s: %s", self.file_path, e)
+            if self._stop.wait(self.interval):
+                break
+
+    def close(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for thread in self._threads:
+            thread.join(5)
+        if self.file_path:
+            try:
+                # Final snapshot so the file reflects everything processed before exit
+                write_prometheus_file(self.file_path)
+            except Exception as e:
+                logger.warning("Could not write metrics file %s: %s", self.file_path, e)
+
+
+_exporter = None
+
+
+def start_exporter(file_path=None, port=None, host="127.0.0.1", interval=EXPORT_INTERVAL):
+    """Start the shared exporter (nothing is started when neither a file nor a port is given)"""
+    global _exporter
+    stop_exporter()
+    if file_path or port is not None:
+        _exporter = MetricsExporter(file_path, port, host, interval)
+    return _exporter
+
+
+def stop_exporter():
+    global _exporter
+    if _exporter is not None:
+        _exporter.close()
+        _exporter = None
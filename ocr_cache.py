@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Default cache settings (can be changed with configure_caches)
+CACHE_MAX_ENTRIES = 512  # Entries kept in memory per cache level
+ATTACHMENT_CACHE_TTL = 7 * 24 * 3600  # Seconds an attachment's extraction stays valid
+VIEW_CACHE_TTL = 120  # Seconds an unchanged conversation view may reuse its OCR text
+DISK_MAX_ENTRIES = 20000  # Rows kept per cache level in the on-disk store
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class ExtractionCache:
+    """Thread-safe LRU cache with a time-to-live and an optional SQLite store behind it"""
+
+    def __init__(self, name, max_entries=CACHE_MAX_ENTRIES, ttl=None, db_path=None, disk_max_entries=DISK_MAX_ENTRIES):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_max_entries = disk_max_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache (level TEXT, key TEXT, stored_at REAL, value TEXT, "
+            "PRIMARY KEY (level, key))"
+        )
+        self._db.commit()
+
+    def _expired(self, stored_at, now):
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[0], now):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT stored_at, value FROM cache WHERE level = ? AND key = ?", (self.name, key)
+                ).fetchone()
+                if row and not self._expired(row[0], now):
+                    value = json.loads(row[1])
+                    self._remember(key, row[0], value)
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def _remember(self, key, stored_at, value):
+        self._entries[key] = (stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, key, value):
+        """Store a JSON-serializable value under key"""
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache (level, key, stored_at, value) VALUES (?, ?, ?, ?)",
+                    (self.name, key, now, json.dumps(value)),
+                )
+                # Keep the store bounded by dropping the oldest rows of this level
+                self._db.execute(
+                    "DELETE FROM cache WHERE level = ? AND key NOT IN "
+                    "(SELECT key FROM cache WHERE level = ? ORDER BY stored_at DESC LIMIT ?)",
+                    (self.name, self.name, self.disk_max_entries),
+                )
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def file_digest(path):
+    """Streaming content hash of a file, read in fixed-size chunks"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def view_hash(regions):
+    """Content hash of grayscale ROI arrays at full resolution
+
+    This is deliberately an exact hash, not a perceptual one. Every pixel counts:
+    on a downscaled or quantized copy two receipts that differ in a single digit
+    of the amount can hash alike and reuse the wrong OCR text. An unchanged view
+    is captured from the same window at the same size, so its pixels repeat
+    exactly and tolerance would buy no extra hits.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    for roi in regions:
+        digest.update(repr(roi.shape).encode())
+        digest.update(roi.tobytes())
+    return digest.hexdigest()
+
+
+_attachment_cache = None
+_view_cache = None
+_caches_lock = threading.Lock()
+
+
+def configure_caches(enabled=True, max_entries=CACHE_MAX_ENTRIES, attachment_ttl=ATTACHMENT_CACHE_TTL,
+                     view_ttl=VIEW_CACHE_TTL, db_path=None):
+    """Create (or disable, with enabled=False) the attachment and conversation-view caches"""
+    global _attachment_cache, _view_cache
+    with _caches_lock:
+        for cache in (_attachment_cache, _view_cache):
+            if cache is not None:
+                cache.close()
+        if not enabled:
+            _attachment_cache = _view_cache = None
+            return
+        _attachment_cache = ExtractionCache("attachment", max_entries, attachment_ttl, db_path)
+        # The view cache only helps for a burst from one conversation, so it stays in memory
+        _view_cache = ExtractionCache("view", max_entries, view_ttl)
+
+
+def get_attachment_cache():
+    """Level 1: extraction results keyed by the attachment's content hash (None if disabled)"""
+    return _attachment_cache
+
+
+def get_view_cache():
+    """Level 2: OCR text keyed by a hash of the header and transaction region pixels (None if disabled)"""
+    return _view_cache
+
+
+def cache_stats():
+    stats = {}
+    for cache in (_attachment_cache, _view_cache):
+        if cache is not None:
+            stats[cache.name] = cache.stats()
+    return stats
+
+
+def format_cache_stats():
+    parts = []
+    for name, stat in cache_stats().items():
+        parts.append(f"{name} {stat['hits'] + stat['disk_hits']} hits/{stat['misses']} misses")
+    return "Cache: " + ", ".join(parts) if parts else "Cache: disabled"
@@ -0,0 +1,410 @@
+import json
+import logging
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Default pool settings (can be changed with configure_pool)
+OCR_ENGINE = "auto"  # "auto", "tesserocr" (in-process, model stays loaded) or "pytesseract"
+OCR_POOL_SIZE = 3  # Number of long-lived OCR workers
+OCR_TIMEOUT = 15  # Seconds to wait for a single OCR call
+OCR_LANG = "eng"
+TESSERACT_CMD = None  # Path of the tesseract executable; None finds it on the PATH
+
+
+# A recognized word, its confidence (0-100) and its character offsets in OcrResult.text
+OcrWord = namedtuple("OcrWord", ["text", "confidence", "start", "end"])
+# Text rebuilt from the recognized words (one line per text line) plus the words themselves
+OcrResult = namedtuple("OcrResult", ["text", "words"])
+
+EMPTY_RESULT = OcrResult("", [])
+
+# Tesseract settings for one region; None leaves Tesseract's default. psm is the page
+# segmentation mode (e.g. 6 = one block of text, 7 = a single line), oem the engine mode
+# (1 = LSTM only), whitelist the only characters recognized and scale resizes the image
+OcrProfile = namedtuple("OcrProfile", ["psm", "oem", "lang", "whitelist", "scale"], defaults=(None,) * 5)
+DEFAULT_PROFILE = OcrProfile()
+
+
+def build_result(items):
+    """Build an OcrResult from (word, confidence, line_key) tuples in reading order"""
+    parts = []
+    words = []
+    offset = 0
+    previous_line = None
+    for text, confidence, line_key in items:
+        text = text.strip()
+        if not text:
+            continue
+        if previous_line is not None:
+            separator = " " if line_key == previous_line else "\n"
+            parts.append(separator)
+            offset += 1
+        previous_line = line_key
+        parts.append(text)
+        words.append(OcrWord(text, float(confidence), offset, offset + len(text)))
+        offset += len(text)
+    return OcrResult("".join(parts), words)
+
+
+def join_results(results, separator="\n"):
+    """Concatenate several OcrResults, shifting the word offsets into the joined text"""
+    parts = []
+    words = []
+    offset = 0
+    for result in results:
+        if not result.text:
+            continue
+        if parts:
+            parts.append(separator)
+            offset += len(separator)
+        parts.append(result.text)
+        words.extend(word._replace(start=word.start + offset, end=word.end + offset) for word in result.words)
+        offset += len(result.text)
+    return OcrResult("".join(parts), words)
+
+
+def span_confidence(words, start, end):
+    """Lowest confidence of the words overlapping text[start:end], or None if none overlap"""
+    confidences = [word.confidence for word in words if word.start < end and word.end > start]
+    return min(confidences) if confidences else None
+
+
+def set_tesseract_cmd(path):
+    """Use the tesseract executable at path (its tessdata folder also serves tesserocr)"""
+    global TESSERACT_CMD
+    TESSERACT_CMD = path
+
+
+def _tessdata_path():
+    """Locate the tessdata folder next to the configured tesseract executable"""
+    prefix = os.environ.get("TESSDATA_PREFIX")
+    if prefix:
+        return prefix
+    cmd = TESSERACT_CMD
+    if cmd and os.path.isabs(cmd):
+        path = os.path.join(os.path.dirname(cmd), "tessdata")
+        if os.path.isdir(path):
+            return path
+    return None
+
+
+def _to_pil(image):
+    """Wrap a numpy array as a PIL image without encoding it to disk"""
+    if isinstance(image, Image.Image):
+        return image
+    return Image.fromarray(image)
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def ocr_profile(settings):
+    """Build an OcrProfile from a dict such as {"psm": 7, "whitelist": "0123456789"}, checking each value"""
+    unknown = set(settings) - set(OcrProfile._fields)
+    if unknown:
+        raise ValueError(f"Unknown OCR settings {sorted(unknown)}")
+    profile = OcrProfile(**settings)
+    # bool is an int subclass and 7.0 == 7, so check the types before the ranges
+    if profile.psm is not None and (not _is_int(profile.psm) or profile.psm not in range(14)):
+        raise ValueError(f"psm must be an integer 0-13, not {profile.psm!r}")
+    if profile.oem is not None and (not _is_int(profile.oem) or profile.oem not in range(4)):
+        raise ValueError(f"oem must be an integer 0-3, not {profile.oem!r}")
+    if profile.scale is not None and (not _is_number(profile.scale) or not 0 < profile.scale <= 4):
+        raise ValueError(f"scale must be a number above 0 and at most 4, not {profile.scale!r}")
+    for name in ("lang", "whitelist"):
+        value = getattr(profile, name)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"{name} must be a string, not {value!r}")
+    if profile.whitelist is not None and any(c.isspace() or c in "'\"" for c in profile.whitelist):
+        # pytesseract passes the whitelist on the command line
+        raise ValueError("whitelist cannot contain spaces or quotes")
+    return profile
+
+
+def profile_settings(profile):
+    """The settings of an OcrProfile that differ from Tesseract's defaults, as a dict"""
+    return {key: value for key, value in profile._asdict().items() if value is not None}
+
+
+def tesseract_config(profile):
+    """Command line options of the tesseract executable for an OcrProfile"""
+    options = []
+    if profile.psm is not None:
+        options.append(f"--psm {profile.psm}")
+    if profile.oem is not None:
+        options.append(f"--oem {profile.oem}")
+    if profile.whitelist:
+        options.append(f"-c tessedit_char_whitelist={profile.whitelist}")
+    return " ".join(options)
+
+
+def scale_image(image, scale):
+    """Resize an image (numpy array or PIL image) by scale, returning a PIL image"""
+    image = _to_pil(image)
+    if not scale or scale == 1:
+        return image
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.BILINEAR if scale > 1 else Image.BOX)
+
+
+class TesserocrEngine:
+    """In-process Tesseract API; the language model is loaded once per worker"""
+
+    name = "tesserocr"
+
+    def __init__(self, lang=OCR_LANG):
+        self.lang = lang
+        self._apis = {}  # (lang, oem) -> API; each loads its own model
+        self._api_for(DEFAULT_PROFILE)
+
+    def _api_for(self, profile):
+        """Return the API for the profile's language and engine mode, set to its other settings"""
+        import tesserocr
+
+        key = (profile.lang or self.lang, profile.oem)
+        api = self._apis.get(key)
+        if api is None:
+            options = {"lang": key[0]}
+            if profile.oem is not None:
+                options["oem"] = profile.oem
+            path = _tessdata_path()
+            if path:
+                options["path"] = path
+            api = self._apis[key] = tesserocr.PyTessBaseAPI(**options)
+        api.SetPageSegMode(tesserocr.PSM.AUTO if profile.psm is None else profile.psm)
+        api.SetVariable("tessedit_char_whitelist", profile.whitelist or "")
+        return api
+
+    def image_to_string(self, image, profile=DEFAULT_PROFILE):
+        api = self._api_for(profile)
+        api.SetImage(scale_image(image, profile.scale))
+        return api.GetUTF8Text()
+
+    def image_to_data(self, image, profile=DEFAULT_PROFILE):
+        from tesserocr import RIL, iterate_level
+
+        api = self._api_for(profile)
+        api.SetImage(scale_image(image, profile.scale))
+        api.Recognize()
+        iterator = api.GetIterator()
+        if iterator is None:
+            return EMPTY_RESULT
+        items = []
+        line = 0
+        for word in iterate_level(iterator, RIL.WORD):
+            if word.IsAtBeginningOf(RIL.TEXTLINE):
+                line += 1
+            items.append((word.GetUTF8Text(RIL.WORD) or "", word.Confidence(RIL.WORD), line))
+        return build_result(items)
+
+    def close(self):
+        for api in self._apis.values():
+            api.End()
+        self._apis = {}
+
+
+class PytesseractEngine:
+    """Fallback that runs the tesseract executable for every call"""
+
+    name = "pytesseract"
+
+    def __init__(self, lang=OCR_LANG, timeout=OCR_TIMEOUT):
+        # Imported here so tesserocr alone is enough to run the in-process engine
+        import pytesseract
+
+        if TESSERACT_CMD:
+            pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+        self._pytesseract = pytesseract
+        self.lang = lang
+        self.timeout = timeout
+
+    def image_to_string(self, image, profile=DEFAULT_PROFILE):
+        return self._pytesseract.image_to_string(scale_image(image, profile.scale), lang=profile.lang or self.lang,
+                                                 config=tesseract_config(profile), timeout=self.timeout)
+
+    def image_to_data(self, image, profile=DEFAULT_PROFILE):
+        data = self._pytesseract.image_to_data(scale_image(image, profile.scale), lang=profile.lang or self.lang,
+                                               config=tesseract_config(profile), timeout=self.timeout,
+                                               output_type=self._pytesseract.Output.DICT)
+        items = []
+        for index, text in enumerate(data["text"]):
+            line_key = (data["block_num"][index], data["par_num"][index], data["line_num"][index])
+            items.append((text, data["conf"][index], line_key))
+        return build_result(items)
+
+    def close(self):
+        pass
+
+
+def create_engine(engine=OCR_ENGINE, lang=OCR_LANG, timeout=OCR_TIMEOUT):
+    """Create a single OCR engine, preferring the in-process binding for 'auto'"""
+    if engine in ("auto", "tesserocr"):
+        try:
+            return TesserocrEngine(lang=lang)
+        except ImportError:
+            if engine == "tesserocr":
+                raise
+        except Exception as e:
+            if engine == "tesserocr":
+                raise
+            logger.warning("tesserocr could not be initialized (%s), falling back to pytesseract", e)
+    if engine in ("auto", "pytesseract"):
+        return PytesseractEngine(lang=lang, timeout=timeout)
+    raise ValueError(f"Unknown OCR engine: {engine}")
+
+
+class OcrPool:
+    """Pool of long-lived OCR workers, each owning its own engine instance"""
+
+    def __init__(self, size=OCR_POOL_SIZE, timeout=OCR_TIMEOUT, engine=OCR_ENGINE, lang=OCR_LANG):
+        self.size = size
+        self.timeout = timeout
+        self.engine = engine
+        self.lang = lang
+        self._local = threading.local()
+        self._engines = []
+        self._lock = threading.Lock()
+
+        # Tesseract's own OpenMP threads would oversubscribe the CPU when
+        # several workers run at once, so keep each worker single-threaded
+        if size > 1:
+            os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="ocr-worker")
+
+    def _worker_engine(self):
+        """Return the engine owned by the current worker thread, creating it on first use"""
+        engine = getattr(self._local, "engine", None)
+        if engine is None:
+            engine = create_engine(self.engine, lang=self.lang, timeout=self.timeout)
+            self._local.engine = engine
+            with self._lock:
+                self._engines.append(engine)
+        return engine
+
+    def _run(self, image, with_data, label, profile):
+        engine = self._worker_engine()
+        # Timed on the worker so the latency excludes time spent waiting in the queue
+        with span("ocr", labels={"region": label}, engine=engine.name):
+            if with_data:
+                return engine.image_to_data(image, profile)
+            return engine.image_to_string(image, profile)
+
+    def submit(self, image, with_data=False, label="full_frame", profile=None):
+        """Queue an image (numpy array or PIL image) for OCR; with_data returns an OcrResult future
+
+        label names the region in the OCR latency metrics and selects its OcrProfile
+        (see configure_ocr_profiles) unless profile is given.
+        """
+        if profile is None:
+            profile = get_ocr_profile(label)
+        return self._executor.submit(self._run, image, with_data, label, profile)
+
+    def image_to_string(self, image):
+        """OCR a single in-memory image, waiting at most the pool timeout"""
+        return self.submit(image).result(timeout=self.timeout)
+
+    def image_to_data(self, image):
+        """OCR a single in-memory image and return an OcrResult with word confidences"""
+        return self.submit(image, with_data=True).result(timeout=self.timeout)
+
+    def ocr_regions(self, regions, with_data=False):
+        """OCR a dict of name -> image concurrently and return name -> text (or OcrResult)"""
+        futures = {name: self.submit(image, with_data, label=name) for name, image in regions.items()}
+        texts = {}
+        for name, future in futures.items():
+            try:
+                texts[name] = future.result(timeout=self.timeout)
+            except Exception as e:
+                logger.error("OCR failed for %s: %s", name, e)
+                texts[name] = EMPTY_RESULT if with_data else ""
+        return texts
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for engine in self._engines:
+                engine.close()
+            self._engines = []
+
+
+_ocr_profiles = {}  # Region name -> OcrProfile
+_ocr_profiles_lock = threading.Lock()
+
+
+def load_ocr_profiles(path):
+    """Read per-region OCR settings from a JSON file ({"header": {"psm": 7}, ...}, as written by ocr_tuning.py)"""
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError("expected an object of region names to settings")
+    profiles = {}
+    for region, settings in config.items():
+        try:
+            profiles[region] = ocr_profile(settings)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"OCR profile '{region}': {e}") from None
+    return profiles
+
+
+def configure_ocr_profiles(profiles=None, path=None):
+    """Set the OCR settings used per region (region -> OcrProfile or settings dict), or load them from path"""
+    if path:
+        profiles = load_ocr_profiles(path)
+    profiles = {region: profile if isinstance(profile, OcrProfile) else ocr_profile(profile)
+                for region, profile in (profiles or {}).items()}
+    with _ocr_profiles_lock:
+        _ocr_profiles.clear()
+        _ocr_profiles.update(profiles)
+    return profiles
+
+
+def get_ocr_profile(region):
+    """Return the OCR settings of a region (Tesseract's defaults if none are configured)"""
+    with _ocr_profiles_lock:
+        return _ocr_profiles.get(region, DEFAULT_PROFILE)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure_pool(size=OCR_POOL_SIZE, timeout=OCR_TIMEOUT, engine=OCR_ENGINE, lang=OCR_LANG):
+    """Replace the shared OCR pool with one using the given settings"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = OcrPool(size=size, timeout=timeout, engine=engine, lang=lang)
+        return _pool
+
+
+def get_pool():
+    """Return the shared OCR pool, creating it with the default settings if needed"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = OcrPool()
+        return _pool
+
+
+def shutdown_pool():
+    """Stop the shared OCR pool's workers"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -0,0 +1,271 @@
+"""Finds the fastest Tesseract settings for each OCR region that still read the fields correctly.
+
+Usage:
+    python ocr_tuning.py [--corpus DIR] [--output ocr_profiles.json] [--target-accuracy 0.98]
+                         [--psm 3,6,7,11] [--oem default,1] [--lang eng] [--whitelist none,auto]
+                         [--scale 0.75,1,1.5]
+
+The corpus is a labeled screenshot folder in benchmark.py's format (labels.jsonl);
+without --corpus the synthetic benchmark corpus is rendered. Every region of every
+screenshot is preprocessed once, as the live extraction does, and then OCR'd with
+each combination of the settings. A combination is scored by the field accuracy
+of the whole extraction with only that region's text replaced, and timed per OCR
+call on a single engine. For each region the fastest combination that reaches the
+target accuracy (by default the accuracy with Tesseract's defaults) is written to
+the output file, which OCR_PROFILES_FILE in viber_file_rename.py loads.
+
+"auto" in --whitelist tries the characters the region was read as with the
+default settings, widened to all digits, upper and lower case letters where any
+of them occur, so the whitelist does not depend on the exact samples.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import string
+import sys
+import time
+
+from benchmark import FIELDS, load_corpus, score_fields, synthetic_corpus
+
+logger = logging.getLogger(__name__)
+
+PSM_CHOICES = "3,4,6,7,11"  # Automatic, single column, single block, single line, sparse text
+OEM_CHOICES = "default"  # "default" leaves Tesseract's choice; 1 is LSTM only, 0 needs legacy models
+WHITELIST_CHOICES = "none,auto"
+SCALE_CHOICES = "0.75,1,1.5"
+REPEAT = 1  # Times each OCR call is timed; the fastest run counts
+
+
+def _choices(text, convert):
+    """Parse a comma-separated option, mapping "default"/"none" to None"""
+    values = []
+    for item in text.split(","):
+        item = item.strip()
+        values.append(None if item.lower() in ("default", "none") else convert(item))
+    return values
+
+
+def _scale(value):
+    value = float(value)
+    return None if value == 1 else value
+
+
+def auto_whitelist(texts):
+    """Characters seen in texts, widened to whole character classes, or None if nothing was read"""
+    seen = set("".join(texts)) - set(string.whitespace) - set("'\"")
+    if not seen:
+        return None
+    for characters in (string.digits, string.ascii_uppercase, string.ascii_lowercase):
+        if seen & set(characters):
+            seen |= set(characters)
+    return "".join(sorted(seen))
+
+
+def candidate_profiles(psms, oems, langs, whitelists, scales):
+    """Every combination of the settings as OcrProfiles, Tesseract's defaults first"""
+    from ocr_engine import DEFAULT_PROFILE, OcrProfile, ocr_profile
+
+    profiles = [DEFAULT_PROFILE]
+    for settings in itertools.product(psms, oems, langs, whitelists, scales):
+        profile = ocr_profile(OcrProfile(*settings)._asdict())
+        if profile not in profiles:
+            profiles.append(profile)
+    return profiles
+
+
+def _ocr(engine, image, profile, repeat):
+    """OCR an image, returning its text and the fastest of repeat runs in milliseconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = engine.image_to_data(image, profile)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return result.text, best
+
+
+def _field_scores(labels, region_texts, rois):
+    """Fields read correctly from the combined region texts (in on-screen order)"""
+    from screenshot_extract import format_fields, parse_fields, region_spans
+
+    texts = [(name, region_texts.get(name, "")) for name in rois]
+    all_text = "\n".join(text for _, text in texts if text)
+    fields = parse_fields(all_text, region_spans(texts))
+    return sum(score_fields(labels, *format_fields(fields)).values())
+
+
+def prepare_samples(corpus, rois):
+    """Preprocess the regions of every screenshot once; returns [(labels, name -> image)]"""
+    from screenshot_extract import preprocess_regions, to_grayscale
+
+    samples = []
+    for labels, screenshot in corpus:
+        gray = to_grayscale(screenshot)
+        samples.append((labels, preprocess_regions(screenshot, gray, list(rois), rois=rois)))
+    return samples
+
+
+def evaluate(engine, samples, rois, profiles, repeat=REPEAT):
+    """OCR every region with its profile; returns accuracy, mean ms per call and the texts per sample"""
+    from ocr_engine import DEFAULT_PROFILE
+
+    correct = 0
+    latencies = []
+    texts = []
+    for labels, regions in samples:
+        region_texts = {}
+        for name, image in regions.items():
+            region_texts[name], elapsed = _ocr(engine, image, profiles.get(name, DEFAULT_PROFILE), repeat)
+            latencies.append(elapsed)
+        texts.append(region_texts)
+        correct += _field_scores(labels, region_texts, rois)
+    return _summary(correct, latencies, len(samples)), texts
+
+
+def _summary(correct, latencies, sample_count):
+    return {
+        "accuracy": round(correct / (sample_count * len(FIELDS)), 4) if sample_count else None,
+        "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else None,
+    }
+
+
+def sweep_region(engine, samples, rois, region, candidates, baseline_texts, repeat=REPEAT):
+    """Score every candidate profile for one region, keeping the default texts of the other regions"""
+    results = []
+    for profile in candidates:
+        correct = 0
+        latencies = []
+        for (labels, regions), region_texts in zip(samples, baseline_texts):
+            region_texts = dict(region_texts)
+            if region in regions:
+                region_texts[region], elapsed = _ocr(engine, regions[region], profile, repeat)
+                latencies.append(elapsed)
+            correct += _field_scores(labels, region_texts, rois)
+        result = _summary(correct, latencies, len(samples))
+        result["profile"] = profile
+        results.append(result)
+        logger.info("%s %s: accuracy %s, %s ms", region, profile, result["accuracy"], result["mean_ms"])
+    return results
+
+
+def choose(results, target):
+    """Fastest result reaching the target accuracy, else the most accurate (fastest among equals)"""
+    def speed(result):
+        return float("inf") if result["mean_ms"] is None else result["mean_ms"]
+
+    passing = [result for result in results if result["accuracy"] >= target]
+    if passing:
+        return min(passing, key=speed), True
+    return min(results, key=lambda result: (-result["accuracy"], speed(result))), False
+
+
+def tune(corpus, engine, rois=None, psms=(None,), oems=(None,), langs=(None,), whitelists=(None,),
+         scales=(None,), target_accuracy=None, repeat=REPEAT):
+    """Sweep the settings per region; returns the report with the chosen profile of every region"""
+    import screenshot_extract
+    from ocr_engine import profile_settings
+
+    rois = screenshot_extract.ROIS if rois is None else rois
+    samples = prepare_samples(corpus, rois)
+    if not samples:
+        raise ValueError("The corpus is empty")
+
+    # Warm up the engine so model loading is not counted as latency
+    evaluate(engine, samples[:1], rois, {})
+    baseline, baseline_texts = evaluate(engine, samples, rois, {}, repeat)
+    target = baseline["accuracy"] if target_accuracy is None else target_accuracy
+    logger.info("Default settings: accuracy %s, %s ms per region", baseline["accuracy"], baseline["mean_ms"])
+
+    chosen = {}
+    regions = {}
+    for region in rois:
+        region_whitelists = [auto_whitelist(texts[region] for texts in baseline_texts if region in texts)
+                             if whitelist == "auto" else whitelist for whitelist in whitelists]
+        candidates = candidate_profiles(psms, oems, langs, region_whitelists, scales)
+        results = sweep_region(engine, samples, rois, region, candidates, baseline_texts, repeat)
+        best, reached = choose(results, target)
+        chosen[region] = best["profile"]
+        regions[region] = {
+            "profile": profile_settings(best["profile"]),
+            "accuracy": best["accuracy"],
+            "mean_ms": best["mean_ms"],
+            "default_mean_ms": results[0]["mean_ms"],
+            "reached_target": reached,
+            "candidates": len(results),
+        }
+
+    # The regions were tuned one at a time, so check the chosen profiles together
+    tuned, _ = evaluate(engine, samples, rois, chosen, repeat)
+    return {
+        "samples": len(samples),
+        "target_accuracy": target,
+        "default": baseline,
+        "tuned": tuned,
+        "regions": regions,
+        "profiles": {region: profile_settings(profile) for region, profile in chosen.items()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the fastest OCR settings per region for a target field accuracy")
+    parser.add_argument("--corpus", help="Labeled corpus directory (default: render the synthetic benchmark corpus)")
+    parser.add_argument("--seed", type=int, default=1234, help="Seed for the synthetic corpus")
+    parser.add_argument("--output", "-o", default="ocr_profiles.json", help="Write the chosen profiles here")
+    parser.add_argument("--report", help="Also write the full JSON report here")
+    parser.add_argument("--target-accuracy", type=float,
+                        help="Field accuracy (0-1) a profile must reach (default: the accuracy of the default settings)")
+    parser.add_argument("--psm", default=PSM_CHOICES, help=f"Page segmentation modes to try (default: {PSM_CHOICES})")
+    parser.add_argument("--oem", default=OEM_CHOICES, help=f"Engine modes to try (default: {OEM_CHOICES})")
+    parser.add_argument("--lang", default="default", help="Languages to try, e.g. eng,eng_fast (default: the pool's)")
+    parser.add_argument("--whitelist", default=WHITELIST_CHOICES,
+                        help=f"Character whitelists to try: none, auto or the characters (default: {WHITELIST_CHOICES})")
+    parser.add_argument("--scale", default=SCALE_CHOICES, help=f"Scale factors to try (default: {SCALE_CHOICES})")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="Time each OCR call this many times, keeping the fastest")
+    parser.add_argument("--tesseract-cmd", help="Path to the tesseract executable")
+    parser.add_argument("--engine", default="auto", choices=["auto", "tesserocr", "pytesseract"], help="OCR engine")
+    parser.add_argument("--rules", help="JSON file with extra or replacement field rules")
+    parser.add_argument("--log-level", default="WARNING", help="Logging level (INFO shows every candidate)")
+    args = parser.parse_args(argv)
+
+    from field_rules import configure_rules
+    from ocr_engine import create_engine, set_tesseract_cmd
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(levelname)s %(name)s: %(message)s")
+    if args.tesseract_cmd:
+        set_tesseract_cmd(args.tesseract_cmd)
+    # Time a single-threaded engine, as each live OCR worker runs
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    configure_rules(path=args.rules)
+    engine = create_engine(args.engine)
+    try:
+        corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.seed)
+        report = tune(corpus, engine,
+                      psms=_choices(args.psm, int), oems=_choices(args.oem, int), langs=_choices(args.lang, str),
+                      whitelists=_choices(args.whitelist, str), scales=_choices(args.scale, _scale),
+                      target_accuracy=args.target_accuracy, repeat=args.repeat)
+    finally:
+        engine.close()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report["profiles"], f, indent=2)
+        f.write("\n")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+    for region, result in report["regions"].items():
+        note = "" if result["reached_target"] else " (target not reached, most accurate kept)"
+        print(f"{region}: {result['profile'] or 'defaults'} - accuracy {result['accuracy']}, "
+              f"{result['mean_ms']} ms (defaults {result['default_mean_ms']} ms){note}")
+    default, tuned = report["default"], report["tuned"]
+    print(f"All regions: accuracy {default['accuracy']} -> {tuned['accuracy']}, "
+          f"{default['mean_ms']} -> {tuned['mean_ms']} ms per region (target {report['target_accuracy']})")
+    print(f"Wrote {args.output}")
+    return 0 if tuned["accuracy"] >= report["target_accuracy"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
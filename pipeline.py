@@ -0,0 +1,207 @@
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class Stage:
+    """One pipeline stage: a bounded input queue served by a fixed number of worker threads"""
+
+    def __init__(self, name, handler, workers=1, queue_size=10):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = []
+        self.busy = 0
+        self.done = 0
+        self.failed = 0
+        self.blocked_puts = 0
+
+
+class FairQueue:
+    """Per-source FIFO queues served in weighted round-robin order
+
+    Each turn a source may hand out up to its weight items before the next source
+    is served, so a burst in one source (e.g. a busy download folder) cannot starve
+    the others. Not thread-safe: meant to be filled and drained by one loop.
+    """
+
+    def __init__(self, weights=None):
+        self.weights = dict(weights or {})
+        self._queues = OrderedDict()
+        self._turn = 0  # Index of the source being served
+        self._served = 0  # Items handed out by that source in this turn
+
+    def push(self, source, item):
+        self._queues.setdefault(source, deque()).append(item)
+
+    def pop(self):
+        """Return (source, item) from the next source due, or None if every queue is empty"""
+        sources = list(self._queues)
+        if not sources:
+            return None
+        for _ in range(len(sources) + 1):
+            source = sources[self._turn % len(sources)]
+            items = self._queues[source]
+            if items and self._served < self.weights.get(source, 1):
+                self._served += 1
+                return source, items.popleft()
+            self._turn = (self._turn + 1) % len(sources)
+            self._served = 0
+        return None
+
+    def pending(self):
+        """Number of items waiting per source"""
+        return {source: len(items) for source, items in self._queues.items()}
+
+    def __len__(self):
+        return sum(len(items) for items in self._queues.values())
+
+
+class Pipeline:
+    """Runs items through a chain of stages linked by bounded queues"""
+
+    # Each stage handler returns the item for the next stage, or None to drop it.
+    # A full queue blocks the stage feeding it, so a slow OCR stage throttles
+    # capture and detection instead of letting work pile up (backpressure).
+
+    def __init__(self, stages):
+        self.stages = stages
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._started = False
+
+    def start(self):
+        for index, stage in enumerate(self.stages):
+            next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            for number in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._worker,
+                    args=(stage, next_stage),
+                    name=f"{stage.name}-{number}",
+                    daemon=True,
+                )
+                thread.start()
+                stage.threads.append(thread)
+        self._started = True
+
+    def _put(self, stage, entry, deadline=None):
+        """Put into a stage queue, counting how often the producer had to wait
+
+        Returns False if the queue was still full at deadline (a time.time() value).
+        """
+        try:
+            stage.queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            with self._lock:
+                stage.blocked_puts += 1
+        while True:
+            # Short timeouts keep the caller responsive to Ctrl+C on Windows
+            wait = 1 if deadline is None else min(1, deadline - time.time())
+            if wait <= 0:
+                return False
+            try:
+                stage.queue.put(entry, timeout=wait)
+                return True
+            except queue.Full:
+                continue
+
+    def _finish(self, key):
+        with self._lock:
+            self._in_flight.discard(key)
+
+    def _worker(self, stage, next_stage):
+        while True:
+            entry = stage.queue.get()
+            if entry is _STOP:
+                break
+            key, item = entry
+            with self._lock:
+                stage.busy += 1
+            try:
+                result = stage.handler(item)
+            except Exception as e:
+                logger.exception("Error in %s stage for %s: %s", stage.name, key, e)
+                result = None
+                with self._lock:
+                    stage.failed += 1
+            else:
+                with self._lock:
+                    stage.done += 1
+            finally:
+                with self._lock:
+                    stage.busy -= 1
+
+            if result is not None and next_stage is not None:
+                self._put(next_stage, (key, result))
+            else:
+                self._finish(key)
+
+    def put(self, item, key=None):
+        """Feed an item into the first stage; returns False if the same key is already in flight"""
+        key = item if key is None else key
+        with self._lock:
+            if key in self._in_flight:
+                return False
+            self._in_flight.add(key)
+        self._put(self.stages[0], (key, item))
+        return True
+
+    def has_room(self):
+        """True if the first stage can take an item without blocking"""
+        first = self.stages[0].queue
+        return first.maxsize <= 0 or first.qsize() < first.maxsize
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._in_flight)
+
+    def queue_depths(self):
+        """Number of items waiting in front of each stage"""
+        return {stage.name: stage.queue.qsize() for stage in self.stages}
+
+    def stats(self):
+        """Per-stage queue depth, active workers and completed/failed counts"""
+        with self._lock:
+            return {
+                stage.name: {
+                    'queued': stage.queue.qsize(),
+                    'capacity': stage.queue.maxsize,
+                    'busy': stage.busy,
+                    'done': stage.done,
+                    'failed': stage.failed,
+                    'blocked_puts': stage.blocked_puts,
+                }
+                for stage in self.stages
+            }
+
+    def format_status(self):
+        parts = []
+        for name, stat in self.stats().items():
+            parts.append(f"{name}={stat['queued']}/{stat['capacity']} (busy {stat['busy']}, done {stat['done']})")
+        return "Pipeline: " + ", ".join(parts)
+
+    def stop(self, timeout=None):
+        """Drain the stages in order and stop their workers"""
+        if not self._started:
+            return
+        deadline = None if timeout is None else time.time() + timeout
+        for stage in self.stages:
+            for _ in stage.threads:
+                if not self._put(stage, _STOP, deadline):
+                    # A worker is stuck (e.g. an OCR call that never returns); its threads are
+                    # daemons, so stop waiting for them rather than hang the shutdown
+                    logger.warning("Timed out stopping the %s stage with %d items queued",
+                                   stage.name, stage.queue.qsize())
+                    break
+            for thread in stage.threads:
+                remaining = None if deadline is None else max(0.0, deadline - time.time())
+                thread.join(remaining)
+        self._started = False
@@ -0,0 +1,309 @@
+"""Moves finished attachments to their new name, possibly on another volume.
+
+A move is an atomic rename when source and target share a volume. Otherwise the
+file is streamed to "<target>.part" (through the kernel's copy offload where
+available), the copy is verified by hash, renamed into place and only then is the
+source deleted. Existing files are never overwritten: a taken name gets a
+deterministic "_2", "_3", ... suffix. Names in use are looked up in a cached
+listing of each output folder, so a busy archive is not listed or stat-ed again
+for every file.
+"""
+import errno
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+
+from metrics import counter
+from ocr_cache import file_digest
+
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK_SIZE = 8 * 1024 * 1024  # Bytes per read/write (or offloaded copy call) when copying across volumes
+VERIFY_COPIES = True  # Compare the hash of a cross-volume copy with the source before deleting the source
+LISTING_TTL = 300  # Seconds a cached folder listing is trusted before it is read again
+MAX_SUFFIX = 10000  # Highest collision suffix tried
+PART_SUFFIX = ".part"
+
+_placements = counter("placements_total", "Files moved into the output folder, by method")
+_collisions = counter("placement_collisions_total", "Target names that were taken and got a suffix")
+_copied_bytes = counter("placement_copied_bytes_total", "Bytes copied for cross-volume moves")
+
+
+class PlacementError(OSError):
+    """A cross-volume copy could not be completed or verified; the source is left in place"""
+
+
+def _key(name):
+    return os.path.normcase(name)
+
+
+def _link_unsupported(error):
+    return error.errno in (errno.EPERM, errno.EACCES, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EMLINK,
+                           getattr(errno, "ENOSYS", None))
+
+
+def rename_no_clobber(source, target):
+    """Rename source to target, raising FileExistsError instead of replacing an existing target"""
+    if sys.platform == "win32":
+        # MoveFile never replaces an existing file
+        os.rename(source, target)
+        return
+    try:
+        # A hard link fails if the target exists; removing the old name then completes the move
+        os.link(source, target)
+    except OSError as e:
+        if e.errno == errno.EEXIST or e.errno == errno.EXDEV or not _link_unsupported(e):
+            raise
+        # The file system has no hard links (FAT, some network shares): check, then rename
+        if os.path.lexists(target):
+            raise FileExistsError(errno.EEXIST, "Target exists", target) from None
+        os.rename(source, target)
+        return
+    os.unlink(source)
+
+
+def _copy_offloaded(source_fd, target_fd, size, chunk_size):
+    """Copy inside the kernel (copy_file_range, then sendfile); returns False if neither is supported"""
+    for name in ("copy_file_range", "sendfile"):
+        function = getattr(os, name, None)
+        if function is None:
+            continue
+        offset = 0
+        try:
+            while offset < size:
+                if name == "copy_file_range":
+                    sent = function(source_fd, target_fd, min(chunk_size, size - offset))
+                else:
+                    sent = function(target_fd, source_fd, offset, min(chunk_size, size - offset))
+                if sent == 0:
+                    break
+                offset += sent
+        except OSError as e:
+            if offset == 0 and e.errno in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                                           errno.ENOTSUP, errno.EBADF):
+                continue
+            raise
+        if offset == size:
+            return True
+        raise PlacementError(errno.EIO, f"Short copy ({offset} of {size} bytes)")
+    return False
+
+
+def _copy_windows(source, target):
+    """CopyFileExW, which uses offloaded (ODX/SMB server-side) copies where the storage supports them"""
+    import ctypes
+    from ctypes import wintypes
+
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.CopyFileExW.argtypes = [wintypes.LPCWSTR, wintypes.LPCWSTR, wintypes.LPVOID, wintypes.LPVOID,
+                                     wintypes.LPVOID, wintypes.DWORD]
+    COPY_FILE_FAIL_IF_EXISTS = 0x1
+    if not kernel32.CopyFileExW(source, target, None, None, None, COPY_FILE_FAIL_IF_EXISTS):
+        raise ctypes.WinError(ctypes.get_last_error())
+
+
+def copy_file(source, target, chunk_size=COPY_CHUNK_SIZE):
+    """Stream source to a new file target (which must not exist); returns the method used"""
+    if sys.platform == "win32":
+        try:
+            _copy_windows(source, target)
+            return "offload"
+        except OSError as e:
+            if os.path.exists(target):
+                raise
+            logger.debug("CopyFileExW failed (%s), copying in chunks", e)
+    with open(source, "rb") as src, open(target, "xb") as dst:
+        size = os.fstat(src.fileno()).st_size
+        if sys.platform != "win32" and _copy_offloaded(src.fileno(), dst.fileno(), size, chunk_size):
+            return "offload"
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        while True:
+            read = src.readinto(buffer)
+            if not read:
+                break
+            dst.write(view[:read])
+    return "copy"
+
+
+class FilePlacer:
+    """Moves files into output folders without overwriting, reusing cached folder listings"""
+
+    def __init__(self, verify=VERIFY_COPIES, chunk_size=COPY_CHUNK_SIZE, listing_ttl=LISTING_TTL):
+        self.verify = verify
+        self.chunk_size = chunk_size
+        self.listing_ttl = listing_ttl
+        self._lock = threading.Lock()
+        self._listings = {}  # folder -> (read at, set of normalized names in use or reserved)
+
+    def _names(self, directory):
+        """Names in use in directory; the caller holds the lock"""
+        cached = self._listings.get(directory)
+        if cached is None or time.time() - cached[0] > self.listing_ttl:
+            with os.scandir(directory) as entries:
+                names = {_key(entry.name) for entry in entries}
+            cached = self._listings[directory] = (time.time(), names)
+        return cached[1]
+
+    def forget(self, directory=None):
+        """Drop the cached listing of directory (or of every folder)"""
+        with self._lock:
+            if directory is None:
+                self._listings.clear()
+            else:
+                self._listings.pop(os.path.abspath(directory), None)
+
+    def reserve(self, directory, name):
+        """Return a free path for name in directory, adding "_2", "_3", ... before the extension if taken"""
+        with self._lock:
+            return self._reserve(os.path.abspath(directory), name)
+
+    def _reserve(self, directory, name):
+        """reserve() for an absolute directory; the caller holds the lock"""
+        stem, extension = os.path.splitext(name)
+        names = self._names(directory)
+        for number in range(1, MAX_SUFFIX + 1):
+            candidate = name if number == 1 else f"{stem}_{number}{extension}"
+            # A leftover partial copy also blocks the name
+            if _key(candidate) not in names and _key(candidate + PART_SUFFIX) not in names:
+                names.add(_key(candidate))
+                if number > 1:
+                    _collisions.inc()
+                return os.path.join(directory, candidate)
+        raise FileExistsError(errno.EEXIST, "No free name", os.path.join(directory, name))
+
+    def create(self, directory, name):
+        """Open a new file for name in directory (or a suffixed variant) for writing; f.name is its path
+
+        Like reserve(), but a file created by another process since the listing was read
+        is never replaced: the next free name is used instead.
+        """
+        path = self.reserve(directory, name)
+        while True:
+            try:
+                return open(path, "xb")
+            except FileExistsError:
+                self.forget(directory)
+                path = self.reserve(directory, name)
+            except BaseException:
+                self.release(path)
+                raise
+
+    def release(self, path):
+        """Give back a name reserved with reserve() that ended up unused"""
+        with self._lock:
+            cached = self._listings.get(os.path.dirname(path))
+            if cached is not None:
+                cached[1].discard(_key(os.path.basename(path)))
+
+    def move(self, source, target, digest=None):
+        """Move source to the reserved path target; returns the final path
+
+        If target was taken by another process in the meantime, the next free name is used.
+        digest (the source's file_digest, if already known) saves re-reading it for verification.
+        """
+        while True:
+            try:
+                rename_no_clobber(source, target)
+                _placements.inc(method="rename")
+                return target
+            except FileExistsError:
+                pass
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    self.release(target)
+                    raise
+                try:
+                    return self._copy_across(source, target, digest)
+                except FileExistsError:
+                    pass
+            # Someone else created the name since the listing was read
+            directory, name = os.path.split(target)
+            self.forget(directory)
+            target = self.reserve(directory, name)
+
+    def _copy_across(self, source, target, digest):
+        part = target + PART_SUFFIX
+        placed = False
+        try:
+            method = copy_file(source, part, self.chunk_size)
+            try:
+                shutil.copystat(source, part)
+            except OSError:
+                pass
+            if self.verify:
+                expected = digest or file_digest(source)
+                if file_digest(part) != expected:
+                    raise PlacementError(errno.EIO, "Copy does not match the source", target)
+            rename_no_clobber(part, target)
+            placed = True
+        finally:
+            if not placed:
+                try:
+                    os.remove(part)
+                except OSError:
+                    pass
+                # Free the name again so the next file can have it
+                self.release(target)
+        _copied_bytes.inc(os.path.getsize(target))
+        _placements.inc(method=method)
+        try:
+            os.remove(source)
+        except OSError as e:
+            # The copy is complete and verified; the download just could not be deleted
+            logger.warning("Copied %s to %s but could not delete the original: %s", source, target, e)
+        return target
+
+    def place(self, source, directory, name, digest=None):
+        """Move source into directory as name (or a suffixed variant); returns the final path"""
+        return self.move(source, self.reserve(directory, name), digest)
+
+    def place_many(self, moves):
+        """Place (source, directory, name[, digest]) tuples; returns the final path or the exception of each
+
+        Every target is reserved up front in one pass over the cached listings, so a
+        batch reads each output folder at most once, however many files go into it.
+        """
+        moves = list(moves)
+        targets = []
+        with self._lock:
+            for move in moves:
+                try:
+                    targets.append(self._reserve(os.path.abspath(move[1]), move[2]))
+                except OSError as e:
+                    targets.append(e)
+        results = []
+        for move, target in zip(moves, targets):
+            if isinstance(target, OSError):
+                results.append(target)
+                continue
+            try:
+                results.append(self.move(move[0], target, move[3] if len(move) > 3 else None))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+_placer = FilePlacer()
+
+
+def configure_placement(**settings):
+    """Replace the shared placer (verify, chunk_size, listing_ttl)"""
+    global _placer
+    _placer = FilePlacer(**settings)
+    return _placer
+
+
+def get_placer():
+    return _placer
+
+
+def place_file(source, directory, name, digest=None):
+    return _placer.place(source, directory, name, digest)
+
+
+def create_file(directory, name):
+    return _placer.create(directory, name)
@@ -0,0 +1,184 @@
+"""Watch profiles: several download folders or Viber accounts served by one runtime.
+
+Each profile has its own watched folder, output folders, Viber window, ROI table
+and field rules. All profiles share the event loop, the OCR worker pool and the
+capture stage (so only one window is ever captured at a time). Profiles file:
+
+    {"profiles": [
+        {"name": "shop", "folder": "C:\\\\Users\\\\Admin\\\\Documents\\\\ViberDownloads",
+         "output_dir": "C:\\\\Users\\\\Admin\\\\Documents\\\\Viber_Attachments"},
+        {"name": "office", "folder": "D:\\\\Office\\\\ViberDownloads", "output_dir": "D:\\\\Office\\\\Renamed",
+         "window_title": "Rakuten Viber (Office)", "rules_file": "office_rules.json", "weight": 2}
+    ]}
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from field_rules import FieldRuleEngine, load_rules
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+# Settings a profile may define; anything not given comes from the script's defaults
+PROFILE_KEYS = ('name', 'folder', 'output_dir', 'screenshot_dir', 'window_title', 'rois', 'rules_file',
+                'extraction_source', 'fallback_fields', 'required_fields', 'weight')
+ROI_EDGES = ('top', 'left', 'bottom', 'right')
+
+_detected = counter("files_detected_total", "Downloads queued for processing")
+_processed = counter("files_processed_total", "Downloads finished, by profile and outcome")
+
+
+class ProfileStats:
+    """Per-profile counts of detected and finished downloads"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self.detected = 0
+        self.outcomes = {}
+        self._lock = threading.Lock()
+
+    def record_detected(self):
+        _detected.inc(profile=self.name)
+        with self._lock:
+            self.detected += 1
+
+    def record(self, outcome):
+        _processed.inc(profile=self.name, outcome=outcome)
+        with self._lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def renamed_per_minute(self):
+        minutes = max(time.time() - self.started, 1) / 60
+        return self.outcomes.get("renamed", 0) / minutes
+
+    def format(self, waiting=0):
+        with self._lock:
+            outcomes = ", ".join(f"{count} {outcome}" for outcome, count in sorted(self.outcomes.items()))
+            detected = self.detected
+        status = f"{self.name}: {detected} detected"
+        if outcomes:
+            status += f", {outcomes}"
+        status += f" ({self.renamed_per_minute():.1f} renamed/min)"
+        if waiting:
+            status += f", {waiting} waiting"
+        return status
+
+
+class Profile:
+    """Folder, output layout, window, regions and rules of one watched download folder"""
+
+    def __init__(self, name, folder, output_dir, screenshot_dir=None, window_title="Rakuten Viber", rois=None,
+                 rules_file=None, extraction_source="attachment", fallback_fields=('contact_name',),
+                 required_fields=None, weight=1):
+        self.name = name
+        self.folder = folder
+        self.output_dir = output_dir
+        self.screenshot_dir = screenshot_dir or os.path.join(output_dir, "Screenshots")
+        self.window_title = window_title
+        self.rois = _check_rois(name, rois) if rois else None
+        self.rules_file = rules_file
+        # None uses the shared rules (FIELD_RULES_FILE)
+        self.engine = FieldRuleEngine(load_rules(rules_file)) if rules_file else None
+        self.extraction_source = extraction_source
+        if not isinstance(fallback_fields, (list, tuple)) or not all(isinstance(field, str) for field in fallback_fields):
+            raise ValueError(f"Profile '{name}': fallback_fields must be a list of field names")
+        self.fallback_fields = tuple(fallback_fields)
+        if required_fields is not None and (not isinstance(required_fields, (list, tuple))
+                                            or not all(isinstance(field, str) for field in required_fields)):
+            raise ValueError(f"Profile '{name}': required_fields must be a list of field names")
+        # Fields the lazy screenshot OCR must find before it stops; None uses REQUIRED_FIELDS
+        self.required_fields = tuple(required_fields) if required_fields is not None else None
+        if not _is_number(weight):
+            raise ValueError(f"Profile '{name}': weight must be a number, not {weight!r}")
+        self.weight = max(1, int(weight))
+        self.archiver = None  # Set when the profile's screenshot archiver is started
+        self.stats = ProfileStats(name)
+
+    @classmethod
+    def from_dict(cls, config, defaults=None):
+        if not isinstance(config, dict):
+            raise ValueError(f"Each profile must be an object, not {config!r}")
+        unknown = set(config) - set(PROFILE_KEYS)
+        if unknown:
+            raise ValueError(f"Profile '{config.get('name')}': unknown settings {sorted(unknown)}")
+        settings = dict(defaults or {})
+        settings.update(config)
+        for key in ('name', 'folder', 'output_dir'):
+            if not settings.get(key):
+                raise ValueError(f"Profile '{settings.get('name')}': '{key}' is required")
+        for key in ('name', 'folder', 'output_dir', 'screenshot_dir', 'window_title', 'rules_file', 'extraction_source'):
+            if settings.get(key) is not None and not isinstance(settings[key], str):
+                raise ValueError(f"Profile '{settings.get('name')}': '{key}' must be a string")
+        return cls(**settings)
+
+    def __repr__(self):
+        return f"Profile({self.name!r}, {self.folder!r})"
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _check_rois(name, rois):
+    if not isinstance(rois, dict):
+        raise ValueError(f"Profile '{name}': rois must be an object of region names to edges")
+    for region, coords in rois.items():
+        if not isinstance(coords, dict) or set(coords) != set(ROI_EDGES):
+            raise ValueError(f"Profile '{name}': region '{region}' needs exactly {', '.join(ROI_EDGES)}")
+        if not all(_is_number(coords[edge]) for edge in ROI_EDGES):
+            raise ValueError(f"Profile '{name}': region '{region}' edges must be numbers")
+        if not (0 <= coords['top'] < coords['bottom'] <= 1 and 0 <= coords['left'] < coords['right'] <= 1):
+            raise ValueError(f"Profile '{name}': region '{region}' must lie within 0-1 of the window")
+    return rois
+
+
+def load_profiles(path, defaults=None):
+    """Read profiles from a JSON file ({"profiles": [...]}); defaults fill in unset settings"""
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    if not isinstance(config, dict) or not isinstance(config.get('profiles'), list):
+        raise ValueError('expected an object with a "profiles" list')
+    profiles = [Profile.from_dict(entry, defaults) for entry in config['profiles']]
+    names = [profile.name for profile in profiles]
+    folders = [_folder_key(profile.folder) for profile in profiles]
+    if len(set(names)) != len(names):
+        raise ValueError("Profile names must be unique")
+    if len(set(folders)) != len(folders):
+        raise ValueError("Two profiles watch the same folder")
+    return profiles
+
+
+def _folder_key(folder):
+    return os.path.normcase(os.path.abspath(folder))
+
+
+_profiles = {}  # Watched folder -> profile
+_profiles_lock = threading.Lock()
+
+
+def configure_profiles(profiles):
+    """Register the profiles that files are looked up in by folder"""
+    with _profiles_lock:
+        _profiles.clear()
+        for profile in profiles:
+            _profiles[_folder_key(profile.folder)] = profile
+
+
+def get_profiles():
+    with _profiles_lock:
+        return list(_profiles.values())
+
+
+def profile_for(path):
+    """Return the profile watching the folder path is in, or None"""
+    with _profiles_lock:
+        return _profiles.get(_folder_key(os.path.dirname(path)))
+
+
+def format_profile_stats(profiles, waiting=None):
+    waiting = waiting or {}
+    return "Profiles: " + "; ".join(profile.stats.format(waiting.get(profile.name, 0)) for profile in profiles)
@@ -0,0 +1,446 @@
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import layout
+from field_rules import get_rule_engine
+from frames import ROIS, frame_geometry
+from metrics import counter, span
+from ocr_cache import get_view_cache, view_hash
+from ocr_engine import get_pool, join_results, span_confidence, EMPTY_RESULT
+
+logger = logging.getLogger(__name__)
+
+# Everything in this module runs without a display, so it can be used by the
+# live watcher as well as by batch reprocessing on a headless machine.
+
+# "lazy" OCRs regions in REGION_STAGES order and stops once the required fields are
+# found with enough confidence; "full" always OCRs every region
+EXTRACTION_MODE = "lazy"
+# Regions in order of usefulness; regions in the same stage are OCR'd concurrently
+REGION_STAGES = [('header', 'transaction_info'), ('bank_details',)]
+# Fields that must be found before the lazy mode stops ('date_time' means any date or time):
+# the ones that replace the filename's "Unknown", "NoDetails" and clock-date placeholders.
+# The account, reference and status are still named when the regions OCR'd contain them;
+# a profile's required_fields can ask for them too.
+REQUIRED_FIELDS = ('contact_name', 'amount', 'date_time')
+MIN_FIELD_CONFIDENCE = 60  # Lowest per-word OCR confidence (0-100) accepted for a required field
+OVERLAP_MARGIN = 0.01  # Fraction of the height re-read where a region overlaps one already OCR'd
+FULL_FRAME_ON_MISSING = False  # Also OCR the full frame when required fields are still missing
+# Find the text blocks inside each region (layout.py) and OCR only those
+LAYOUT_ANALYSIS = True
+
+
+# Preprocessing buffers are reused per thread, keyed by region name and shape
+_buffers = threading.local()
+
+# Debug region dumps are written by a background thread so they never block OCR
+DEBUG_QUEUE_SIZE = 8
+_debug_queue = None
+_debug_lock = threading.Lock()
+
+# Placeholders used for missing fields ("Unknown", "NoDetails", ...) and slower fallback paths
+_fallbacks = counter("fallbacks_total", "Extractions that fell back to a placeholder value or a slower path")
+_lazy_regions = counter("lazy_regions_total", "Regions OCR'd by the lazy extraction before it stopped")
+
+def to_grayscale(screenshot):
+    """Convert the captured frame to a single grayscale array once"""
+    if isinstance(screenshot, np.ndarray):
+        return screenshot if screenshot.ndim == 2 else cv2.cvtColor(screenshot, cv2.COLOR_RGB2GRAY)
+    # PIL does the luma conversion in one pass, so only one byte per pixel is copied into numpy
+    return np.asarray(screenshot.convert("L"))
+
+def _buffer(name, shape):
+    """Return a preallocated uint8 buffer for this thread, region and shape"""
+    cache = getattr(_buffers, "cache", None)
+    if cache is None:
+        cache = _buffers.cache = {}
+    buffer = cache.get((name, shape))
+    if buffer is None:
+        buffer = cache[(name, shape)] = np.empty(shape, dtype=np.uint8)
+    return buffer
+
+def _debug_writer():
+    while True:
+        path, image = _debug_queue.get()
+        try:
+            cv2.imwrite(path, image)
+        except Exception as e:
+            logger.warning("Error saving debug region %s: %s", path, e)
+
+def save_debug_region(path, image):
+    """Queue a copy of a region for writing in the background; dropped if the writer is behind"""
+    global _debug_queue
+    with _debug_lock:
+        if _debug_queue is None:
+            _debug_queue = queue.Queue(maxsize=DEBUG_QUEUE_SIZE)
+            threading.Thread(target=_debug_writer, name="debug-region-writer", daemon=True).start()
+    try:
+        _debug_queue.put_nowait((path, image.copy()))
+    except queue.Full:
+        pass
+
+def _region_box(coords, geometry, top_fraction=None):
+    """Pixel (top, left, bottom, right) of an ROI inside the captured image"""
+    offset_x, offset_y, width, height = geometry
+    top = int(height * (coords['top'] if top_fraction is None else top_fraction)) - offset_y
+    left = int(width * coords['left']) - offset_x
+    bottom = int(height * coords['bottom']) - offset_y
+    right = int(width * coords['right']) - offset_x
+    return max(0, top), max(0, left), bottom, right
+
+def _threshold(image, name):
+    """Blur and adaptively threshold a grayscale crop into a reused buffer"""
+    # Apply slight blur to reduce noise
+    blurred = cv2.GaussianBlur(image, (3, 3), 0, dst=_buffer(name + "_blur", image.shape))
+    
+    # Apply adaptive thresholding to enhance text
+    return cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+                                 cv2.THRESH_BINARY, 11, 2, dst=_buffer(name, image.shape))
+
+def _block_lines(boxes):
+    """Group boxes whose vertical ranges overlap into lines, top to bottom, each left to right"""
+    lines = []
+    for box in sorted(boxes):
+        if lines and box[0] < lines[-1][1]:
+            lines[-1][0].append(box)
+            lines[-1][1] = max(lines[-1][1], box[2])
+        else:
+            lines.append([[box], box[2]])
+    return [sorted(line, key=lambda box: box[1]) for line, _ in lines]
+
+def _stack_blocks(gray, boxes):
+    """Threshold each text block and lay them out on a white canvas in reading order
+
+    Blocks on the same line are placed side by side, left to right, keeping their
+    vertical offsets, so a label and its value are still read as one line; the
+    lines are stacked top to bottom.
+    """
+    gap = layout.BOX_PADDING * 2
+    lines = []
+    for line in _block_lines(boxes):
+        line_top = min(box[0] for box in line)
+        # Block sizes vary from frame to frame, so these are not kept in the reused buffers
+        blocks = [(top - line_top, cv2.adaptiveThreshold(cv2.GaussianBlur(gray[top:bottom, left:right], (3, 3), 0), 255,
+                                                         cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2))
+                  for top, left, bottom, right in line]
+        height = max(offset + block.shape[0] for offset, block in blocks)
+        width = sum(block.shape[1] for _, block in blocks) + gap * (len(blocks) - 1)
+        lines.append((height, width, blocks))
+    canvas = np.full((sum(height for height, _, _ in lines) + gap * (len(lines) - 1),
+                      max(width for _, width, _ in lines)), 255, dtype=np.uint8)
+    y = 0
+    for height, _, blocks in lines:
+        x = 0
+        for offset, block in blocks:
+            canvas[y + offset:y + offset + block.shape[0], x:x + block.shape[1]] = block
+            x += block.shape[1] + gap
+        y += height + gap
+    return canvas
+
+def _frame_dpi(screenshot):
+    dpi = screenshot.info.get("dpi") if hasattr(screenshot, "info") else None
+    return round(dpi[0]) if dpi else None
+
+def preprocess_regions(screenshot, gray, names, debug_dir=None, tops=None, rois=None):
+    """Slice and threshold the named ROIs of the grayscale frame; returns name -> image
+
+    With LAYOUT_ANALYSIS only the text blocks found inside a region are kept, stacked
+    into one image, and regions without any text are left out.
+    """
+    rois = ROIS if rois is None else rois
+    geometry = frame_geometry(screenshot)
+    dpi = _frame_dpi(screenshot)
+    processed_regions = {}
+    for region_name in names:
+        top_fraction = tops.get(region_name) if tops else None
+        region_box = _region_box(rois[region_name], geometry, top_fraction)
+        top, left, bottom, right = region_box
+        
+        # Extract region (a view, not a copy)
+        roi = gray[top:bottom, left:right]
+        if roi.size == 0:
+            continue
+
+        boxes = None
+        if LAYOUT_ANALYSIS:
+            boxes = layout.text_boxes(gray, region_box, layout.layout_key(region_name, region_box, dpi))
+            if boxes == []:
+                # Nothing that looks like text: no need to OCR this region
+                continue
+        
+        if boxes and boxes != [region_box]:
+            # Process only the tight text blocks for OCR
+            processed = _stack_blocks(gray, boxes)
+        else:
+            # Process the region for better OCR, writing into reused buffers
+            processed = _threshold(roi, region_name)
+        
+        # Save region for debugging if needed
+        if debug_dir:
+            save_debug_region(os.path.join(debug_dir, f"debug_{region_name}.png"), processed)
+        
+        processed_regions[region_name] = processed
+    return processed_regions
+
+def extract_specific_regions(screenshot, debug_dir=None, gray=None, rois=None):
+    """Extract and process specific regions of the screenshot for better OCR accuracy"""
+    try:
+        rois = ROIS if rois is None else rois
+        # Convert to grayscale once; every ROI below is a view into this array
+        if gray is None:
+            gray = to_grayscale(screenshot)
+        
+        # Extract and preprocess each region, then OCR them concurrently
+        processed_regions = preprocess_regions(screenshot, gray, rois, debug_dir, rois=rois)
+
+        # Perform OCR on the processed regions using the shared worker pool
+        # (the buffers are not reused until this thread's next call, after OCR finished)
+        region_texts = get_pool().ocr_regions(processed_regions)
+        for region_name, region_text in region_texts.items():
+            logger.debug("OCR for %s: %r", region_name, region_text)
+            
+        return region_texts
+    except Exception as e:
+        logger.error("Error extracting regions: %s", e)
+        return {}
+
+def parse_fields(all_text, spans=None, engine=None):
+    """Find the transaction fields in the OCR text; returns field -> (value, start, end)
+
+    The patterns are the rules in field_rules.py (or those of engine, e.g. a profile's
+    own rules); spans ((region, start, end) of each region's text) lets region-scoped
+    rules ignore matches from other regions.
+    """
+    return (engine or get_rule_engine()).extract(all_text, spans)
+
+def region_spans(texts, separator="\n"):
+    """(region, start, end) of each non-empty (region, text) pair inside separator.join(texts)"""
+    spans = []
+    offset = 0
+    for region_name, text in texts:
+        if not text:
+            continue
+        if spans:
+            offset += len(separator)
+        spans.append((region_name, offset, offset + len(text)))
+        offset += len(text)
+    return spans
+
+def missing_fields(fields, words=None, required=None, min_confidence=None):
+    """Required fields that were not found, or found with too low an OCR confidence"""
+    required = REQUIRED_FIELDS if required is None else required
+    min_confidence = MIN_FIELD_CONFIDENCE if min_confidence is None else min_confidence
+    missing = []
+    for field in required:
+        # Any of the date sources is enough to build the date/time part of the name
+        candidates = ('date', 'time', 'transaction_date') if field == 'date_time' else (field,)
+        found = False
+        for candidate in candidates:
+            if candidate not in fields:
+                continue
+            _, start, end = fields[candidate]
+            confidence = span_confidence(words, start, end) if words else None
+            if confidence is None or confidence >= min_confidence:
+                found = True
+                break
+        if not found:
+            missing.append(field)
+    return missing
+
+def _trimmed_top(region_name, done, rois):
+    """Start a region below the band already covered by OCR'd regions above it"""
+    top = rois[region_name]['top']
+    for other in done:
+        other_coords = rois[other]
+        if other_coords['top'] <= top < other_coords['bottom']:
+            top = max(top, other_coords['bottom'] - OVERLAP_MARGIN)
+    return top
+
+def extract_regions_lazy(screenshot, gray, debug_dir=None, rois=None, stages=None, required=None, engine=None):
+    """OCR regions in order of usefulness, stopping once every required field is confidently found
+
+    Returns the combined text and the (region, start, end) span of each region in it.
+    """
+    rois = ROIS if rois is None else rois
+    stages = REGION_STAGES if stages is None else stages
+    staged = {name for stage in stages for name in stage}
+    if any(name not in staged for name in rois):
+        # Regions of a custom ROI table that no stage names are OCR'd last
+        stages = list(stages) + [tuple(name for name in rois if name not in staged)]
+    results = {}
+    combined = EMPTY_RESULT
+    spans = []
+    for stage in stages:
+        names = [name for name in stage if name in rois and name not in results]
+        if not names:
+            continue
+        tops = {name: _trimmed_top(name, results, rois) for name in names}
+        processed_regions = preprocess_regions(screenshot, gray, names, debug_dir, tops, rois)
+        results.update(get_pool().ocr_regions(processed_regions, with_data=True))
+        for region_name in names:
+            if region_name in results:
+                logger.debug("OCR for %s: %r", region_name, results[region_name].text)
+
+        # Combine the regions in their on-screen order and check what is still missing
+        ordered = [name for name in rois if name in results]
+        combined = join_results([results[name] for name in ordered])
+        spans = region_spans([(name, results[name].text) for name in ordered])
+        missing = missing_fields(parse_fields(combined.text, spans, engine), combined.words, required)
+        if not missing:
+            logger.debug("All required fields found after OCR of: %s", ", ".join(results))
+            _lazy_regions.inc(len(results))
+            return combined.text, spans
+        logger.debug("Missing after %s: %s", ", ".join(names), ", ".join(missing))
+    _lazy_regions.inc(len(results))
+
+    # Fall back to the full frame when the regions gave nothing (or, optionally, when fields are missing)
+    if not combined.text or FULL_FRAME_ON_MISSING:
+        _fallbacks.inc(kind="full_frame")
+        combined = join_results([combined, get_pool().image_to_data(gray)])
+    return combined.text, spans
+
+def format_fields(fields):
+    """Build (contact_name, details_str, date_time) for the filename from the parsed fields"""
+    def value(field):
+        return fields[field][0] if field in fields else ""
+
+    contact_name = value('contact_name') or "Unknown"
+    account_number = value('account').replace(' ', '')
+    amount = value('amount').replace(',', '')
+    date_str = value('date')
+    time_str = value('time')
+    transaction_date = value('transaction_date')
+    reference = value('reference')
+    success_status = "SUCCESS" if 'status' in fields else ""
+    
+    # Create a properly formatted date/time string
+    if date_str and time_str:
+        date_time = f"{date_str} {time_str}"
+    elif date_str:
+        date_time = date_str
+    elif time_str:
+        date_time = f"Today {time_str}"
+    elif transaction_date:
+        date_time = transaction_date
+    else:
+        date_time = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())
+    
+    # Clean up the extracted information (remove invalid characters for filenames)
+    contact_name = re.sub(r'[<>:"/\\|?*]', '', contact_name).strip() or "Unknown"
+            
+    # Combine account number, amount, reference, and status for a more detailed filename
+    details = []
+    if amount:
+        details.append(f"MVR{amount}")
+    if account_number:
+        details.append(account_number)
+    if reference:
+        details.append(reference)
+    if success_status:
+        details.append(success_status)
+        
+    details_str = "_".join(details) if details else "NoDetails"
+    
+    # Format date_time to be filename friendly
+    date_time = re.sub(r'[<>:"/\\|?*,]', '_', date_time).strip()
+    return contact_name, details_str, date_time
+
+def count_fallbacks(fields):
+    """Count the placeholder values format_fields had to use in place of missing fields"""
+    if 'contact_name' not in fields:
+        _fallbacks.inc(kind="Unknown")
+    if not any(field in fields for field in ('amount', 'account', 'reference', 'status')):
+        _fallbacks.inc(kind="NoDetails")
+    if not any(field in fields for field in ('date', 'time', 'transaction_date')):
+        _fallbacks.inc(kind="clock_date")
+
+def conversation_view_key(screenshot, gray, rois=None):
+    """Hash of the pixels of every region, since the cached OCR text may come from any of them"""
+    rois = ROIS if rois is None else rois
+    geometry = frame_geometry(screenshot)
+    regions = []
+    for region_name in rois:
+        top, left, bottom, right = _region_box(rois[region_name], geometry)
+        regions.append(gray[top:bottom, left:right])
+    return view_hash(regions)
+
+def finish_extraction(fields):
+    """Format parsed fields for the filename, counting the placeholders that had to be used"""
+    contact_name, details_str, date_time = format_fields(fields)
+    count_fallbacks(fields)
+    logger.info("Extracted info - Name: %s, Details: %s, Date: %s", contact_name, details_str, date_time)
+    return contact_name, details_str, date_time
+
+def extract_fields_from_screenshot(screenshot, debug_dir=None, mode=None, required=None, rois=None, engine=None):
+    """OCR the screenshot and return the parsed fields (field -> (value, start, end)), {} on errors
+
+    required limits the fields the lazy mode looks for (e.g. only the contact name
+    when the rest was read from the attachment). rois and engine replace the default
+    ROI table and field rules.
+    """
+    try:
+        # Convert to grayscale once for the regions and the full-image fallback
+        gray = to_grayscale(screenshot)
+
+        # An unchanged conversation view can reuse the OCR text of the previous attachment
+        view_cache = get_view_cache()
+        view_key = None
+        if view_cache:
+            view_key = conversation_view_key(screenshot, gray, rois)
+            if required is not None:
+                # Text OCR'd for a subset of the fields must not satisfy a full extraction
+                view_key += ":" + ",".join(required)
+        cached = view_cache.get(view_key) if view_cache else None
+
+        if cached is not None:
+            logger.debug("Conversation view unchanged, reusing cached OCR text")
+            all_text, spans = cached[0], [tuple(region) for region in cached[1]]
+        elif (mode or EXTRACTION_MODE) == "lazy":
+            # OCR the most useful regions first and stop once all fields are found
+            all_text, spans = extract_regions_lazy(screenshot, gray, debug_dir, rois, required=required, engine=engine)
+        else:
+            # First try region-specific extraction for better accuracy
+            region_texts = extract_specific_regions(screenshot, debug_dir, gray, rois)
+            
+            # Combine all region texts for comprehensive search
+            all_text = "\n".join(text for text in region_texts.values() if text)
+            spans = region_spans(region_texts.items())
+            
+            # If region extraction failed, fall back to full image OCR
+            if not all_text:
+                # Use the OCR pool to extract all text from the grayscale frame
+                _fallbacks.inc(kind="full_frame")
+                all_text = get_pool().image_to_string(gray)
+
+        # Text of the full-frame fallback lies past the last region span; the key does not cover it
+        if view_cache and cached is None and all_text and spans and spans[-1][2] == len(all_text):
+            view_cache.put(view_key, [all_text, spans])
+        
+        logger.debug("OCR extracted text: %r", all_text)
+        
+        with span("parse_fields"):
+            return parse_fields(all_text, spans, engine)
+    except Exception as e:
+        logger.error("Error extracting info from screenshot: %s", e)
+        _fallbacks.inc(kind="extraction_error")
+        return {}
+
+def extract_info_from_screenshot(screenshot, debug_dir=None, mode=None):
+    """Extract contact name, number, and date/time from the screenshot"""
+    return finish_extraction(extract_fields_from_screenshot(screenshot, debug_dir, mode))
+
+def format_date_for_filename(date_time):
+    """Format date_time to be filename friendly"""
+    return re.sub(r'[/,\s:]', '_', date_time)
+
+def build_new_name(contact_name, details_str, date_time, file_extension):
+    """Create the new attachment filename from the extracted information"""
+    formatted_date = format_date_for_filename(date_time)
+    return f"{contact_name}_{details_str}_{formatted_date}{file_extension}"
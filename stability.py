@@ -0,0 +1,212 @@
+"""Decides when a detected download is complete.
+
+A file is complete as soon as the watcher reports that it was closed after
+writing or renamed into place (e.g. from its "_tmp" name). Without such an event
+(the Windows backend reports no closes) the file is polled with exponential
+backoff until its size and mtime stay unchanged for a quiet period, or, where
+the writer's open handle can be detected, until no process holds it for writing.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+from folder_watcher import EVENT_CLOSED, EVENT_MOVED
+from metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+TMP_MARKER = "_tmp"  # Viber writes downloads under a name with this suffix, then renames them
+QUIET_PERIOD = 0.5  # Seconds size and mtime must stay unchanged when the writer cannot be detected
+INITIAL_POLL = 0.02  # First poll interval in seconds; doubles while nothing changes
+MAX_POLL = 1.0  # Longest poll interval in seconds
+STALL_TIMEOUT = 30  # Give up when a file does not appear or change for this many seconds
+MAX_WAIT = 600  # Give up on a download still being written after this many seconds
+SIGNAL_TTL = 60  # Seconds a completion event is remembered for a file not being waited on yet
+
+_results = counter("stability_checks_total", "Stability checks by how completion was decided")
+_wait_seconds = histogram("stability_wait_seconds", "Time from the start of the stability check to completion")
+
+
+def is_temporary(path):
+    """True for a download still under its temporary name ("photo.jpg_tmp" or "photo_tmp.jpg")"""
+    name = os.path.basename(path)
+    return name.endswith(TMP_MARKER) or os.path.splitext(name)[0].endswith(TMP_MARKER)
+
+
+def final_path_for(tmp_path):
+    """Name a temporary download will have once it is complete"""
+    directory, name = os.path.split(tmp_path)
+    if name.endswith(TMP_MARKER):
+        name = name[:-len(TMP_MARKER)]
+    else:
+        stem, extension = os.path.splitext(name)
+        if stem.endswith(TMP_MARKER):
+            name = stem[:-len(TMP_MARKER)] + extension
+    return os.path.join(directory, name)
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _open_for_writing_windows(path):
+    """True if another process has the file open for writing (sharing violation on a deny-write open)"""
+    import ctypes
+    from ctypes import wintypes
+
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.CreateFileW.restype = wintypes.HANDLE
+    kernel32.CreateFileW.argtypes = [wintypes.LPCWSTR, wintypes.DWORD, wintypes.DWORD, wintypes.LPVOID,
+                                     wintypes.DWORD, wintypes.DWORD, wintypes.HANDLE]
+    GENERIC_READ, FILE_SHARE_READ, OPEN_EXISTING = 0x80000000, 0x1, 3
+    ERROR_SHARING_VIOLATION, INVALID_HANDLE_VALUE = 32, wintypes.HANDLE(-1).value
+    handle = kernel32.CreateFileW(path, GENERIC_READ, FILE_SHARE_READ, None, OPEN_EXISTING, 0, None)
+    if handle == INVALID_HANDLE_VALUE:
+        return ctypes.get_last_error() == ERROR_SHARING_VIOLATION
+    kernel32.CloseHandle(handle)
+    return False
+
+
+def open_for_writing(path):
+    """True/False if the platform can tell whether a writer still holds the file, else None"""
+    if sys.platform != "win32":
+        # Linux reports close-after-write through inotify instead
+        return None
+    try:
+        return _open_for_writing_windows(path)
+    except Exception as e:
+        logger.debug("Could not check the open handles of %s: %s", path, e)
+        return None
+
+
+class StabilityDetector:
+    """Waits for downloads to complete, woken early by the watcher's close and rename events"""
+
+    def __init__(self, quiet_period=QUIET_PERIOD, initial_poll=INITIAL_POLL, max_poll=MAX_POLL,
+                 stall_timeout=STALL_TIMEOUT, max_wait=MAX_WAIT):
+        self.quiet_period = quiet_period
+        self.initial_poll = initial_poll
+        self.max_poll = max_poll
+        self.stall_timeout = stall_timeout
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._waiters = {}  # key -> threading.Event of the check waiting on it
+        self._signals = {}  # key -> time a close or rename-into-place event was seen
+
+    def notify(self, key, event):
+        """Pass on a watcher event; a close or a rename into the final name completes the download"""
+        if event.kind not in (EVENT_CLOSED, EVENT_MOVED) or is_temporary(event.path):
+            return
+        now = time.time()
+        with self._lock:
+            self._signals[key] = now
+            waiter = self._waiters.get(key)
+            if len(self._signals) > 1000:
+                for stale in [k for k, seen in self._signals.items() if now - seen > SIGNAL_TTL]:
+                    del self._signals[stale]
+        if waiter is not None:
+            waiter.set()
+
+    def _take_signal(self, key):
+        with self._lock:
+            seen = self._signals.pop(key, None)
+        return seen is not None and time.time() - seen <= SIGNAL_TTL
+
+    def _complete(self, path, how, started):
+        signature = _signature(path)
+        if signature is None or signature[0] == 0:
+            # Gone, or created empty and not written yet (closing an empty file does not finish a
+            # download; one that stays empty through the quiet period completes in _poll)
+            return False
+        writing = open_for_writing(path)
+        if writing:
+            return False
+        _results.inc(result=how)
+        _wait_seconds.observe(time.time() - started)
+        logger.debug("File complete (%s) after %.3fs: %s", how, time.time() - started, path)
+        return True
+
+    def wait(self, event, key):
+        """Return the completed file's path for a watcher event, or None if it never completed"""
+        started = time.time()
+        path = final_path_for(event.path) if is_temporary(event.path) else event.path
+        if event.kind in (EVENT_CLOSED, EVENT_MOVED) and path == event.path and os.path.exists(path):
+            # The writer closed the file or moved it into place, so it is complete
+            self._take_signal(key)
+            if self._complete(path, "event", started):
+                return path
+
+        waiter = threading.Event()
+        with self._lock:
+            self._waiters[key] = waiter
+        try:
+            return self._poll(event.path, path, key, waiter, started)
+        finally:
+            with self._lock:
+                self._waiters.pop(key, None)
+
+    def _poll(self, event_path, path, key, waiter, started):
+        signature = None
+        changed = started
+        delay = self.initial_poll
+        while True:
+            now = time.time()
+            if waiter.is_set() or self._take_signal(key):
+                waiter.clear()
+                if os.path.exists(path) and self._complete(path, "event", started):
+                    return path
+
+            current = _signature(path)
+            if current is not None and path != event_path and not os.path.exists(event_path):
+                # The temporary file was renamed to its final name
+                if self._complete(path, "renamed", started):
+                    return path
+
+            if current != signature:
+                signature = current
+                changed = now
+                delay = self.initial_poll
+            elif current is not None:
+                writing = open_for_writing(path)
+                # Without a way to see the writer, only a quiet period shows the download stopped;
+                # an empty file always waits it out, as its writer may not have opened it yet
+                quiet = self.quiet_period if writing is None or current[0] == 0 else self.initial_poll
+                if not writing and now - changed >= quiet:
+                    _results.inc(result="quiet" if writing is None else "unlocked")
+                    _wait_seconds.observe(now - started)
+                    return path
+
+            if now - changed > self.stall_timeout or now - started > self.max_wait:
+                _results.inc(result="timeout")
+                if current is None:
+                    logger.warning("Timeout reached. Final file %s not found.", path)
+                else:
+                    logger.warning("Timeout reached. File %s is still being written.", path)
+                return None
+
+            # Poll again soon after a change, then back off while nothing happens
+            wake = delay
+            if current is not None and current == signature:
+                wake = min(wake, max(0.0, changed + self.quiet_period - now))
+            waiter.wait(max(wake, 0.001))
+            delay = min(delay * 2, self.max_poll)
+
+
+_detector = StabilityDetector()
+
+
+def configure_stability(**settings):
+    """Replace the shared detector (quiet_period, initial_poll, max_poll, stall_timeout, max_wait)"""
+    global _detector
+    _detector = StabilityDetector(**settings)
+    return _detector
+
+
+def get_stability_detector():
+    return _detector
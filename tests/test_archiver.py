@@ -0,0 +1,62 @@
+import os
+import time
+
+from PIL import Image
+
+from archiver import ARCHIVE_MANIFEST, ScreenshotArchiver
+
+
+def screenshot():
+    return Image.new("RGB", (64, 48), "white")
+
+
+def test_defaults_keep_everything_lossless(tmp_path):
+    archiver = ScreenshotArchiver(str(tmp_path), crop_to_regions=False)
+    path = archiver.submit(screenshot(), "a_screenshot_1")
+    archiver.close()
+    assert path.endswith(".png")
+    assert os.path.exists(path)
+    assert archiver.retention_days is None and archiver.max_bytes is None
+
+
+def test_written_files_are_closed_and_listed(tmp_path):
+    archiver = ScreenshotArchiver(str(tmp_path), crop_to_regions=False, fsync_batch=100, fsync_interval=60)
+    path = archiver.submit(screenshot(), "a_screenshot_1")
+    manifest_path = tmp_path / ARCHIVE_MANIFEST
+    deadline = time.time() + 5
+    # A file is listed in the manifest once it has been written and closed
+    while time.time() < deadline and not (manifest_path.exists() and manifest_path.read_text(encoding="utf-8")):
+        time.sleep(0.01)
+    # Renamed before the batched fsync, which fails on Windows while a handle is open
+    os.replace(path, path + ".moved")
+    os.replace(path + ".moved", path)
+    archiver.close()
+    assert manifest_path.read_text(encoding="utf-8").split() == [os.path.basename(path)]
+
+
+def test_retention_only_deletes_the_archivers_own_files(tmp_path):
+    old = time.time() - 30 * 86400
+    foreign = tmp_path / "holiday_screenshot_2020.png"
+    foreign.write_bytes(b"not ours")
+    os.utime(foreign, (old, old))
+
+    archiver = ScreenshotArchiver(str(tmp_path), crop_to_regions=False)
+    ours = archiver.submit(screenshot(), "a_screenshot_1")
+    archiver.close()
+    os.utime(ours, (old, old))
+
+    archiver = ScreenshotArchiver(str(tmp_path), crop_to_regions=False, retention_days=7)
+    archiver.close()
+    assert foreign.exists()
+    assert not os.path.exists(ours)
+    assert (tmp_path / ARCHIVE_MANIFEST).read_text(encoding="utf-8") == ""
+
+
+def test_same_name_twice_is_not_overwritten(tmp_path):
+    archiver = ScreenshotArchiver(str(tmp_path), crop_to_regions=False)
+    first = archiver.submit(screenshot(), "a_screenshot_1")
+    second = archiver.submit(screenshot(), "a_screenshot_1")
+    archiver.close()
+    assert os.path.basename(first) == "a_screenshot_1.png"
+    assert os.path.basename(second) == "a_screenshot_1_2.png"
+    assert os.path.exists(first) and os.path.exists(second)
@@ -0,0 +1,93 @@
+import json
+import os
+
+import pytest
+from PIL import Image, features
+
+import batch_replay
+import frames
+import screenshot_extract
+from archiver import ScreenshotArchiver
+
+
+@pytest.mark.parametrize("image_format", ["png", "jpeg", "webp"])
+def test_replay_finds_the_regions_of_an_archived_crop(tmp_path, monkeypatch, image_format):
+    if image_format == "webp" and not features.check("webp"):
+        pytest.skip("Pillow has no WebP support")
+    frame = Image.new("RGB", (1000, 800), "white")
+    archiver = ScreenshotArchiver(str(tmp_path), image_format=image_format)
+    path = archiver.submit(frame, "Contact_MVR100_screenshot_20250224_162400")
+    archiver.close()
+    expected = frames.regions_bounding_box(1000, 800)
+
+    seen = []
+
+    def extract(screenshot):
+        seen.append(frames.frame_geometry(screenshot))
+        return "Contact", "MVR100", None
+    monkeypatch.setattr(screenshot_extract, "extract_info_from_screenshot", extract)
+    result = batch_replay.process_screenshot((path, None))
+    assert result["status"] == "ok"
+    # The archive kept only the regions, and replay still places them in the original frame
+    assert seen == [(expected[0], expected[1], 1000, 800)]
+    with Image.open(path) as archived:
+        assert archived.size == (expected[2] - expected[0], expected[3] - expected[1])
+
+
+def touch(path):
+    path.write_bytes(b"x")
+    return str(path)
+
+
+@pytest.fixture
+def folders(tmp_path):
+    screenshots = tmp_path / "Screenshots"
+    attachments = tmp_path / "attachments"
+    screenshots.mkdir()
+    attachments.mkdir()
+    return screenshots, attachments
+
+
+def test_screenshots_pair_with_suffixed_attachments(folders):
+    screenshots, attachments = folders
+    first = touch(attachments / "Contact_MVR100_2025-02-24.jpg")
+    second = touch(attachments / "Contact_MVR100_2025-02-24_2.jpg")
+    shots = [touch(screenshots / "Contact_MVR100_2025-02-24_screenshot_20250224_162400.png"),
+             touch(screenshots / "Contact_MVR100_2025-02-24_2_screenshot_20250224_162400_2.png"),
+             touch(screenshots / "Other_screenshot_20250224_162400.png")]
+    index = batch_replay.index_attachments(str(attachments))
+    assert batch_replay.pair_screenshots(shots, index) == [(shots[0], first), (shots[1], second), (shots[2], None)]
+
+
+def test_an_attachment_matched_twice_is_left_unpaired(folders):
+    screenshots, attachments = folders
+    touch(attachments / "Contact_MVR100.jpg")
+    shots = [touch(screenshots / "Contact_MVR100_screenshot_20250224_162400.png"),
+             touch(screenshots / "Contact_MVR100_screenshot_20250224_162400_2.png")]
+    index = batch_replay.index_attachments(str(attachments))
+    assert batch_replay.pair_screenshots(shots, index) == [(shots[0], None), (shots[1], None)]
+
+
+@pytest.mark.parametrize("apply", [False, True])
+def test_dry_run_renames_nothing_and_apply_renames_the_pair(folders, monkeypatch, apply):
+    screenshots, attachments = folders
+    attachment = touch(attachments / "IMG_0001.jpg")
+    touch(screenshots / "IMG_0001_screenshot_20250224_162400.png")
+
+    def process(job):
+        return {"screenshot": job[0], "attachment": job[1], "contact_name": "Contact", "details": "MVR100",
+                "date_time": "", "new_name": "Contact_MVR100.jpg", "status": "ok", "elapsed_ms": 0}
+    monkeypatch.setattr(batch_replay, "process_screenshot", process)
+    monkeypatch.setattr(batch_replay, "_init_worker", lambda *args: None)
+    output = screenshots.parent / "results.jsonl"
+    summary = batch_replay.run_batch(str(screenshots), str(attachments), str(output), workers=1, apply=apply)
+
+    assert summary["ok"] == 1
+    row = json.loads(output.read_text(encoding="utf-8"))
+    if apply:
+        assert summary["renamed"] == 1 and row["action"] == "renamed"
+        assert sorted(os.listdir(attachments)) == ["Contact_MVR100.jpg"]
+    else:
+        assert summary["renamed"] == 0 and row["action"] == "dry-run"
+        assert os.listdir(attachments) == ["IMG_0001.jpg"]
+        assert os.path.exists(attachment)
@@ -0,0 +1,94 @@
+import io
+import json
+import socket
+
+import pytest
+from PIL import Image
+
+from capture_backend import ReplayBackend, _first_sighting, _load_frame, _parse_address, encode_frame, send_frame
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def replay():
+    backends = []
+
+    def start(**options):
+        backend = ReplayBackend(f"tcp://:{free_port()}", wait=1, **options)
+        backends.append(backend)
+        return backend
+    yield start
+    for backend in backends:
+        backend.close()
+
+
+def connect(backend):
+    return socket.create_connection(backend._server.getsockname())
+
+
+def frame():
+    return Image.new("RGB", (32, 24), "white")
+
+
+def test_socket_without_a_host_listens_on_loopback():
+    assert _parse_address("tcp://:8765") == (socket.AF_INET, ("127.0.0.1", 8765))
+
+
+def test_frames_are_served_by_name(replay):
+    backend = replay()
+    with connect(backend) as sock:
+        send_frame(sock, frame(), "receipt.jpg")
+        image = backend.capture("Viber", name="receipt.jpg")
+    assert image.size == (32, 24)
+
+
+def test_frames_without_the_token_are_refused(replay):
+    backend = replay(token="secret")
+    with connect(backend) as sock:
+        send_frame(sock, frame(), "a.jpg", token="wrong")
+        assert backend.capture("Viber", name="a.jpg") is None
+    with connect(backend) as sock:
+        send_frame(sock, frame(), "b.jpg", token="secret")
+        assert backend.capture("Viber", name="b.jpg") is not None
+
+
+def test_oversized_frames_are_refused(replay):
+    backend = replay(max_frame_bytes=1024)
+    with connect(backend) as sock:
+        sock.sendall(json.dumps({"name": "big.jpg", "size": 10 ** 9}).encode("utf-8") + b"\n")
+        # The connection is dropped without reading the announced gigabyte
+        sock.settimeout(2)
+        assert sock.recv(1) == b""
+    assert backend.capture("Viber", name="big.jpg") is None
+
+
+def test_frames_with_too_many_pixels_are_not_decoded():
+    buffer = io.BytesIO()
+    Image.new("L", (200, 200)).save(buffer, format="PNG")
+    buffer.seek(0)
+    with pytest.raises(ValueError, match="pixel limit"):
+        _load_frame(buffer, max_pixels=100 * 100)
+
+
+def test_frames_with_a_non_string_name_are_dropped_without_closing_the_connection(replay):
+    backend = replay()
+    with connect(backend) as sock:
+        data = encode_frame(frame())
+        sock.sendall(json.dumps({"name": ["bad"], "size": len(data)}).encode("utf-8") + b"\n" + data)
+        send_frame(sock, frame(), "good.jpg")
+        assert backend.capture("Viber", name="good.jpg") is not None
+
+
+def test_agent_captures_a_reused_name_again_after_the_window():
+    sent = {}
+    assert _first_sighting(sent, "receipt.jpg", now=0, window=60)
+    assert not _first_sighting(sent, "receipt.jpg", now=30, window=60)
+    assert _first_sighting(sent, "receipt.jpg", now=100, window=60)
+    # Expired names are pruned rather than kept forever
+    _first_sighting(sent, "other.jpg", now=500, window=60)
+    assert list(sent) == ["other.jpg"]
@@ -0,0 +1,94 @@
+import pytest
+
+from field_rules import DEFAULT_RULES, FieldRuleEngine, load_rules
+
+
+def values(fields):
+    return {field: value for field, (value, _, _) in fields.items()}
+
+
+def test_default_rules_read_a_receipt():
+    text = ("SoneeHardware JanavareeMagu\nLast seen today at 4:24 PM\nMonday, February 24, 2025\n"
+            "To SONEE HARDWARE\nMVR 7701 70007B 001\n1,065.80\n24/02/2025\nReference BLAZ29Y417504782\nSUCCESS")
+    assert values(FieldRuleEngine().extract(text)) == {
+        'contact_name': "SoneeHardware JanavareeMagu",
+        'time': "4:24 PM",
+        'date': "Monday, February 24, 2025",
+        'account': "MVR 7701 70007B 001",
+        'amount': "1,065.80",
+        'transaction_date': "24/02/2025",
+        'reference': "BLAZ29Y417504782",
+        'status': "SUCCESS",
+    }
+
+
+def test_overlapping_matches_of_different_rules_are_all_found():
+    rules = [
+        {'name': 'amount', 'field': 'amount', 'pattern': r"\d+\.\d{2}", 'priority': 10},
+        {'name': 'amount_line', 'field': 'line', 'pattern': r"Amount\s+\d+\.\d{2}", 'priority': 10},
+    ]
+    assert values(FieldRuleEngine(rules).extract("Amount 12.50")) == {'amount': "12.50", 'line': "Amount 12.50"}
+
+
+def test_lower_priority_match_does_not_hide_a_higher_priority_one():
+    rules = [
+        {'name': 'any_code', 'field': 'reference', 'pattern': r"Ref\w*\s+\w+", 'priority': 1},
+        {'name': 'reference', 'field': 'reference', 'pattern': r"Reference\s+(?P<value>[A-Z0-9]+)", 'priority': 10},
+    ]
+    assert values(FieldRuleEngine(rules).extract("Reference BLAZ29")) == {'reference': "BLAZ29"}
+
+
+def test_earliest_match_wins_among_equal_priorities():
+    rules = [
+        {'name': 'late', 'field': 'code', 'pattern': r"B\d", 'priority': 5},
+        {'name': 'early', 'field': 'code', 'pattern': r"A\d", 'priority': 5},
+    ]
+    assert FieldRuleEngine(rules).extract("B1 A2") == {'code': ("B1", 0, 2)}
+
+
+def test_region_scoped_rule_only_matches_its_region():
+    rules = [{'name': 'seen', 'field': 'time', 'pattern': r"\d{1,2}:\d{2}", 'regions': ['header']}]
+    engine = FieldRuleEngine(rules)
+    text = "4:24 PM\n5:30 PM"
+    assert values(engine.extract(text, [('amount', 0, 8), ('header', 8, 15)])) == {'time': "5:30"}
+    assert values(engine.extract(text)) == {'time': "4:24"}
+
+
+def test_flags_apply_to_their_rule_only():
+    rules = [
+        {'name': 'status', 'field': 'status', 'pattern': r"success", 'flags': ['IGNORECASE']},
+        {'name': 'code', 'field': 'code', 'pattern': r"abc"},
+    ]
+    assert values(FieldRuleEngine(rules).extract("SUCCESS ABC")) == {'status': "SUCCESS"}
+
+
+def test_invalid_rules_are_reported_by_name():
+    with pytest.raises(ValueError, match="'broken'"):
+        FieldRuleEngine([{'name': 'broken', 'field': 'x', 'pattern': r"{NOPE}"}])
+    with pytest.raises(ValueError, match="'grouped'"):
+        FieldRuleEngine([{'name': 'grouped', 'field': 'x', 'pattern': r"(?P<other>x)"}])
+
+
+def test_rules_file_overrides_and_disables_defaults(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text('[{"name": "status", "enabled": false}, {"name": "amount", "priority": 99},'
+                    ' {"name": "extra", "field": "note", "pattern": "Note \\\\w+"}]', encoding="utf-8")
+    rules = {rule['name']: rule for rule in load_rules(str(path))}
+    assert len(rules) == len(DEFAULT_RULES) + 1
+    assert rules['amount']['priority'] == 99
+    engine = FieldRuleEngine(list(rules.values()))
+    assert 'status' not in engine.fields
+    assert values(engine.extract("Note paid SUCCESS"))['note'] == "Note paid"
+
+
+def test_malformed_rules_files_raise_value_error(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text('{"name": "status"}', encoding="utf-8")
+    with pytest.raises(ValueError):
+        load_rules(str(path))
+    path.write_text('[{"name": "new_rule", "field": "note"}]', encoding="utf-8")
+    with pytest.raises(ValueError, match="'new_rule'"):
+        FieldRuleEngine(load_rules(str(path)))
+    path.write_text('[{"name": "amount", "pattern": "(unclosed"}]', encoding="utf-8")
+    with pytest.raises(ValueError, match="'amount'"):
+        FieldRuleEngine(load_rules(str(path)))
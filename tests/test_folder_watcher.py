@@ -0,0 +1,47 @@
+import os
+
+from folder_watcher import EVENT_CLOSED, EVENT_CREATED, EVENT_MODIFIED, ScandirWatcher
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def test_scandir_reports_new_file_then_close(tmp_path):
+    watcher = ScandirWatcher(str(tmp_path), interval=0)
+    path = str(tmp_path / "photo.jpg")
+    write(path, b"data")
+    assert watcher.read_events() == [(EVENT_CREATED, path)]
+    assert watcher.read_events() == [(EVENT_CLOSED, path)]
+    assert watcher.read_events() == []
+
+
+def test_scandir_reports_existing_file_rewritten_in_place(tmp_path):
+    path = str(tmp_path / "IMG_0001.jpg")
+    write(path, b"")
+    watcher = ScandirWatcher(str(tmp_path), interval=0)
+    assert watcher.read_events() == []
+
+    # The folder's mtime does not change when a file is written in place
+    write(path, b"downloaded")
+    os.utime(path, ns=(0, 1))
+    assert watcher.read_events() == [(EVENT_MODIFIED, path)]
+    assert watcher.read_events() == [(EVENT_CLOSED, path)]
+
+
+def test_scandir_stats_unchanged_folders_only_on_the_full_rescan(tmp_path):
+    path = str(tmp_path / "IMG_0001.jpg")
+    write(path, b"")
+    # An old folder mtime, so the watcher trusts it
+    os.utime(str(tmp_path), ns=(0, 10 ** 9))
+    watcher = ScandirWatcher(str(tmp_path), interval=0, full_rescan_interval=3600)
+
+    write(path, b"downloaded")
+    os.utime(str(tmp_path), ns=(0, 10 ** 9))
+    assert watcher.read_events() == []
+
+    # Adding an entry changes the folder's mtime, which triggers a full scan
+    new = str(tmp_path / "photo.jpg")
+    write(new, b"data")
+    assert sorted(watcher.read_events()) == sorted([(EVENT_CREATED, new), (EVENT_MODIFIED, path)])
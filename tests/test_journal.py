@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+from journal import (ProcessingJournal, STATE_CAPTURED, STATE_DETECTED, STATE_FAILED, STATE_RENAMED,
+                     STATE_RENAMING, STATE_STABLE)
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = ProcessingJournal(str(tmp_path / "journal.sqlite3"))
+    yield journal
+    journal.close()
+
+
+@pytest.fixture
+def folder(tmp_path):
+    folder = tmp_path / "downloads"
+    folder.mkdir()
+    return folder
+
+
+def download(folder, name, data=b"receipt", mtime_ns=None):
+    path = folder / name
+    path.write_bytes(data)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+def test_files_present_on_first_use_are_baseline(journal, folder):
+    path = download(folder, "old.jpg")
+    assert not journal.folder_initialized(str(folder))
+    journal.initialize_folder(str(folder), [path])
+    assert journal.folder_initialized(str(folder))
+    assert journal.new_files(str(folder), [path]) == []
+    assert journal.is_processed(path)
+
+
+def test_unrecorded_file_is_new(journal, folder):
+    journal.initialize_folder(str(folder), [])
+    path = download(folder, "new.jpg")
+    assert journal.new_files(str(folder), [path]) == [path]
+
+
+def test_reused_name_of_a_baseline_file_is_new(journal, folder):
+    path = download(folder, "IMG_0001.jpg", b"first", mtime_ns=1_000_000_000)
+    journal.initialize_folder(str(folder), [path])
+    download(folder, "IMG_0001.jpg", b"second receipt", mtime_ns=2_000_000_000)
+    assert journal.new_files(str(folder), [path]) == [path]
+
+    # Tracking it again forgets the earlier file, so it is no longer treated as processed
+    journal.record_detected(path)
+    assert not journal.is_processed(path)
+
+
+def test_name_of_a_renamed_file_holds_a_new_download(journal, folder):
+    path = download(folder, "IMG_0001.jpg")
+    journal.record_detected(path)
+    stat = os.stat(path)
+    journal.update(path, STATE_STABLE, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+    journal.update(path, STATE_RENAMED, output_path=str(folder / "renamed.jpg"))
+    assert journal.new_files(str(folder), [path]) == [path]
+
+
+def test_failed_file_is_not_retried_unless_it_changed(journal, folder):
+    path = download(folder, "broken.jpg", mtime_ns=1_000_000_000)
+    journal.record_detected(path)
+    journal.update(path, STATE_STABLE, size=os.path.getsize(path), mtime_ns=1_000_000_000)
+    journal.update(path, STATE_FAILED, error="OCR failed")
+    assert journal.new_files(str(folder), [path]) == []
+    download(folder, "broken.jpg", mtime_ns=2_000_000_000)
+    assert journal.new_files(str(folder), [path]) == [path]
+
+
+def test_in_flight_lists_unfinished_files(journal, folder):
+    paths = [download(folder, f"{index}.jpg") for index in range(4)]
+    for path, state in zip(paths, (STATE_DETECTED, STATE_CAPTURED, STATE_RENAMING, STATE_RENAMED)):
+        journal.update(path, state, output_path=path + ".out" if state == STATE_RENAMING else None)
+    rows = sorted(journal.in_flight(str(folder)))
+    assert [(os.path.basename(path), state) for path, state, _ in rows] == [
+        ("0.jpg", STATE_DETECTED), ("1.jpg", STATE_CAPTURED), ("2.jpg", STATE_RENAMING)]
+    assert rows[2][2] == os.path.abspath(paths[2] + ".out")
+
+
+def test_is_processed_checks_content_and_outputs(journal, folder):
+    path = download(folder, "a.jpg")
+    output = str(folder / "Contact_MVR100.jpg")
+    journal.update(path, STATE_RENAMED, digest="abc", output_path=output, fields={"contact_name": "Contact"})
+    assert journal.is_processed(path, "abc")
+    assert not journal.is_processed(path, "other")
+    assert journal.is_processed(output)
+    assert journal.find_by_digest("abc")["fields"] == {"contact_name": "Contact"}
+    assert journal.counts() == {STATE_RENAMED: 1}
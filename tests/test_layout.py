@@ -0,0 +1,81 @@
+import cv2
+import numpy as np
+import pytest
+
+import layout
+from screenshot_extract import _block_lines, _stack_blocks
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    layout.clear_layout_cache()
+    yield
+    layout.clear_layout_cache()
+
+
+def frame(*lines):
+    """White 400x600 frame with dark text at the given (x, y) positions"""
+    gray = np.full((400, 600), 255, dtype=np.uint8)
+    for text, x, y in lines:
+        cv2.putText(gray, text, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 1.0, 0, 2)
+    return gray
+
+
+def inside(box, boxes):
+    return any(top <= box[0] and left <= box[1] and box[2] <= bottom and box[3] <= right
+               for top, left, bottom, right in boxes)
+
+
+def test_text_outside_the_cached_blocks_is_found():
+    region = (0, 0, 400, 600)
+    key = layout.layout_key("chat", region)
+    first = layout.text_boxes(frame(("Amount 12.50", 20, 60)), region, key)
+    assert first
+
+    gray = frame(("Amount 12.50", 20, 60), ("Reference BLAZ29", 20, 300))
+    boxes = layout.text_boxes(gray, region, key)
+    mask = layout.text_mask(gray)
+    assert cv2.countNonZero(layout.uncovered(mask, boxes)) == 0
+    assert all(inside(box, boxes) for box in first)
+    assert len(boxes) > len(first)
+
+
+def test_cached_blocks_are_reused_without_a_new_analysis(monkeypatch):
+    region = (0, 0, 400, 600)
+    key = layout.layout_key("chat", region)
+    first = layout.text_boxes(frame(("Amount 12.50", 20, 60)), region, key)
+
+    def no_analysis(*args, **kwargs):
+        raise AssertionError("text_mask should not run on a cache hit")
+    monkeypatch.setattr(layout, "text_mask", no_analysis)
+    # Different text inside the cached blocks is still the same layout
+    assert layout.text_boxes(frame(("Amount 99.00", 20, 60)), region, key) == first
+
+
+def test_blocks_of_text_that_went_away_are_dropped_after_max_reuse(monkeypatch):
+    monkeypatch.setattr(layout, "LAYOUT_MAX_REUSE", 1)
+    region = (0, 0, 400, 600)
+    key = layout.layout_key("chat", region)
+    layout.text_boxes(frame(("Amount 12.50", 20, 60), ("Reference BLAZ29", 20, 300)), region, key)
+    gray = frame(("Reference BLAZ29", 20, 300))
+    # The text vanished inside a cached block, so the first lookup still hits
+    layout.text_boxes(gray, region, key)
+    only = layout.text_boxes(gray, region, key)
+    assert only == layout.text_boxes(frame(("Reference BLAZ29", 20, 300)), region, layout.layout_key("new", region))
+    assert all(top > 200 for top, _, _, _ in only)
+
+
+def test_blocks_on_one_line_are_grouped_left_to_right():
+    boxes = [(10, 300, 40, 400), (12, 10, 38, 100), (60, 10, 90, 200)]
+    assert _block_lines(boxes) == [[(12, 10, 38, 100), (10, 300, 40, 400)], [(60, 10, 90, 200)]]
+
+
+def test_stacked_blocks_keep_a_line_side_by_side():
+    gray = np.full((100, 500), 255, dtype=np.uint8)
+    gray[12:38, 10:100] = 0
+    gray[10:40, 300:400] = 0
+    gray[60:90, 10:200] = 0
+    canvas = _stack_blocks(gray, [(10, 300, 40, 400), (12, 10, 38, 100), (60, 10, 90, 200)])
+    gap = layout.BOX_PADDING * 2
+    # One line of 90 + gap + 100 pixels, 30 high, then the second line below it
+    assert canvas.shape == (30 + gap + 30, 90 + gap + 100)
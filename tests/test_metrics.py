@@ -0,0 +1,27 @@
+import json
+
+import metrics
+
+
+def test_counter_mirroring_a_total_stays_monotonic():
+    registry = metrics.Registry()
+    lookups = registry.counter("test_lookups_total", "Lookups")
+    lookups.set_total(5, result="hit")
+    lookups.set_total(3, result="hit")
+    text = registry.render()
+    assert "# TYPE viber_test_lookups_total counter" in text
+    assert 'viber_test_lookups_total{result="hit"} 5' in text
+
+
+def test_span_accepts_a_label_and_attribute_with_the_same_name(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    metrics.configure_tracing(str(path))
+    try:
+        with metrics.span("test_span", labels={"region": "amount"}, region="amount@2x", file="a.jpg"):
+            pass
+    finally:
+        metrics.configure_tracing(None)
+    record = json.loads(path.read_text(encoding="utf-8"))
+    assert record["span"] == "test_span"
+    assert record["region"] == "amount@2x"
+    assert record["file"] == "a.jpg"
@@ -0,0 +1,64 @@
+import time
+
+import numpy as np
+
+from ocr_cache import ExtractionCache, file_digest, view_hash
+
+
+def test_view_hash_is_stable_for_identical_pixels():
+    roi = np.random.default_rng(1).integers(0, 256, (120, 400), dtype=np.uint8)
+    assert view_hash([roi]) == view_hash([roi.copy()])
+
+
+def test_view_hash_changes_with_a_single_pixel():
+    roi = np.full((120, 400), 255, dtype=np.uint8)
+    changed = roi.copy()
+    changed[60, 200] = 254
+    assert view_hash([roi]) != view_hash([changed])
+
+
+def test_view_hash_includes_the_region_shape():
+    pixels = np.zeros(1200, dtype=np.uint8)
+    assert view_hash([pixels.reshape(30, 40)]) != view_hash([pixels.reshape(40, 30)])
+
+
+def test_view_hash_of_views_into_a_frame():
+    frame = np.random.default_rng(2).integers(0, 256, (300, 500), dtype=np.uint8)
+    assert view_hash([frame[10:60, 20:200]]) == view_hash([frame[10:60, 20:200].copy()])
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ExtractionCache("test", max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_cache_entries_expire(monkeypatch):
+    cache = ExtractionCache("test", ttl=10)
+    cache.put("a", [1, 2])
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 11)
+    assert cache.get("a") is None
+
+
+def test_cache_persists_to_disk(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    cache = ExtractionCache("attachment", db_path=db_path)
+    cache.put("digest", {"amount": "100.00"})
+    cache.close()
+    reopened = ExtractionCache("attachment", db_path=db_path)
+    assert reopened.get("digest") == {"amount": "100.00"}
+    assert reopened.stats()["disk_hits"] == 1
+    reopened.close()
+
+
+def test_file_digest_depends_on_content_only(tmp_path):
+    first, second, third = tmp_path / "a.jpg", tmp_path / "b.jpg", tmp_path / "c.jpg"
+    first.write_bytes(b"receipt")
+    second.write_bytes(b"receipt")
+    third.write_bytes(b"receipT")
+    assert file_digest(str(first)) == file_digest(str(second)) != file_digest(str(third))
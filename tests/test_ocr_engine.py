@@ -0,0 +1,40 @@
+import pytest
+
+from ocr_engine import DEFAULT_PROFILE, OcrProfile, load_ocr_profiles, ocr_profile, tesseract_config
+
+
+def test_settings_become_a_profile():
+    profile = ocr_profile({"psm": 7, "oem": 1, "whitelist": "0123456789.,", "scale": 1.5})
+    assert profile == OcrProfile(psm=7, oem=1, whitelist="0123456789.,", scale=1.5)
+    assert tesseract_config(profile) == "--psm 7 --oem 1 -c tessedit_char_whitelist=0123456789.,"
+    assert ocr_profile({}) == DEFAULT_PROFILE
+
+
+@pytest.mark.parametrize("settings", [
+    {"psm": 7.0},
+    {"psm": True},
+    {"psm": "7"},
+    {"psm": 14},
+    {"oem": 1.0},
+    {"oem": 4},
+    {"scale": 0},
+    {"scale": "2"},
+    {"lang": ["eng"]},
+    {"whitelist": "0 1"},
+    {"colour": True},
+])
+def test_invalid_settings_are_rejected(settings):
+    with pytest.raises(ValueError):
+        ocr_profile(settings)
+
+
+def test_profiles_file_errors_name_the_region(tmp_path):
+    path = tmp_path / "ocr_profiles.json"
+    path.write_text('{"header": {"psm": 7}, "amount": {"psm": 6.5}}', encoding="utf-8")
+    with pytest.raises(ValueError, match="'amount'"):
+        load_ocr_profiles(str(path))
+    path.write_text('[{"psm": 7}]', encoding="utf-8")
+    with pytest.raises(ValueError):
+        load_ocr_profiles(str(path))
+    path.write_text('{"header": {"psm": 7}}', encoding="utf-8")
+    assert load_ocr_profiles(str(path)) == {"header": OcrProfile(psm=7)}
@@ -0,0 +1,80 @@
+import threading
+import time
+
+from pipeline import FairQueue, Pipeline, Stage
+
+
+def test_items_pass_through_every_stage():
+    results = []
+    pipeline = Pipeline([
+        Stage("double", lambda item: item * 2),
+        Stage("drop_odd", lambda item: item if item % 4 == 0 else None),
+        Stage("collect", results.append),
+    ])
+    pipeline.start()
+    for number in range(6):
+        assert pipeline.put(number)
+    pipeline.stop(timeout=5)
+    assert sorted(results) == [0, 4, 8]
+    assert pipeline.in_flight() == 0
+
+
+def test_put_rejects_a_key_already_in_flight():
+    release = threading.Event()
+    pipeline = Pipeline([Stage("wait", lambda item: release.wait())])
+    pipeline.start()
+    assert pipeline.put("a.jpg")
+    assert not pipeline.put("a.jpg")
+    release.set()
+    pipeline.stop(timeout=5)
+
+
+def test_stop_gives_up_at_the_timeout_when_a_stage_is_stuck():
+    release = threading.Event()
+    pipeline = Pipeline([Stage("stuck", lambda item: release.wait(), queue_size=1)])
+    pipeline.start()
+    pipeline.put(1)
+    time.sleep(0.05)  # Let the worker take item 1 and block on it
+    pipeline.put(2)  # Fills the queue, so the stop sentinel cannot be queued
+    start = time.time()
+    pipeline.stop(timeout=0.3)
+    assert time.time() - start < 2
+    release.set()
+
+
+def drain(fair_queue):
+    items = []
+    while True:
+        entry = fair_queue.pop()
+        if entry is None:
+            return items
+        items.append(entry[1])
+
+
+def test_fair_queue_empty_returns_none():
+    fair_queue = FairQueue()
+    assert fair_queue.pop() is None
+    fair_queue.push("a", 1)
+    fair_queue.pop()
+    assert fair_queue.pop() is None
+    assert len(fair_queue) == 0
+
+
+def test_fair_queue_serves_sources_by_weight():
+    fair_queue = FairQueue({"busy": 2})
+    for number in range(1, 5):
+        fair_queue.push("busy", f"busy{number}")
+    fair_queue.push("quiet", "quiet1")
+    fair_queue.push("quiet", "quiet2")
+    assert fair_queue.pending() == {"busy": 4, "quiet": 2}
+    assert drain(fair_queue) == ["busy1", "busy2", "quiet1", "busy3", "busy4", "quiet2"]
+
+
+def test_fair_queue_burst_does_not_starve_a_later_source():
+    fair_queue = FairQueue()
+    for number in range(100):
+        fair_queue.push("burst", number)
+    assert fair_queue.pop() == ("burst", 0)
+    fair_queue.push("other", "x")
+    assert [fair_queue.pop() for _ in range(3)] == [("other", "x"), ("burst", 1), ("burst", 2)]
+    assert len(fair_queue) == 97
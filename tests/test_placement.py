@@ -0,0 +1,103 @@
+import errno
+import os
+
+import pytest
+
+import placement
+from placement import FilePlacer, PlacementError, rename_no_clobber
+
+
+def write(path, data=b"receipt"):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_rename_no_clobber_refuses_an_existing_target(tmp_path):
+    source = write(tmp_path / "a.jpg", b"new")
+    target = write(tmp_path / "b.jpg", b"old")
+    with pytest.raises(FileExistsError):
+        rename_no_clobber(source, target)
+    assert (tmp_path / "b.jpg").read_bytes() == b"old"
+    assert os.path.exists(source)
+
+
+def test_taken_names_get_a_suffix(tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    write(out / "Contact_MVR100.jpg", b"earlier")
+    placer = FilePlacer()
+    first = placer.place(write(tmp_path / "a.jpg", b"a"), str(out), "Contact_MVR100.jpg")
+    second = placer.place(write(tmp_path / "b.jpg", b"b"), str(out), "Contact_MVR100.jpg")
+    assert os.path.basename(first) == "Contact_MVR100_2.jpg"
+    assert os.path.basename(second) == "Contact_MVR100_3.jpg"
+    assert (out / "Contact_MVR100.jpg").read_bytes() == b"earlier"
+
+
+def test_file_created_after_the_listing_is_not_replaced(tmp_path):
+    placer = FilePlacer()
+    assert placer.reserve(str(tmp_path), "other.jpg").endswith("other.jpg")  # Caches the listing
+    write(tmp_path / "shot.png", b"someone else's")
+    with placer.create(str(tmp_path), "shot.png") as f:
+        f.write(b"ours")
+    assert os.path.basename(f.name) == "shot_2.png"
+    assert (tmp_path / "shot.png").read_bytes() == b"someone else's"
+
+
+def cross_volume(monkeypatch):
+    """Make every rename of the source fail as if the output folder were on another volume"""
+    real_rename = placement.rename_no_clobber
+
+    def rename(source, target):
+        if not source.endswith(placement.PART_SUFFIX):
+            raise OSError(errno.EXDEV, "Cross-device link")
+        real_rename(source, target)
+    monkeypatch.setattr(placement, "rename_no_clobber", rename)
+
+
+def test_cross_volume_move_copies_then_deletes_the_source(tmp_path, monkeypatch):
+    cross_volume(monkeypatch)
+    out = tmp_path / "out"
+    out.mkdir()
+    source = write(tmp_path / "a.jpg", b"x" * 100000)
+    target = FilePlacer(chunk_size=4096).place(source, str(out), "new.jpg")
+    assert target == str(out / "new.jpg")
+    assert (out / "new.jpg").read_bytes() == b"x" * 100000
+    assert not os.path.exists(source)
+    assert os.listdir(out) == ["new.jpg"]
+
+
+def test_failed_copy_keeps_the_source_and_frees_the_name(tmp_path, monkeypatch):
+    cross_volume(monkeypatch)
+    out = tmp_path / "out"
+    out.mkdir()
+    source = write(tmp_path / "a.jpg")
+    placer = FilePlacer()
+    with pytest.raises(PlacementError):
+        placer.place(source, str(out), "new.jpg", digest="not the digest of the source")
+    assert os.path.exists(source)
+    assert os.listdir(out) == []
+    assert placer.reserve(str(out), "new.jpg") == str(out / "new.jpg")
+
+
+def test_place_many_reserves_every_name_and_reports_each_failure(tmp_path, monkeypatch):
+    out = tmp_path / "out"
+    out.mkdir()
+    write(out / "Contact.jpg", b"earlier")
+    placer = FilePlacer()
+    listings = []
+    real_scandir = os.scandir
+
+    def scandir(directory):
+        listings.append(directory)
+        return real_scandir(directory)
+    monkeypatch.setattr(placement.os, "scandir", scandir)
+    results = placer.place_many([
+        (write(tmp_path / "a.jpg", b"a"), str(out), "Contact.jpg"),
+        (str(tmp_path / "missing.jpg"), str(out), "Other.jpg"),
+        (write(tmp_path / "b.jpg", b"b"), str(out), "Contact.jpg"),
+    ])
+    assert [os.path.basename(path) for path in (results[0], results[2])] == ["Contact_2.jpg", "Contact_3.jpg"]
+    assert isinstance(results[1], OSError)
+    assert sorted(os.listdir(out)) == ["Contact.jpg", "Contact_2.jpg", "Contact_3.jpg"]
+    # The output folder is listed once for the whole batch
+    assert listings == [str(out)]
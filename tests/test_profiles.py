@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+from profiles import load_profiles
+
+
+def write_profiles(tmp_path, config):
+    path = tmp_path / "profiles.json"
+    path.write_text(json.dumps(config), encoding="utf-8")
+    return str(path)
+
+
+def profile(**settings):
+    return dict({"name": "shop", "folder": "downloads", "output_dir": "renamed"}, **settings)
+
+
+def test_profiles_are_loaded_with_defaults(tmp_path):
+    rois = {"header": {"top": 0.1, "left": 0.2, "bottom": 0.3, "right": 0.9}}
+    path = write_profiles(tmp_path, {"profiles": [profile(rois=rois, weight=2),
+                                                  profile(name="office", folder="office")]})
+    shop, office = load_profiles(path, {"window_title": "Viber"})
+    assert shop.rois == rois and shop.weight == 2
+    assert office.window_title == "Viber" and office.rois is None and office.required_fields is None
+
+
+@pytest.mark.parametrize("config, message", [
+    ([], "profiles"),
+    ({"profiles": "x"}, "profiles"),
+    ({"profiles": ["x"]}, "object"),
+    ({"profiles": [profile(rois=[1])]}, "'shop'"),
+    ({"profiles": [profile(rois={"header": [1]})]}, "'shop'"),
+    ({"profiles": [profile(rois={"header": {"top": "0", "left": 0, "bottom": 1, "right": 1}})]}, "'shop'"),
+    ({"profiles": [profile(weight=None)]}, "'shop'"),
+    ({"profiles": [profile(fallback_fields="contact_name")]}, "'shop'"),
+    ({"profiles": [profile(required_fields=[1])]}, "'shop'"),
+    ({"profiles": [profile(folder=7)]}, "'shop'"),
+    ({"profiles": [profile(colour="red")]}, "'shop'"),
+    ({"profiles": [profile(), profile(folder="other")]}, "unique"),
+])
+def test_malformed_profiles_raise_value_error(tmp_path, config, message):
+    with pytest.raises(ValueError, match=message):
+        load_profiles(write_profiles(tmp_path, config))
@@ -0,0 +1,61 @@
+import numpy as np
+from PIL import Image
+
+import screenshot_extract
+from ocr_engine import OcrResult
+
+
+class FakePool:
+    """Returns canned OCR text per region and records which regions were OCR'd"""
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.regions = []
+
+    def ocr_regions(self, images, with_data=False):
+        self.regions.extend(images)
+        return {name: OcrResult(self.texts.get(name, ""), []) for name in images}
+
+    def image_to_data(self, gray):
+        self.regions.append("full_frame")
+        return OcrResult("", [])
+
+
+def run_lazy(monkeypatch, texts, required=None):
+    pool = FakePool(texts)
+    monkeypatch.setattr(screenshot_extract, "get_pool", lambda: pool)
+    monkeypatch.setattr(screenshot_extract, "preprocess_regions",
+                        lambda screenshot, gray, names, *args: {name: None for name in names})
+    screenshot = Image.new("RGB", (800, 600), "white")
+    text, _ = screenshot_extract.extract_regions_lazy(screenshot, np.full((600, 800), 255, np.uint8),
+                                                      required=required)
+    return pool.regions, text
+
+
+TEXTS = {
+    'header': "SoneeHardware JanavareeMagu\nLast seen today at 4:24 PM",
+    'transaction_info': "Transfer 1,065.80",
+    'bank_details': "Reference BLAZ29Y417504782",
+}
+
+
+def test_lazy_mode_stops_once_the_filename_fields_are_found(monkeypatch):
+    regions, text = run_lazy(monkeypatch, TEXTS)
+    assert "bank_details" not in regions
+    assert "SoneeHardware" in text and "1,065.80" in text
+
+
+def test_lazy_mode_reads_further_regions_for_missing_fields(monkeypatch):
+    regions, text = run_lazy(monkeypatch, TEXTS, required=('contact_name', 'amount', 'reference'))
+    assert "bank_details" in regions
+    assert "BLAZ29Y417504782" in text
+
+
+def test_view_key_covers_every_region_whose_text_is_cached():
+    screenshot = Image.new("RGB", (800, 600), "white")
+    gray = np.full((600, 800), 255, np.uint8)
+    key = screenshot_extract.conversation_view_key(screenshot, gray)
+    bank_details = screenshot_extract.ROIS['bank_details']
+    changed = gray.copy()
+    changed[int(bank_details['bottom'] * 600) - 5, int(bank_details['left'] * 800) + 5] = 0
+    assert screenshot_extract.conversation_view_key(screenshot, changed) != key
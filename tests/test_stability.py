@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+
+import pytest
+
+from folder_watcher import EVENT_CLOSED, EVENT_CREATED, EVENT_MOVED, FileEvent
+from stability import StabilityDetector, final_path_for, is_temporary
+
+
+@pytest.mark.parametrize("name, temporary, final", [
+    ("photo.jpg_tmp", True, "photo.jpg"),
+    ("photo_tmp.jpg", True, "photo.jpg"),
+    ("receipt.pdf", False, "receipt.pdf"),
+    ("my_tmp_notes.txt", False, "my_tmp_notes.txt"),
+])
+def test_temporary_names(tmp_path, name, temporary, final):
+    path = os.path.join(str(tmp_path), name)
+    assert is_temporary(path) == temporary
+    assert final_path_for(path) == os.path.join(str(tmp_path), final)
+
+
+def detector():
+    return StabilityDetector(quiet_period=0.2, initial_poll=0.01, max_poll=0.05, stall_timeout=2, max_wait=5)
+
+
+def test_closed_file_completes_at_once(tmp_path):
+    path = tmp_path / "receipt.jpg"
+    path.write_bytes(b"data")
+    started = time.time()
+    assert detector().wait(FileEvent(EVENT_CLOSED, str(path)), str(path)) == str(path)
+    assert time.time() - started < 0.2
+
+
+def test_temporary_download_completes_when_renamed(tmp_path):
+    tmp = tmp_path / "photo.jpg_tmp"
+    final = tmp_path / "photo.jpg"
+    tmp.write_bytes(b"partial")
+
+    def finish():
+        time.sleep(0.1)
+        tmp.write_bytes(b"partial and the rest")
+        os.replace(tmp, final)
+    writer = threading.Thread(target=finish)
+    writer.start()
+    result = detector().wait(FileEvent(EVENT_CREATED, str(tmp)), str(final))
+    writer.join()
+    assert result == str(final)
+
+
+def test_move_event_wakes_the_waiting_check(tmp_path):
+    stability = StabilityDetector(quiet_period=5, initial_poll=0.5, max_poll=1, stall_timeout=10, max_wait=10)
+    path = tmp_path / "receipt.jpg"
+    path.write_bytes(b"data")
+
+    def moved():
+        time.sleep(0.1)
+        stability.notify(str(path), FileEvent(EVENT_MOVED, str(path)))
+    threading.Thread(target=moved).start()
+    started = time.time()
+    assert stability.wait(FileEvent(EVENT_CREATED, str(path)), str(path)) == str(path)
+    # Completed by the event, long before the quiet period
+    assert time.time() - started < 2
+
+
+def test_empty_file_is_not_complete_when_closed(tmp_path):
+    path = tmp_path / "receipt.jpg"
+    path.write_bytes(b"")
+
+    def write():
+        time.sleep(0.1)
+        path.write_bytes(b"data")
+    writer = threading.Thread(target=write)
+    writer.start()
+    started = time.time()
+    assert detector().wait(FileEvent(EVENT_CLOSED, str(path)), str(path)) == str(path)
+    writer.join()
+    assert time.time() - started >= 0.1
+    assert path.read_bytes() == b"data"
+
+
+def test_file_that_stays_empty_completes_after_the_quiet_period(tmp_path):
+    path = tmp_path / "empty.txt"
+    path.write_bytes(b"")
+    started = time.time()
+    assert detector().wait(FileEvent(EVENT_CLOSED, str(path)), str(path)) == str(path)
+    assert 0.2 <= time.time() - started < 2
+
+
+def test_missing_file_times_out(tmp_path):
+    stability = StabilityDetector(quiet_period=0.05, initial_poll=0.01, max_poll=0.02, stall_timeout=0.2, max_wait=1)
+    tmp = tmp_path / "never.jpg_tmp"
+    assert stability.wait(FileEvent(EVENT_CREATED, str(tmp)), str(tmp_path / "never.jpg")) is None
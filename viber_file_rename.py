@@ -1,289 +1,218 @@
+import logging
 import os
 import time
-import pyautogui
-import win32gui
-import win32con
-import pytesseract
 import re
-from PIL import Image, ImageGrab
-import cv2
-import numpy as np
 from datetime import datetime
+from folder_watcher import create_watcher, FileEvent, EVENT_CREATED
+from frames import frame_pnginfo
+import metrics
+from field_rules import configure_rules
+from archiver import ScreenshotArchiver, get_archiver
+from capture_backend import configure_capture, get_capture_backend, close_capture, frame_name
+from journal import (open_journal, get_journal, close_journal, path_key, STATE_DETECTED, STATE_STABLE,
+                     STATE_CAPTURED, STATE_RENAMING, STATE_RENAMED, STATE_SKIPPED, STATE_FAILED)
+from ocr_engine import configure_ocr_profiles, configure_pool, set_tesseract_cmd, shutdown_pool
+from ocr_cache import configure_caches, get_attachment_cache, file_digest, cache_stats, format_cache_stats
+from pipeline import FairQueue, Pipeline, Stage
+from placement import configure_placement, get_placer
+from stability import configure_stability, get_stability_detector, final_path_for, is_temporary
+from profiles import Profile, configure_profiles, format_profile_stats, load_profiles, profile_for
+from attachment_extract import extract_fields_from_attachment, is_supported_attachment
+from screenshot_extract import (extract_fields_from_screenshot, finish_extraction, missing_fields,
+                                build_new_name)
 
-# Configure pytesseract path - update this to your installation path
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+logger = logging.getLogger("viber_file_rename")
+
+# Tesseract path - update this to your installation path
+TESSERACT_CMD = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+
+# OCR worker pool: "auto" uses the in-process tesserocr binding when installed
+OCR_ENGINE = "auto"
+OCR_POOL_SIZE = 3  # Number of long-lived OCR workers (one per region is enough)
+OCR_TIMEOUT = 15  # Seconds to wait for a single OCR call
 
-# Time to wait between checks (in seconds)
-WAIT_TIME = 1
 TIMEOUT = 30  # Timeout after this many seconds
 VIBER_WINDOW_TITLE = "Rakuten Viber"  # Title of the Viber window
 
+# Folder watcher backend: "auto", "inotify", "windows" or "scandir"
+WATCH_BACKEND = "auto"
+# A download is complete as soon as the watcher reports it closed or renamed from "_tmp".
+# Otherwise it is polled (backing off up to STABILITY_MAX_POLL seconds) until nothing holds it
+# open for writing or, where that cannot be checked, its size stays unchanged this many seconds
+STABILITY_QUIET_PERIOD = 0.5
+STABILITY_MAX_POLL = 1.0
+
+# JSON file defining several watch profiles (folder, output folders, window, regions, rules;
+# see profiles.py) served by one process; None watches folder_to_watch with the settings here
+PROFILES_FILE = None
+# Seconds per round the event loop waits for new files, shared by every profile's watcher
+LOOP_INTERVAL = 1
+
+# Processing pipeline: detection -> stability -> attachment -> capture (serialized) -> OCR/rename
+STABILITY_WORKERS = 4  # Downloads that can be waited on at the same time
+ATTACHMENT_WORKERS = 2  # Attachments decoded and OCR'd in parallel
+RENAME_WORKERS = 2  # Screenshots OCR'd and renamed in parallel
+PIPELINE_QUEUE_SIZE = 10  # Items each stage may queue before blocking the previous one
+PIPELINE_STATUS_INTERVAL = 10  # Seconds between queue depth reports while busy
+
+# Where the transaction fields come from: "attachment" reads the receipt image/PDF itself and
+# uses the chat capture only for SCREENSHOT_FALLBACK_FIELDS it lacks; "screenshot" always uses it
+EXTRACTION_SOURCE = "attachment"
+# Fields taken from the chat screenshot when the attachment does not show them
+# ('date_time' means any date or time); () never captures
+SCREENSHOT_FALLBACK_FIELDS = ('contact_name',)
+
+# JSON file with extra or replacement field rules (see field_rules.py); None uses the defaults
+FIELD_RULES_FILE = None
+# JSON file with Tesseract settings per region, as written by ocr_tuning.py; None uses Tesseract's defaults
+OCR_PROFILES_FILE = None
+
+# What to capture: "regions" (only the OCR regions of the Viber window), "window"
+# (the Viber window) or "full" (the whole screen, as older versions did)
+CAPTURE_MODE = "regions"
+# Where frames come from: "auto" uses the desktop ("win32"), or "replay" when CAPTURE_SOURCE is set
+CAPTURE_BACKEND = "auto"
+# Replay source: a directory of frames or a socket ("tcp://127.0.0.1:8765", "unix:/run/viber.sock")
+# fed by the capture agent (python capture_backend.py DOWNLOAD_FOLDER --send ...)
+CAPTURE_SOURCE = None
+# Shared secret a capture agent must send with every frame (--token); set it before listening beyond 127.0.0.1
+CAPTURE_TOKEN = None
+# Save debug_<region>.png files for each attachment (written in the background)
+SAVE_DEBUG_REGIONS = False
+
 # Output directories
 OUTPUT_DIR = r"C:\Users\Admin\Documents\Viber_Attachments"
 SCREENSHOT_DIR = os.path.join(OUTPUT_DIR, "Screenshots")
+# When OUTPUT_DIR is on another volume (e.g. a mapped network drive) files are copied;
+# compare the copy's hash with the original before the original is deleted
+VERIFY_COPIES = True
+
+# Reference screenshots are written in the background by the archiver
+# PNG is lossless; "webp" at quality 80 is much smaller and still legible,
+# but the exact pixels (and so a bit-identical OCR replay) are lost
+ARCHIVE_FORMAT = "png"  # "png", "webp" or "jpeg"
+ARCHIVE_QUALITY = 80  # WebP/JPEG quality (0-100); PNG uses ARCHIVE_PNG_LEVEL (0-9)
+ARCHIVE_PNG_LEVEL = 6
+ARCHIVE_CROP_TO_REGIONS = True  # Keep only the OCR regions instead of the whole capture
+ARCHIVE_SCALE = 1.0  # e.g. 0.5 stores half-size copies
+ARCHIVE_RETENTION_DAYS = None  # e.g. 90 deletes the archiver's screenshots after 90 days
+ARCHIVE_MAX_MB = None  # e.g. 1024 deletes its oldest screenshots above 1 GB
+
+# Extraction cache: repeated attachments and unchanged conversation views skip OCR
+CACHE_ENABLED = True
+CACHE_MAX_ENTRIES = 512  # Entries kept in memory per cache level
+VIEW_CACHE_TTL = 120  # Seconds an unchanged conversation view may reuse its OCR text
+CACHE_DB_PATH = os.path.join(OUTPUT_DIR, "ocr_cache.sqlite3")  # None keeps the cache in memory only
+
+# Journal of every attachment's state; lets restarts pick up files that arrived while stopped
+JOURNAL_PATH = os.path.join(OUTPUT_DIR, "journal.sqlite3")  # None disables the journal
+
+# Logging: "DEBUG" also logs the OCR text of every region
+LOG_LEVEL = "INFO"
+LOG_FILE = None  # Also write the log to this file
+
+# Metrics in Prometheus text format: rewritten to METRICS_FILE every METRICS_INTERVAL
+# seconds and/or served on http://127.0.0.1:METRICS_PORT/metrics (None disables either)
+METRICS_FILE = os.path.join(OUTPUT_DIR, "metrics.prom")
+METRICS_PORT = None
+METRICS_INTERVAL = 15
+# JSON-lines trace of every timed step (capture, OCR per region, rename, ...); None disables it
+TRACE_FILE = None
+
+_default_profile = None
+
+def default_profile():
+    """Profile made of the settings in this file, used when no PROFILES_FILE is given"""
+    global _default_profile
+    if _default_profile is None:
+        _default_profile = Profile("default", folder_to_watch, OUTPUT_DIR, SCREENSHOT_DIR, VIBER_WINDOW_TITLE,
+                                   extraction_source=EXTRACTION_SOURCE,
+                                   fallback_fields=SCREENSHOT_FALLBACK_FIELDS)
+    return _default_profile
+
+def load_watch_profiles():
+    """Profiles from PROFILES_FILE (unset settings default to the ones in this file), or the default profile"""
+    if not PROFILES_FILE:
+        return [default_profile()]
+    defaults = {'window_title': VIBER_WINDOW_TITLE, 'extraction_source': EXTRACTION_SOURCE,
+                'fallback_fields': SCREENSHOT_FALLBACK_FIELDS}
+    return load_profiles(PROFILES_FILE, defaults)
 
-def ensure_directories_exist():
+def file_profile(path):
+    """Profile watching the folder of path"""
+    return profile_for(path) or default_profile()
+
+def ensure_directories_exist(profile=None):
     """Create necessary directories if they don't exist"""
+    profile = profile or default_profile()
     try:
-        if not os.path.exists(OUTPUT_DIR):
-            os.makedirs(OUTPUT_DIR)
-            print(f"Created output directory: {OUTPUT_DIR}")
+        if not os.path.exists(profile.output_dir):
+            os.makedirs(profile.output_dir)
+            logger.info("Created output directory: %s", profile.output_dir)
             
-        if not os.path.exists(SCREENSHOT_DIR):
-            os.makedirs(SCREENSHOT_DIR)
-            print(f"Created screenshot directory: {SCREENSHOT_DIR}")
+        if not os.path.exists(profile.screenshot_dir):
+            os.makedirs(profile.screenshot_dir)
+            logger.info("Created screenshot directory: %s", profile.screenshot_dir)
     except Exception as e:
-        print(f"Error creating directories: {e}")
+        logger.error("Error creating directories: %s", e)
 
-def bring_viber_to_foreground():
+@metrics.timed("foreground")
+def bring_viber_to_foreground(window_title=None):
     """Find the Viber window and bring it to the foreground in full screen"""
     try:
-        # Find the Viber window by title
-        hwnd = win32gui.FindWindow(None, VIBER_WINDOW_TITLE)
-        
-        if hwnd:
-            # Maximize the window
-            win32gui.ShowWindow(hwnd, win32con.SW_MAXIMIZE)
-            # Bring it to the foreground
-            win32gui.SetForegroundWindow(hwnd)
-            # Give UI time to update
-            time.sleep(0.5)
-            return True
-        else:
-            print("Viber window not found")
-            return False
+        return get_capture_backend().focus(window_title or VIBER_WINDOW_TITLE)
     except Exception as e:
-        print(f"Error bringing Viber to foreground: {e}")
+        logger.error("Error bringing Viber to foreground: %s", e)
         return False
 
-def capture_viber_screenshot():
-    """Capture a screenshot of the Viber window"""
+@metrics.timed("capture")
+def capture_viber_screenshot(name=None, window_title=None, rois=None):
+    """Capture a screenshot of the Viber window (name is the attachment it is taken for)"""
     try:
-        # Take a screenshot of the entire screen
-        screenshot = ImageGrab.grab()
-        return screenshot
+        return get_capture_backend().capture(window_title or VIBER_WINDOW_TITLE, CAPTURE_MODE, name, rois)
     except Exception as e:
-        print(f"Error capturing screenshot: {e}")
+        logger.error("Error capturing screenshot: %s", e)
         return None
 
-def extract_specific_regions(screenshot):
-    """Extract and process specific regions of the screenshot for better OCR accuracy"""
-    try:
-        # Convert PIL image to numpy array for OpenCV
-        screenshot_cv = cv2.cvtColor(np.array(screenshot), cv2.COLOR_RGB2BGR)
-        
-        # Get image dimensions
-        height, width = screenshot_cv.shape[:2]
-        
-        # Define regions of interest (ROIs) based on the screenshots provided
-        # These values are percentages of the total screen size
-        rois = {
-            'header': {
-                'top': 0.08,  # 8% from top
-                'left': 0.4,  # 40% from left
-                'bottom': 0.15,  # 15% from top
-                'right': 0.85  # 85% from left
-            },
-            'transaction_info': {
-                'top': 0.3,  # 30% from top
-                'left': 0.3,  # 30% from left
-                'bottom': 0.7,  # 70% from top
-                'right': 0.85  # 85% from left
-            },
-            'bank_details': {
-                'top': 0.6,  # 60% from top
-                'left': 0.4,  # 40% from left
-                'bottom': 0.9,  # 90% from top
-                'right': 0.9  # 90% from left
-            }
-        }
-        
-        # Extract and OCR each region
-        region_texts = {}
-        for region_name, coords in rois.items():
-            # Calculate pixel coordinates
-            top = int(height * coords['top'])
-            left = int(width * coords['left'])
-            bottom = int(height * coords['bottom'])
-            right = int(width * coords['right'])
-            
-            # Extract region
-            roi = screenshot_cv[top:bottom, left:right]
-            
-            # Save region for debugging if needed
-            region_path = os.path.join(SCREENSHOT_DIR, f"debug_{region_name}.png")
-            cv2.imwrite(region_path, roi)
-            
-            # Process the region for better OCR
-            # Convert to grayscale
-            roi_gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-            
-            # Apply slight blur to reduce noise
-            roi_blur = cv2.GaussianBlur(roi_gray, (3, 3), 0)
-            
-            # Apply adaptive thresholding to enhance text
-            roi_thresh = cv2.adaptiveThreshold(roi_blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                             cv2.THRESH_BINARY, 11, 2)
-            
-            # Perform OCR on the processed region
-            region_text = pytesseract.image_to_string(roi_thresh)
-            region_texts[region_name] = region_text
-            print(f"OCR for {region_name}: {region_text}")
-            
-        return region_texts
-    except Exception as e:
-        print(f"Error extracting regions: {e}")
-        return {}
-
-def extract_info_from_screenshot(screenshot):
-    """Extract contact name, number, and date/time from the screenshot"""
-    try:
-        # First try region-specific extraction for better accuracy
-        region_texts = extract_specific_regions(screenshot)
-        
-        # Combine all region texts for comprehensive search
-        all_text = "\n".join(region_texts.values()) if region_texts else ""
-        
-        # If region extraction failed, fall back to full image OCR
-        if not all_text:
-            # Convert PIL image to cv2 format for processing
-            screenshot_cv = cv2.cvtColor(np.array(screenshot), cv2.COLOR_RGB2BGR)
-            
-            # Convert to grayscale for better OCR results
-            gray = cv2.cvtColor(screenshot_cv, cv2.COLOR_BGR2GRAY)
-            
-            # Use pytesseract to extract all text from the image
-            all_text = pytesseract.image_to_string(gray)
-        
-        print(f"OCR extracted text: {all_text}")  # Debug: print all extracted text
-        
-        # Extract contact info using regex patterns based on the screenshots
-        # Pattern for the contact name (based on the screenshots showing "SoneeHardware JanavareeMagu")
-        contact_name_match = re.search(r"Sonee\w+\s+\w+", all_text)
-        contact_name = contact_name_match.group(0) if contact_name_match else "Unknown"
-        
-        # Extract bank info or account numbers visible in the screenshot (MVR 7701 70007B 001)
-        account_match = re.search(r"MVR\s+\d+\s+\d+\w*\s+\d+|77017000\d+", all_text)
-        account_number = account_match.group(0).replace(' ', '') if account_match else ""
-        
-        # Look for transaction amount (like 1,065.80)
-        amount_match = re.search(r"\d{1,3}(?:,\d{3})*\.\d{2}", all_text)
-        amount = amount_match.group(0).replace(',', '') if amount_match else ""
-        
-        # Pattern for date (Monday, February 24, 2025)
-        date_match = re.search(r"(?:Monday|Tuesday|Wednesday|Thursday|Friday|Saturday|Sunday),\s+(?:January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},\s+\d{4}", all_text)
-        date_str = date_match.group(0) if date_match else ""
-        
-        # Extract time (Last seen today at 4:24 PM)
-        time_match = re.search(r"Last\s+seen\s+today\s+at\s+(\d{1,2}:\d{2}\s+(?:AM|PM))", all_text)
-        time_str = time_match.group(1) if time_match else ""
-        
-        # Look for transaction date (24/02/2025)
-        transaction_date_match = re.search(r"\d{1,2}/\d{1,2}/\d{4}", all_text)
-        transaction_date = transaction_date_match.group(0) if transaction_date_match else ""
-        
-        # Create a properly formatted date/time string
-        if date_str and time_str:
-            date_time = f"{date_str} {time_str}"
-        elif date_str:
-            date_time = date_str
-        elif time_str:
-            date_time = f"Today {time_str}"
-        elif transaction_date:
-            date_time = transaction_date
-        else:
-            date_time = time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())
-            
-        # Extract reference number if present (e.g., BLAZ29Y417504782)
-        ref_match = re.search(r"Reference\s+([A-Z0-9]+)", all_text, re.IGNORECASE)
-        reference = ref_match.group(1) if ref_match else ""
-        
-        # Also look for "successful" transaction confirmation
-        success_match = re.search(r"(SUCCESS|transaction\s+is\s+successful)", all_text, re.IGNORECASE)
-        success_status = "SUCCESS" if success_match else ""
-        
-        # Clean up the extracted information (remove invalid characters for filenames)
-        contact_name = re.sub(r'[<>:"/\\|?*]', '', contact_name).strip()
-        if not contact_name or contact_name == "Unknown":
-            # Try an alternative pattern like looking for "To SONEE" in the transaction details
-            alt_contact_match = re.search(r"To\s+(SONEE\s+\w+)", all_text)
-            if alt_contact_match:
-                contact_name = alt_contact_match.group(1).strip()
-                
-        # Combine account number, amount, reference, and status for a more detailed filename
-        details = []
-        if amount:
-            details.append(f"MVR{amount}")
-        if account_number:
-            details.append(account_number)
-        if reference:
-            details.append(reference)
-        if success_status:
-            details.append(success_status)
-            
-        details_str = "_".join(details) if details else "NoDetails"
-        
-        # Format date_time to be filename friendly
-        date_time = re.sub(r'[<>:"/\\|?*,]', '_', date_time).strip()
-        
-        print(f"Extracted info - Name: {contact_name}, Details: {details_str}, Date: {date_time}")
-        return contact_name, details_str, date_time
-    except Exception as e:
-        print(f"Error extracting info from screenshot: {e}")
-        return "Unknown", "NoDetails", time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime())
+def save_reference_screenshot(screenshot, screenshot_name, profile=None):
+    """ Saves the screenshot next to the renamed files, in the background when the archiver runs """
+    profile = profile or default_profile()
+    archiver = profile.archiver or get_archiver()
+    if archiver:
+        # Cropped, encoded and written in the background so the rename does not wait for it
+        with metrics.span("screenshot_save", file=screenshot_name):
+            archiver.submit(screenshot, screenshot_name)
+        return
 
-def wait_for_final_file(tmp_path):
-    """ Wait until the temporary file is completed and renamed to its final form """
     try:
-        # Remove '_tmp' suffix to form the final expected filename
-        base_name = tmp_path.rstrip('_tmp')
-
-        # Ensure the file exists and keep checking until it's stable
-        start_time = time.time()
-
-        while True:
-            if os.path.exists(base_name):
-                # Check if the file has stopped changing (by checking its modification time)
-                current_mod_time = os.path.getmtime(base_name)
-                time.sleep(WAIT_TIME)  # Wait a little before checking again
-                new_mod_time = os.path.getmtime(base_name)
-                
-                if new_mod_time == current_mod_time:
-                    print(f"Final file found and stable: {base_name}")
-                    # Bring Viber to foreground before renaming
-                    if bring_viber_to_foreground():
-                        screenshot = capture_viber_screenshot()
-                        if screenshot:
-                            # Process the screenshot to get info for renaming
-                            rename_file(base_name, screenshot)
-                        else:
-                            # Fallback to basic rename if screenshot fails
-                            rename_file(base_name)
-                    else:
-                        # Fallback to basic rename if bringing to foreground fails
-                        rename_file(base_name)
-                    break
-                else:
-                    print(f"File still being written: {base_name}")
-            else:
-                # Check if the timeout has passed
-                if time.time() - start_time > TIMEOUT:
-                    print(f"Timeout reached. Final file {base_name} not found.")
-                    break
-
-            # Wait before the next check
-            time.sleep(WAIT_TIME)
+        # Ensure the screenshot directory exists
+        ensure_directories_exist(profile)
+        # Save the screenshot; a name already taken gets a "_2", "_3", ... suffix instead of being overwritten
+        with metrics.span("screenshot_save", file=screenshot_name):
+            with get_placer().create(profile.screenshot_dir, screenshot_name + ".png") as f:
+                screenshot.save(f, format="PNG", pnginfo=frame_pnginfo(screenshot))
+        logger.info("Screenshot saved to: %s", f.name)
     except Exception as e:
-        print(f"Error waiting for file completion: {e}")
+        logger.error("Error saving screenshot: %s", e)
 
-def rename_file(original_path, screenshot=None):
-    """ Renames the file to the desired format using information from screenshot if available """
+def rename_file(original_path, screenshot=None, info=None, digest=None, attachment_fields=None, profile=None):
+    """ Renames the file to the desired format using information from the attachment and/or screenshot """
+    profile = profile or file_profile(original_path)
     filename = os.path.basename(original_path)
-    print(f"Attempting to rename file: {filename}")  # Debugging line
+    logger.debug("Attempting to rename file: %s", filename)
 
-    # Skip files that have already been renamed by checking for timestamp pattern in the filename
-    if "_tmp" in filename or (filename.count("_") >= 2 and re.search(r'\d{4}-\d{2}-\d{2}', filename)):
-        print(f"Skipping file (already processed or temporary): {filename}")
+    # Skip temporary files and files that have already been renamed: the journal knows
+    # for certain, otherwise check for the timestamp pattern in the filename
+    journal = get_journal()
+    if journal:
+        already_processed = journal.is_processed(original_path, digest)
+    else:
+        already_processed = filename.count("_") >= 2 and re.search(r'\d{4}-\d{2}-\d{2}', filename)
+    if is_temporary(original_path) or already_processed:
+        logger.info("Skipping file (already processed or temporary): %s", filename)
+        if not already_processed:
+            journal_update(original_path, STATE_SKIPPED)
+        record_outcome(original_path, "skipped", profile)
         return
 
     # Get file extension
@@ -292,194 +221,471 @@ def rename_file(original_path, screenshot=None):
     # Current timestamp for unique filenames
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     
-    if screenshot:
-        # Extract contact name, number, and date from the screenshot
-        contact_name, details_str, date_time = extract_info_from_screenshot(screenshot)
-        
-        # Format date_time to be filename friendly
-        formatted_date = re.sub(r'[/,\s:]', '_', date_time)
+    if info:
+        # Byte-identical attachment seen before: reuse its extracted details
+        contact_name, details_str, date_time = info
+        new_name = build_new_name(contact_name, details_str, date_time, file_extension)
+    elif screenshot or attachment_fields:
+        # Fields read from the attachment itself win; the screenshot only fills in what it lacked
+        fields = {}
+        if screenshot:
+            required = screenshot_fields_needed(attachment_fields, profile)
+            with metrics.span("extract_info", file=original_path):
+                debug_dir = profile.screenshot_dir if SAVE_DEBUG_REGIONS else None
+                fields = extract_fields_from_screenshot(screenshot, debug_dir, required=required,
+                                                        rois=profile.rois, engine=profile.engine)
+        fields.update(attachment_fields or {})
+        contact_name, details_str, date_time = finish_extraction(fields)
+
+        # Remember the result for byte-identical copies of this attachment
+        attachment_cache = get_attachment_cache()
+        if attachment_cache and digest and contact_name != "Unknown":
+            attachment_cache.put(digest, [contact_name, details_str, date_time])
         
         # Create new filename with extracted information
-        new_name = f"{contact_name}_{details_str}_{formatted_date}{file_extension}"
-        
-        # Save a copy of the screenshot with a similar name for reference
-        screenshot_name = f"{contact_name}_{details_str}_{formatted_date}_screenshot_{timestamp}.png"
-        screenshot_path = os.path.join(SCREENSHOT_DIR, screenshot_name)
-        try:
-            # Ensure the screenshot directory exists
-            ensure_directories_exist()
-            # Save the screenshot
-            screenshot.save(screenshot_path)
-            print(f"Screenshot saved to: {screenshot_path}")
-        except Exception as e:
-            print(f"Error saving screenshot: {e}")
+        new_name = build_new_name(contact_name, details_str, date_time, file_extension)
     else:
         # Fallback to simple renaming logic if no screenshot is available
         name_parts = filename.split('_')
         
+        metrics.counter("fallbacks_total").inc(kind="no_screenshot")
         if len(name_parts) > 1:
             new_name = f"{name_parts[0]}_{name_parts[1]}_{timestamp}{file_extension}"
         else:
             new_name = f"Unknown_Unknown_{timestamp}{file_extension}"
 
     # Define new file path
-    new_path = os.path.join(OUTPUT_DIR, new_name)
+    new_path = os.path.join(profile.output_dir, new_name)
 
     # Check if the file already has the desired name
     if original_path == new_path:
-        print(f"File already has the correct name: {original_path}")
+        logger.info("File already has the correct name: %s", original_path)
+        journal_update(original_path, STATE_SKIPPED, output_path=new_path)
+        record_outcome(original_path, "skipped", profile)
         return
 
     # Ensure the output directory exists
-    ensure_directories_exist()
+    ensure_directories_exist(profile)
 
     # Rename the file
     try:
-        print(f"Renaming file: {original_path} -> {new_path}")
-        os.rename(original_path, new_path)
+        # A name already taken in the output folder gets a "_2", "_3", ... suffix
+        new_path = get_placer().reserve(profile.output_dir, new_name)
+
+        # Record the intended target first so a crash mid-rename can be resolved on restart
+        fields = None
+        if info or screenshot or attachment_fields:
+            fields = {'contact_name': contact_name, 'details': details_str, 'date_time': date_time}
+        journal_update(original_path, STATE_RENAMING, output_path=new_path, fields=fields, digest=digest)
+
+        logger.info("Renaming file: %s -> %s", original_path, new_path)
+        with metrics.span("rename", file=original_path, output=new_path):
+            # An atomic rename, or a verified copy when the output folder is on another volume
+            final_path = get_placer().move(original_path, new_path, digest)
+        journal_update(original_path, STATE_RENAMED, output_path=final_path)
+        outcome = "renamed"
     except PermissionError as e:
-        print(f"Error renaming file: {e}")
+        logger.error("Error renaming file: %s", e)
+        journal_update(original_path, STATE_FAILED, error=str(e))
+        outcome = "failed"
     except Exception as e:
-        print(f"Unexpected error: {e}")
+        logger.error("Unexpected error: %s", e)
+        journal_update(original_path, STATE_FAILED, error=str(e))
+        outcome = "failed"
+
+    # Save a copy of the screenshot named after the attachment's final name (with any "_2" suffix
+    # the placement added), so batch_replay.py pairs each screenshot with exactly one attachment
+    if screenshot and not info:
+        final_name = os.path.basename(final_path) if outcome == "renamed" else new_name
+        screenshot_name = f"{os.path.splitext(final_name)[0]}_screenshot_{timestamp}"
+        save_reference_screenshot(screenshot, screenshot_name, profile)
+
+    elapsed = record_outcome(original_path, outcome, profile)
+    if elapsed is not None:
+        metrics.trace("detect_to_rename", elapsed, file=original_path, outcome=outcome, profile=profile.name)
+
+def record_outcome(key, outcome, profile):
+    """ Ends a download's detect-to-rename timing and counts its outcome for the profile """
+    profile.stats.record(outcome)
+    return metrics.elapsed_since_mark(key, "detect_to_rename", outcome=outcome, profile=profile.name)
+
+def check_file_stability(event):
+    """ Pipeline stage: waits until a detected download is complete and returns its path """
+    if is_temporary(event.path):
+        logger.info("Processing temporary file: %s", event.path)
+    # Returns at once for closed or moved-in files, otherwise when the download stops changing
+    file_path = get_stability_detector().wait(event, pipeline_key(event.path))
+
+    if file_path:
+        stat = os.stat(file_path)
+        journal_update(file_path, STATE_STABLE, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+    else:
+        record_outcome(pipeline_key(event.path), "incomplete", file_profile(event.path))
+    return file_path
+
+def find_previous_extraction(file_path):
+    """ Returns the file's digest and the details extracted from a byte-identical attachment before, if any """
+    digest = None
+    attachment_cache = get_attachment_cache()
+    journal = get_journal()
+    if attachment_cache or journal:
+        digest = file_digest(file_path)
+        info = attachment_cache.get(digest) if attachment_cache else None
+        if not info and journal:
+            # The journal remembers extractions across restarts
+            previous = journal.find_by_digest(digest)
+            if previous and previous['fields']:
+                fields = previous['fields']
+                info = [fields['contact_name'], fields['details'], fields['date_time']]
+        if info:
+            logger.info("Attachment seen before, reusing extracted details: %s", file_path)
+            return digest, info
+    return digest, None
+
+def screenshot_fields_needed(attachment_fields, profile=None):
+    """ Fields the conversation screenshot still has to provide (None means REQUIRED_FIELDS) """
+    profile = profile or default_profile()
+    if attachment_fields is None:
+        return profile.required_fields
+    return missing_fields(attachment_fields, required=profile.fallback_fields)
+
+def capture_wanted(file_path, profile):
+    """ Whether the conversation may be needed: only a readable attachment with no fallback fields never needs it """
+    if profile.extraction_source != "attachment" or not is_supported_attachment(file_path):
+        return True
+    return bool(profile.fallback_fields)
+
+def capture_file_context(file_path):
+    """ Pipeline stage: captures the Viber conversation as soon as the download is complete """
+    logger.info("Processing file: %s", file_path)
+    # A byte-identical attachment (e.g. a re-downloaded receipt) needs no capture or OCR
+    digest, info = find_previous_extraction(file_path)
+
+    # The capture needs the foreground window, so this stage runs on a single worker
+    # shared by every profile: only one Viber window is brought forward at a time.
+    # It runs before the attachment is read so the conversation has no time to scroll
+    # past the download; the screenshot is dropped later if the attachment has every field.
+    profile = file_profile(file_path)
+    screenshot = None
+    if not info and capture_wanted(file_path, profile):
+        if bring_viber_to_foreground(profile.window_title):
+            screenshot = capture_viber_screenshot(frame_name(file_path), profile.window_title, profile.rois)
+    journal_update(file_path, STATE_CAPTURED, digest=digest)
+    return file_path, screenshot, info, digest
+
+def read_attachment(item):
+    """ Pipeline stage: reads the fields from the attachment itself, dropping a screenshot it makes unnecessary """
+    file_path, screenshot, info, digest = item
+    profile = file_profile(file_path)
+    attachment_fields = None
+    if not info and profile.extraction_source == "attachment" and is_supported_attachment(file_path):
+        # Receipts already contain most fields; this runs in parallel, unlike the capture
+        attachment_fields = extract_fields_from_attachment(file_path, profile.engine)
+        if screenshot is not None and screenshot_fields_needed(attachment_fields, profile) == []:
+            logger.info("Attachment has every field, screenshot not needed: %s", file_path)
+            screenshot = None
+    return file_path, screenshot, info, digest, attachment_fields
+
+def ocr_and_rename(item):
+    """ Pipeline stage: extracts the details from the screenshot and renames the file """
+    file_path, screenshot, info, digest, attachment_fields = item
+    if screenshot or info or attachment_fields:
+        rename_file(file_path, screenshot, info, digest, attachment_fields)
+    else:
+        # Fallback to basic rename if the attachment could not be read and the screenshot failed
+        rename_file(file_path)
+    return None
+
+def create_pipeline():
+    """ Builds the detection -> stability -> capture -> attachment -> OCR/rename pipeline """
+    return Pipeline([
+        Stage("stability", check_file_stability, workers=STABILITY_WORKERS, queue_size=PIPELINE_QUEUE_SIZE),
+        Stage("capture", capture_file_context, workers=1, queue_size=PIPELINE_QUEUE_SIZE),
+        Stage("attachment", read_attachment, workers=ATTACHMENT_WORKERS, queue_size=PIPELINE_QUEUE_SIZE),
+        Stage("ocr_rename", ocr_and_rename, workers=RENAME_WORKERS, queue_size=PIPELINE_QUEUE_SIZE),
+    ])
+
+def journal_update(file_path, state, **values):
+    """ Records an attachment's progress in the journal when journaling is enabled """
+    journal = get_journal()
+    if journal:
+        try:
+            journal.update(file_path, state, **values)
+        except Exception as e:
+            logger.error("Error updating journal: %s", e)
+
+def pipeline_key(path):
+    """ Key identifying a download in the pipeline; a temporary file shares it with its final name """
+    if is_temporary(path):
+        return final_path_for(path)
+    return path
+
+def pipeline_collector(pipeline, scheduler=None):
+    """ Returns a metrics collector that publishes the pipeline's queue depths and cache counts """
+    queued = metrics.gauge("pipeline_queue_depth", "Items waiting in front of each pipeline stage")
+    waiting = metrics.gauge("profile_waiting", "Detected downloads waiting for the pipeline, per profile")
+    busy = metrics.gauge("pipeline_busy_workers", "Workers currently handling an item, per stage")
+    in_flight = metrics.gauge("pipeline_in_flight", "Downloads between detection and rename")
+    cache_lookups = metrics.counter("cache_lookups_total", "Extraction cache lookups by level and result")
+
+    def collect():
+        for name, stat in pipeline.stats().items():
+            queued.set(stat['queued'], stage=name)
+            busy.set(stat['busy'], stage=name)
+        in_flight.set(pipeline.in_flight())
+        if scheduler is not None:
+            for name, count in scheduler.pending().items():
+                waiting.set(count, profile=name)
+        for level, stat in cache_stats().items():
+            cache_lookups.set_total(stat['hits'], level=level, result="hit")
+            cache_lookups.set_total(stat['disk_hits'], level=level, result="disk_hit")
+            cache_lookups.set_total(stat['misses'], level=level, result="miss")
+    return collect
+
+def configure_logging():
+    """ Sets up leveled logging to the console and, optionally, LOG_FILE """
+    handlers = [logging.StreamHandler()]
+    if LOG_FILE:
+        handlers.append(logging.FileHandler(LOG_FILE, encoding="utf-8"))
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)-7s [%(threadName)s] %(message)s",
+                        handlers=handlers)
+
+def find_startup_backlog(folder_path):
+    """ Returns files that arrived while the script was stopped or were left in progress by a crash """
+    journal = get_journal()
+    if not journal:
+        return []
+
+    paths = [entry.path for entry in os.scandir(folder_path) if entry.is_file()]
+    if not journal.folder_initialized(folder_path):
+        # First run with a journal: files already in the folder are not processed
+        journal.initialize_folder(folder_path, paths)
+        logger.info("Journal initialized with %d existing files", len(paths))
+        return []
+
+    backlog = []
+    for file_path, state, output_path in journal.in_flight(folder_path):
+        if (state == STATE_RENAMING and output_path and os.path.exists(output_path) and os.path.exists(file_path)
+                and file_digest(output_path) == file_digest(file_path)):
+            # Crashed after a cross-volume copy was in place but before the original was deleted
+            os.remove(file_path)
+            journal.update(file_path, STATE_RENAMED)
+        elif os.path.exists(file_path):
+            logger.info("Resuming file left in state '%s': %s", state, file_path)
+            backlog.append(file_path)
+        elif state == STATE_RENAMING and output_path and os.path.exists(output_path):
+            # Crashed after the rename but before it was recorded
+            journal.update(file_path, STATE_RENAMED)
+        else:
+            journal.update(file_path, STATE_FAILED, error="File disappeared while the script was stopped")
+
+    # Anything the journal has never seen, or saw as a different file with the same
+    # name (size or mtime differ), arrived while the script was stopped
+    resumed = {path_key(file_path) for file_path in backlog}
+    for file_path in journal.new_files(folder_path, paths):
+        if path_key(file_path) not in resumed:
+            logger.info("File arrived while stopped: %s", file_path)
+            journal.record_detected(file_path)
+            backlog.append(file_path)
+    return backlog
 
 def watch_viber_folder(folder_path):
-    """ Monitors the folder for new files and processes them """
-    # Create a dictionary to track files and their status
-    file_tracking = {}
-    
-    # Get the initial list of files in the directory
+    """ Monitors the folder for new files and feeds them into the processing pipeline """
+    profile = default_profile()
+    profile.folder = folder_path
+    watch_profiles([profile])
+
+def watch_profiles(profiles):
+    """ Monitors every profile's folder and feeds new files from all of them into one pipeline """
+    # Existing files produce no events; the journal tells which of them still need processing
+    watchers = []
+    scheduler = FairQueue({profile.name: profile.weight for profile in profiles})
+    waiting = set()  # Keys of the downloads in the scheduler, so repeated events are queued once
     try:
-        for filename in os.listdir(folder_path):
-            file_path = os.path.join(folder_path, filename)
-            file_tracking[file_path] = {
-                'processed': True,  # Mark as processed since they existed before script started
-                'time_detected': time.time(),
-                'size': os.path.getsize(file_path) if os.path.exists(file_path) else 0
-            }
-        print(f"Initialized tracking for {len(file_tracking)} existing files")
+        for profile in profiles:
+            for file_path in find_startup_backlog(profile.folder):
+                metrics.mark(file_path)
+                waiting.add(file_path)
+                scheduler.push(profile.name, (FileEvent(EVENT_CREATED, file_path), True))
+            watchers.append((profile, create_watcher(profile.folder, WATCH_BACKEND)))
     except Exception as e:
-        print(f"Error initializing file tracking: {e}")
-        file_tracking = {}
+        logger.error("Error starting folder watcher: %s", e)
+        for _, watcher in watchers:
+            watcher.close()
+        return
 
-    print(f"Watching folder: {folder_path}")
-    print("Press Ctrl+C to stop the script")
-    
+    configure_profiles(profiles)
+    by_name = {profile.name: profile for profile in profiles}
+    pipeline = create_pipeline()
+    pipeline.start()
+    collector = pipeline_collector(pipeline, scheduler)
+    metrics.REGISTRY.add_collector(collector)
+
+    for profile, watcher in watchers:
+        logger.info("Watching folder: %s (profile %s, using %s backend)", profile.folder, profile.name, watcher.name)
+    logger.info("Press Ctrl+C to stop the script")
+
+    last_status = 0
     try:
         while True:
             try:
-                # Check the folder for new or modified files
-                current_files = set()
-                for filename in os.listdir(folder_path):
-                    file_path = os.path.join(folder_path, filename)
-                    current_files.add(file_path)
-                    
-                    # Skip temporary zero-byte files
-                    if os.path.getsize(file_path) == 0:
+                # Wait for the watchers to report created, closed-after-write or moved files;
+                # the interval is split between them, and skipped while downloads can be fed in
+                timeout = 0 if scheduler and pipeline.has_room() else LOOP_INTERVAL / len(watchers)
+                for profile, watcher in watchers:
+                    for event in watcher.read_events(timeout=timeout):
+                        if not os.path.exists(event.path):
+                            # File was removed or renamed before we could look at it
+                            continue
+                        # A still empty file is a download that has only just started: the
+                        # stability stage waits for it to be written
+                        # Events for a temporary file and its final name refer to the same download
+                        key = pipeline_key(event.path)
+                        # A close or rename completes a download whose stability check is waiting
+                        get_stability_detector().notify(key, event)
+                        if key not in waiting:
+                            metrics.mark(key)
+                            waiting.add(key)
+                            scheduler.push(profile.name, (event, False))
+
+                # Profiles take turns feeding the pipeline, so a burst in one folder does not
+                # hold up the others; what does not fit waits here instead of blocking the loop
+                while pipeline.has_room():
+                    entry = scheduler.pop()
+                    if entry is None:
+                        break
+                    name, (event, resumed) = entry
+                    key = pipeline_key(event.path)
+                    waiting.discard(key)
+                    if resumed:
+                        if pipeline.put(event, key=key):
+                            journal_update(event.path, STATE_DETECTED)
                         continue
-                    
-                    # Check if this is a new file or if the file has been modified
-                    if file_path not in file_tracking:
-                        # New file detected
-                        print(f"New file detected: {file_path}")
-                        file_tracking[file_path] = {
-                            'processed': False,
-                            'time_detected': time.time(),
-                            'size': os.path.getsize(file_path)
-                        }
-                    else:
-                        # Check if the file has changed size and was previously processed
-                        current_size = os.path.getsize(file_path)
-                        if current_size != file_tracking[file_path]['size'] and file_tracking[file_path]['processed']:
-                            print(f"File modified: {file_path}")
-                            file_tracking[file_path] = {
-                                'processed': False, 
-                                'time_detected': time.time(),
-                                'size': current_size
-                            }
-                
-                # Process any unprocessed files
-                for file_path, status in file_tracking.items():
-                    if not status['processed'] and os.path.exists(file_path):
-                        try:
-                            filename = os.path.basename(file_path)
-                            
-                            # Check if file has stabilized (size hasn't changed for a few seconds)
-                            current_size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
-                            if current_size != status['size']:
-                                # File is still being written, update size and skip for now
-                                file_tracking[file_path]['size'] = current_size
-                                continue
-                                
-                            # Process different file types
-                            if "_tmp" in filename:
-                                print(f"Processing temporary file: {file_path}")
-                                wait_for_final_file(file_path)
-                            else:
-                                print(f"Processing file: {file_path}")
-                                # For non-temporary files, bring Viber to foreground and take screenshot
-                                if bring_viber_to_foreground():
-                                    screenshot = capture_viber_screenshot()
-                                    if screenshot:
-                                        rename_file(file_path, screenshot)
-                                    else:
-                                        rename_file(file_path)
-                                else:
-                                    rename_file(file_path)
-                            
-                            # Mark as processed
-                            file_tracking[file_path]['processed'] = True
-                            
-                        except Exception as e:
-                            print(f"Error processing file {file_path}: {e}")
-                            # If we encountered an error, wait longer before retrying
-                            time.sleep(2)
-                
-                # Remove tracking for files that no longer exist
-                missing_files = [f for f in file_tracking if f not in current_files]
-                for file_path in missing_files:
-                    print(f"File no longer exists, removing from tracking: {file_path}")
-                    del file_tracking[file_path]
-                
-                # Sleep a bit before checking again
-                time.sleep(2)
+
+                    if pipeline.put(event, key=key):
+                        logger.info("New file detected: %s", event.path)
+                        by_name[name].stats.record_detected()
+                        journal = get_journal()
+                        if journal:
+                            journal.record_detected(key)
+
+                # Report queue depths while there is work in flight
+                if (pipeline.in_flight() or scheduler) and time.time() - last_status >= PIPELINE_STATUS_INTERVAL:
+                    logger.info(pipeline.format_status())
+                    logger.info(format_profile_stats(profiles, scheduler.pending()))
+                    logger.info(format_cache_stats())
+                    last_status = time.time()
                 
             except Exception as e:
-                print(f"Error in main watch loop: {e}")
+                logger.error("Error in main watch loop: %s", e)
                 time.sleep(5)  # Sleep longer after errors
     
     except KeyboardInterrupt:
-        print("\nScript stopped by user")
+        logger.info("Script stopped by user")
     except Exception as e:
-        print(f"Fatal error: {e}")
+        logger.critical("Fatal error: %s", e)
     finally:
-        print("Exiting file watch")
+        for _, watcher in watchers:
+            watcher.close()
+        logger.info("Waiting for files in progress to finish...")
+        pipeline.stop(timeout=TIMEOUT)
+        metrics.REGISTRY.remove_collector(collector)
+        logger.info(format_profile_stats(profiles))
+        logger.info(format_cache_stats())
+        logger.info("Exiting file watch")
 
 # Folder to watch for new Viber downloads
 folder_to_watch = r"C:\Users\Admin\Documents\ViberDownloads"
 
 if __name__ == "__main__":
-    print("Starting Viber file renaming script with screenshot capability...")
+    configure_logging()
+    logger.info("Starting Viber file renaming script with screenshot capability...")
+
+    # Folders to watch, each with its own output folders, window, regions and rules
+    try:
+        profiles = load_watch_profiles()
+    except (OSError, ValueError, KeyError) as e:
+        logger.error("Error reading profiles file %s: %s", PROFILES_FILE, e)
+        exit(1)
     
     # Create necessary directories
-    ensure_directories_exist()
+    for profile in profiles:
+        ensure_directories_exist(profile)
     
-    # Check if required libraries are available
+    # Optional libraries are imported as each component is configured; a missing one stops the script here
     try:
-        import pyautogui
-        import win32gui
-        import pytesseract
-        from PIL import ImageGrab
-        import cv2
-        print("All required libraries loaded successfully.")
-        
         # Notify user about Tesseract OCR configuration
-        print("Note: Make sure Tesseract OCR is installed and the path is correctly set in the script.")
-        print(f"Current Tesseract path: {pytesseract.pytesseract.tesseract_cmd}")
+        logger.info("Note: Make sure Tesseract OCR is installed and the path is correctly set in the script.")
+        logger.info("Current Tesseract path: %s", TESSERACT_CMD)
+        set_tesseract_cmd(TESSERACT_CMD)
+
+        # Window control and capture: the desktop, or frames replayed from a capture agent
+        try:
+            backend = configure_capture(CAPTURE_BACKEND, CAPTURE_SOURCE, token=CAPTURE_TOKEN)
+        except (ImportError, RuntimeError, OSError) as e:
+            logger.error("Cannot capture the Viber window - %s", e)
+            logger.error("Install pywin32 on Windows, or set CAPTURE_SOURCE to replay frames from a capture agent")
+            exit(1)
+        logger.info("Capturing frames with the %s backend", backend.name)
+
+        # Verified copies when the output folder is on another volume
+        configure_placement(verify=VERIFY_COPIES)
+
+        # Downloads are complete on close/rename events, or after a quiet period when polled
+        configure_stability(quiet_period=STABILITY_QUIET_PERIOD, max_poll=STABILITY_MAX_POLL,
+                            stall_timeout=TIMEOUT)
+
+        # Compile the field rules once; a broken rules file stops the script here
+        try:
+            configure_rules(path=FIELD_RULES_FILE)
+        except (OSError, ValueError) as e:
+            logger.error("Error reading field rules file %s: %s", FIELD_RULES_FILE, e)
+            exit(1)
+
+        # Tesseract settings per region; a broken profiles file stops the script here
+        try:
+            configure_ocr_profiles(path=OCR_PROFILES_FILE)
+        except (OSError, ValueError) as e:
+            logger.error("Error reading OCR profiles file %s: %s", OCR_PROFILES_FILE, e)
+            exit(1)
+
+        # Start the OCR workers once so the language model stays loaded
+        configure_pool(size=OCR_POOL_SIZE, timeout=OCR_TIMEOUT, engine=OCR_ENGINE)
+
+        # Journal of processed attachments for instant, idempotent restarts
+        open_journal(JOURNAL_PATH)
+
+        # Reuse extractions for repeated attachments and unchanged conversation views
+        configure_caches(enabled=CACHE_ENABLED, max_entries=CACHE_MAX_ENTRIES, view_ttl=VIEW_CACHE_TTL,
+                         db_path=CACHE_DB_PATH)
+
+        # Reference screenshots are saved off the critical path, into each profile's own folder
+        for profile in profiles:
+            profile.archiver = ScreenshotArchiver(
+                profile.screenshot_dir, image_format=ARCHIVE_FORMAT, quality=ARCHIVE_QUALITY,
+                png_compress_level=ARCHIVE_PNG_LEVEL, crop_to_regions=ARCHIVE_CROP_TO_REGIONS,
+                scale=ARCHIVE_SCALE, retention_days=ARCHIVE_RETENTION_DAYS, max_mb=ARCHIVE_MAX_MB,
+                rois=profile.rois)
+
+        # Prometheus metrics and JSON-lines traces of every processing step
+        metrics.configure_tracing(TRACE_FILE)
+        metrics.start_exporter(METRICS_FILE, METRICS_PORT, interval=METRICS_INTERVAL)
         
     except ImportError as e:
-        print(f"Error: Missing required library - {e}")
-        print("Please install missing libraries using pip:")
-        print("pip install pyautogui pywin32 pytesseract pillow opencv-python")
+        logger.error("Missing required library - %s", e)
+        logger.error("Please install missing libraries using pip:")
+        logger.error("pip install pywin32 pytesseract pillow opencv-python")
         exit(1)
         
-    watch_viber_folder(folder_to_watch)
+    try:
+        # One event loop, OCR pool and capture stage serve every profile
+        watch_profiles(profiles)
+    finally:
+        for profile in profiles:
+            if profile.archiver:
+                profile.archiver.close(timeout=TIMEOUT)
+        close_capture()
+        shutdown_pool()
+        close_journal()
+        metrics.stop_exporter()
+        metrics.configure_tracing(None)